@@ -1,11 +1,61 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import openpyxl
 import os
 import io
+import time as time_mod
+import functools
+import threading
+import cProfile
+import json
+import queue
+import atexit
+import hashlib
+import zipfile
+import sqlite3
+import re
+import hmac
+import secrets
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from datetime import datetime, timedelta, time
 
+try:
+    import fitparse  # Opcional: lectura de archivos .fit de pulsómetros
+except ImportError:
+    fitparse = None
+
+try:
+    import pyarrow as pa  # Opcional: caché columnar (Arrow IPC) de los XLSX
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+try:
+    import python_calamine  # Opcional: lector XLSX en Rust, mucho más rápido que openpyxl
+    MOTOR_EXCEL = 'calamine'
+except ImportError:
+    MOTOR_EXCEL = 'openpyxl'
+
+try:
+    import duckdb  # Opcional: motor SQL columnar y vectorizado para la consola de consultas
+    MOTOR_SQL = 'duckdb'
+except ImportError:
+    duckdb = None
+    MOTOR_SQL = 'sqlite'
+
+try:
+    import qrcode  # Opcional: imagen PNG de los códigos QR de asistencia
+except ImportError:
+    qrcode = None
+
+logger = logging.getLogger(__name__)
+
 # --- 1. CONFIGURACIÓN INICIAL DE ARCHIVOS Y FUNCIONES DE CÁLCULO ---
 
 # Archivo 1: Atletas y Marcas
@@ -22,6 +72,11 @@ PRUEBAS_FILE = 'pruebas_activas.xlsx'
 # Archivo 4: Perfiles de Atletas
 PERFILES_FILE = 'perfiles.xlsx'
 
+# Columnas de zonas personalizadas dentro del perfil
+PERFIL_ZONAS_COLUMNAS = ['FC_Max_Medida', 'FC_Reposo', 'Modelo_Zonas']
+MODELOS_ZONAS = ['% FC Máx', 'Karvonen (FCR)']
+FC_REPOSO_POR_DEFECTO = 60
+
 # Archivo 5: Ranking
 RANKING_FILE = 'ranking.xlsx'
 RANKING_REQUIRED_COLUMNS = ['Posicion', 'Atleta', 'Categoria', 'Oros', 'Platas', 'Bronces']
@@ -30,9 +85,466 @@ RANKING_REQUIRED_COLUMNS = ['Posicion', 'Atleta', 'Categoria', 'Oros', 'Platas',
 READINESS_FILE = 'readiness_data.xlsx'
 READINESS_REQUIRED_COLUMNS = ['Atleta', 'Fecha', 'Sueño', 'Molestias', 'Disposicion']
 
+# Equipos (multi-club): cada equipo guarda sus archivos en su propia carpeta.
+# El equipo por defecto usa los archivos de la raíz para mantener la compatibilidad.
+EQUIPOS_FILE = 'equipos.xlsx'
+EQUIPOS_DIR = 'equipos'
+EQUIPO_POR_DEFECTO = 'Principal'
+
+# Archivo 7: Bitácora de auditoría (append-only, una entrada JSON por guardado)
+AUDIT_LOG_FILE = 'auditoria_log.jsonl'
+AUDIT_BATCH_SIZE = 50       # Entradas máximas por escritura
+AUDIT_FLUSH_SECONDS = 2.0   # Espera máxima antes de volcar un lote incompleto
+AUDIT_COLUMNAS_EXCLUIDAS = ('Contraseña',)  # Nunca se escriben en la bitácora
+
+# Archivo 8: Resultados de pruebas de VAM / Cooper / 5K (append-only)
+VAM_FILE = 'pruebas_vam.xlsx'
+VAM_REQUIRED_COLUMNS = ['Atleta', 'Fecha', 'Tipo', 'Distancia_m', 'Tiempo_s', 'VAM_kmh']
+# Fracción de la VAM que se sostiene en cada prueba: VAM = velocidad media / fracción
+TIPOS_PRUEBA_VAM = {'Test VAM (pista)': 1.00, 'Cooper (12 min)': 1.00, '5K': 0.93}
+RIEGEL_EXPONENTE = 1.06
+DISTANCIAS_PREDICCION_M = {'1500 m': 1500, '3 km': 3000, '5 km': 5000, '10 km': 10000, 'Media Maratón': 21097.5, 'Maratón': 42195}
+
+# Archivo 9: Registro diario de peso corporal (append-only)
+PESAJES_FILE = 'pesajes.xlsx'
+PESAJES_REQUIRED_COLUMNS = ['Atleta', 'Fecha', 'Peso_kg']
+PESO_EWMA_ALFA = 0.1     # Suavizado exponencial del peso de tendencia
+KCAL_POR_KG = 7700       # Energía aproximada de 1 kg de masa corporal
+FACTORES_ACTIVIDAD = {
+    "Sedentario (poco o ningún ejercicio)": 1.2,
+    "Ligero (ejercicio 1-3 días/sem)": 1.375,
+    "Moderado (ejercicio 3-5 días/sem)": 1.55,
+    "Alto (ejercicio 6-7 días/sem)": 1.725,
+    "Muy Alto (entrenamientos 2 veces/día)": 1.9
+}
+OBJETIVOS_PESO = {
+    "Mantenimiento": 0,
+    "Definición (Bajar peso)": -500,
+    "Volumen (Subir peso)": 500
+}
+
+# Planificador de corte de peso: eventos del calendario que cuentan como competición
+PALABRAS_COMPETENCIA = ['competencia', 'competición', 'torneo', 'campeonato', 'copa', 'open', 'combate', 'nacional', 'selectivo']
+CORTE_SEGURO_PCT_SEM = 1.0   # % del peso corporal por semana considerado seguro
+CORTE_MAX_PCT_SEM = 1.5      # Por encima de este ritmo el corte se marca como no seguro
+
+# Archivo 10: Plantillas de periodización (bloques, semanas, series x reps @ %RM o RIR)
+PLANTILLAS_FILE = 'plantillas_programa.xlsx'
+PLANTILLAS_REQUIRED_COLUMNS = ['Plantilla', 'Bloque', 'Semana', 'Dia', 'Ejercicio', 'Series', 'Reps', 'Tipo_Intensidad', 'Intensidad']
+TIPOS_INTENSIDAD = ['%RM', 'RIR']
+PLACAS_DISPONIBLES = [25.0, 20.0, 15.0, 10.0, 5.0, 2.5, 1.25, 0.5]
+
+# Archivo 11: Registro de series (append-only, CSV para que crezca sin reescrituras)
+SERIES_LOG_FILE = 'registro_series.csv'
+SERIES_COLUMNS = ['Fecha', 'Atleta', 'Ejercicio', 'Carga_kg', 'Reps', 'RIR']
+SERIES_CHUNK_FILAS = 200000     # Filas por bloque al agregar el registro
+E1RM_VENTANA_DIAS = 42          # Mejor e1RM de las últimas 6 semanas
+E1RM_UMBRAL_PROPUESTA = 0.025   # Diferencia relativa e1RM vs RM para proponer una actualización
+
+# Archivo 12: Repeticiones VBT importadas de encoders (append-only)
+VBT_LOG_FILE = 'vbt_repeticiones.csv'
+VBT_COLUMNS = ['Fecha', 'Atleta', 'Ejercicio', 'Carga_kg', 'Velocidad_ms']
+VBT_ALIAS_COLUMNAS = {
+    'Fecha': ['fecha', 'date', 'timestamp', 'time'],
+    'Atleta': ['atleta', 'athlete', 'nombre', 'name', 'user'],
+    'Ejercicio': ['ejercicio', 'exercise', 'movimiento', 'lift'],
+    'Carga_kg': ['carga_kg', 'carga', 'load', 'weight', 'peso', 'kg', 'load (kg)'],
+    'Velocidad_ms': ['velocidad_ms', 'velocidad', 'velocidad media', 'mean velocity', 'mv', 'vmp', 'mpv', 'velocity', 'avg velocity', 'mean velocity (m/s)'],
+}
+# Velocidad mínima (m/s) a la que se alcanza la 1RM en cada ejercicio
+VBT_MVT = {'Sentadilla': 0.30, 'Press Banca': 0.17, 'Peso Muerto': 0.15}
+VBT_MVT_POR_DEFECTO = 0.30
+
+# Archivo 13: Asistencia (append-only). Una fila por atleta y sesión; el QR de cada atleta se deriva de su ID
+ASISTENCIA_LOG_FILE = 'asistencia.csv'
+ASISTENCIA_COLUMNS = ['Marca', 'Fecha', 'Sesion', 'ID', 'Atleta']
+ASISTENCIA_SESION_POR_DEFECTO = 'Entrenamiento'
+ASISTENCIA_BATCH_SIZE = 100     # Check-ins máximos por escritura
+ASISTENCIA_FLUSH_SECONDS = 1.0  # Espera máxima antes de volcar un lote incompleto
+QR_SECRETO_FILE = '.qr_secreto'  # Clave con la que se firman los QR (se genera en el primer uso)
+
+# Archivo 14: Registro de lesiones y molestias (región corporal, severidad 1-5, inicio y estado)
+LESIONES_FILE = 'lesiones.xlsx'
+LESIONES_REQUIRED_COLUMNS = ['Atleta', 'Region', 'Severidad', 'Inicio', 'Estado', 'Notas']
+REGIONES_CORPORALES = [
+    'Cabeza/Cuello', 'Hombro', 'Codo/Antebrazo', 'Muñeca/Mano', 'Espalda alta', 'Zona lumbar',
+    'Cadera/Ingle', 'Isquiotibiales', 'Cuádriceps', 'Rodilla', 'Gemelo/Pierna', 'Tobillo/Pie',
+]
+ESTADOS_LESION = ['Activa', 'En recuperación', 'Alta']
+# Señales de riesgo (todo el equipo): racha de molestias altas, caída del readiness y pico de carga (ACWR)
+RIESGO_MOLESTIAS_ALTAS = 4     # Molestias >= 4 (1=ninguna, 5=severa) cuentan para la racha
+RIESGO_RACHA_MOLESTIAS = 3     # Check-ins seguidos con molestias altas que activan la señal
+RIESGO_CAIDA_SRD = 0.75        # Caída del SRD frente a su línea base de 28 días
+RIESGO_ACWR_MAX = 1.5          # Carga aguda (7 días) / crónica (media semanal de 28 días)
+RIESGO_VIGENCIA_DIAS = 7       # Un check-in más antiguo no genera señales de readiness
+
+# Autorregulación por readiness: política por equipo (JSON) y ventana de la línea base
+POLITICA_FILE = 'politica_autorregulacion.json'
+READINESS_VENTANA_BASE = '28D'
+POLITICA_POR_DEFECTO = {
+    'umbral_optimo': 4.0,        # SRD >= umbral: carga prescrita sin cambios
+    'umbral_bajo': 3.0,          # SRD < umbral: estado bajo
+    'ajuste_adecuado_pct': -2.5, # % de carga entre ambos umbrales
+    'ajuste_bajo_pct': -5.0,     # % de carga en estado bajo
+    'rir_extra_bajo': 1,         # RIR adicional en estado bajo
+    'caida_base': 0.75,          # Caída del SRD frente a la línea base que aplica un ajuste extra
+    'ajuste_caida_pct': -2.5,
+}
+
+# Tareas programadas en segundo plano (hora local de cada ejecución diaria)
+TAREAS_HORARIO = {
+    'agregados': time(2, 30),     # e1RM del registro de series, perfiles VBT y readiness
+    'instantanea': time(3, 0),    # Copia comprimida de los archivos de datos y compactación
+    'vistas': time(5, 30),        # Ranking y próximos eventos materializados
+    'precalentar': time(6, 0),    # Loaders en caché antes del pico de la mañana
+}
+TAREAS_INTERVALO_S = 60          # Cada cuánto revisa el planificador si hay tareas pendientes
+SNAPSHOTS_DIR = 'instantaneas'
+SNAPSHOTS_RETENCION = 14         # Instantáneas diarias que se conservan por equipo
+EVENTOS_DIAS_AVISO = 5           # Un evento es inminente si faltan entre 0 y 5 días
+
+# Simulación Monte Carlo del ranking (temporadas, tamaño de lote y semilla por defecto)
+MC_TEMPORADAS = 100000
+MC_LOTE = 10000
+MC_SEMILLA = 2024
+MC_PRIOR_COMPETENCIAS = 2.0   # Peso (en competiciones) de la media de la categoría al estimar probabilidades
+
+# Optimizador de inscripciones por categoría
+PUNTOS_MEDALLA = np.array([10.0, 3.0, 1.0])   # Oro, Plata, Bronce (igual que calculate_and_sort_ranking)
+INSCRIPCION_CUPOS_POR_DEFECTO = 3
+
 # RUTA DEL LOGO
 LOGO_PATH = 'logo.png' 
 
+# Instrumentación de rendimiento
+PERF_VENTANA = 500  # Nº de mediciones recientes que se guardan por etiqueta (histograma móvil)
+PERF_PROFILES_DIR = 'perf_profiles'  # Carpeta donde se vuelcan los perfiles cProfile por recarga
+
+# Caché columnar: copia Arrow de cada XLSX parseado, junto al archivo y con el hash del origen en el nombre
+COLUMNAR_DIR = '.columnar'
+
+# Carga en frío: nº máximo de libros que se parsean a la vez
+CARGA_MAX_HILOS = 6
+
+# Bus de cambios entre sesiones: cada cuánto se revisan los archivos y si se fuerza la recarga de las sesiones abiertas
+BUS_INTERVALO_S = 1.0
+BUS_RECARGA_SESIONES = True
+# Una sesión se recarga como mucho una vez cada BUS_RECARGA_MIN_S (los cambios se acumulan) y nunca si se ejecutó hace menos
+BUS_RECARGA_MIN_S = 10.0
+# Datasets que muestran datos de otros atletas en las vistas del atleta (el resto solo se recarga en sesiones de entrenador)
+DATASETS_VISTA_ATLETA = ['atletas', 'calendario', 'pruebas', 'ranking', 'plantillas']
+
+# Consola SQL: límites por consulta y columnas que nunca se exponen
+SQL_MAX_FILAS = 50000
+SQL_TIEMPO_MAX_S = 15
+SQL_COLUMNAS_OCULTAS = {'atletas': ['Contraseña']}
+
+# Calidad de datos: esquema declarativo por dataset (tipo, rango, valores permitidos, unicidad, atípicos y saltos por atleta).
+# Los saltos se miden contra la mediana de los 3 registros previos del atleta ('serie') o contra la versión anterior del archivo ('clave').
+CALIDAD_Z_ATIPICO = 4.0     # |z robusto| (mediana/MAD) a partir del cual un valor se marca como atípico
+CALIDAD_MIN_MUESTRA = 5     # Valores mínimos en la columna para buscar atípicos
+ESQUEMAS_DATASET = {
+    'atletas': {
+        'columnas': {
+            'ID': {'requerida': True},
+            'Atleta': {'requerida': True},
+            'Rol': {'valores': ['Atleta', 'Entrenador']},
+            'Sentadilla_RM': {'tipo': 'numero', 'min': 0, 'max': 500, 'atipicos': True},
+            'PressBanca_RM': {'tipo': 'numero', 'min': 0, 'max': 350, 'atipicos': True},
+            'PesoCorporal': {'tipo': 'numero', 'min': 30, 'max': 250, 'atipicos': True},
+            'Última_Fecha': {'tipo': 'fecha'},
+        },
+        'unicas': ['ID', 'Atleta'],
+        'saltos': {'clave': 'ID', 'columnas': {'Sentadilla_RM': 0.25, 'PressBanca_RM': 0.25, 'PesoCorporal': 0.10}},
+    },
+    'calendario': {
+        'columnas': {'Evento': {'requerida': True}, 'Fecha': {'tipo': 'fecha', 'requerida': True}},
+        'unicas': [['Evento', 'Fecha']],
+    },
+    'perfiles': {
+        'columnas': {
+            'Atleta': {'requerida': True},
+            'Edad': {'tipo': 'numero', 'min': 8, 'max': 90},
+            'Altura_cm': {'tipo': 'numero', 'min': 120, 'max': 230},
+            'FC_Max_Medida': {'tipo': 'numero', 'min': 120, 'max': 230},
+            'FC_Reposo': {'tipo': 'numero', 'min': 30, 'max': 110},
+            'Modelo_Zonas': {'valores': MODELOS_ZONAS},
+        },
+        'unicas': ['Atleta'],
+    },
+    'ranking': {
+        'columnas': {
+            'Atleta': {'requerida': True},
+            'Oros': {'tipo': 'numero', 'min': 0, 'max': 500},
+            'Platas': {'tipo': 'numero', 'min': 0, 'max': 500},
+            'Bronces': {'tipo': 'numero', 'min': 0, 'max': 500},
+        },
+        'unicas': ['Atleta'],
+    },
+    'readiness': {
+        'columnas': {
+            'Atleta': {'requerida': True},
+            'Fecha': {'tipo': 'fecha', 'requerida': True},
+            'Sueño': {'tipo': 'numero', 'min': 1, 'max': 5},
+            'Molestias': {'tipo': 'numero', 'min': 1, 'max': 5},
+            'Disposicion': {'tipo': 'numero', 'min': 1, 'max': 5},
+        },
+    },
+    'vam': {
+        'columnas': {
+            'Atleta': {'requerida': True},
+            'Fecha': {'tipo': 'fecha', 'requerida': True},
+            'Tipo': {'valores': list(TIPOS_PRUEBA_VAM)},
+            'Distancia_m': {'tipo': 'numero', 'min': 100, 'max': 50000},
+            'Tiempo_s': {'tipo': 'numero', 'min': 30, 'max': 20000},
+            'VAM_kmh': {'tipo': 'numero', 'min': 5, 'max': 30, 'atipicos': True},
+        },
+        'saltos': {'serie': 'Atleta', 'orden': 'Fecha', 'columnas': {'VAM_kmh': 0.20}},
+    },
+    'pesajes': {
+        'columnas': {
+            'Atleta': {'requerida': True},
+            'Fecha': {'tipo': 'fecha', 'requerida': True},
+            'Peso_kg': {'tipo': 'numero', 'min': 30, 'max': 250},
+        },
+        'saltos': {'serie': 'Atleta', 'orden': 'Fecha', 'columnas': {'Peso_kg': 0.06}},
+    },
+    'plantillas': {
+        'columnas': {
+            'Plantilla': {'requerida': True},
+            'Ejercicio': {'requerida': True},
+            'Semana': {'tipo': 'numero', 'min': 1, 'max': 52},
+            'Dia': {'tipo': 'numero', 'min': 1, 'max': 7},
+            'Series': {'tipo': 'numero', 'min': 1, 'max': 20},
+            'Reps': {'tipo': 'numero', 'min': 1, 'max': 50},
+            'Tipo_Intensidad': {'valores': TIPOS_INTENSIDAD},
+            'Intensidad': {'tipo': 'numero', 'min': 0, 'max': 100},
+        },
+    },
+    'lesiones': {
+        'columnas': {
+            'Atleta': {'requerida': True},
+            'Region': {'requerida': True, 'valores': REGIONES_CORPORALES},
+            'Severidad': {'tipo': 'numero', 'min': 1, 'max': 5},
+            'Inicio': {'tipo': 'fecha', 'requerida': True},
+            'Estado': {'valores': ESTADOS_LESION},
+        },
+    },
+}
+
+# --- INSTRUMENTACIÓN DE RENDIMIENTO (LATENCIAS, CACHÉ Y PERFILADO) ---
+
+@st.cache_resource
+def get_perf_registry():
+    """Registro compartido por todas las sesiones con latencias recientes y contadores de caché."""
+    return {
+        'lock': threading.Lock(),
+        'latencias': defaultdict(lambda: deque(maxlen=PERF_VENTANA)),
+        'llamadas': defaultdict(int),
+        'misses': defaultdict(int),
+    }
+
+def registrar_latencia(etiqueta, segundos):
+    """Guarda una medición (en ms) en la ventana móvil de la etiqueta."""
+    registro = get_perf_registry()
+    with registro['lock']:
+        registro['latencias'][etiqueta].append(segundos * 1000)
+
+@contextmanager
+def medir_tiempo(etiqueta):
+    """Context manager que mide el bloque y lo registra bajo 'etiqueta'."""
+    inicio = time_mod.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_latencia(etiqueta, time_mod.perf_counter() - inicio)
+
+def registrar_cache_miss(nombre):
+    """Se llama al inicio de una función cacheada: su cuerpo solo se ejecuta cuando la caché falla."""
+    registro = get_perf_registry()
+    with registro['lock']:
+        registro['misses'][nombre] += 1
+
+def instrumentar(nombre):
+    """Decorador que cuenta llamadas y mide la latencia de loaders y savers (conserva '.clear()' de la caché)."""
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            registro = get_perf_registry()
+            with registro['lock']:
+                registro['llamadas'][nombre] += 1
+            with medir_tiempo(nombre):
+                return func(*args, **kwargs)
+        if hasattr(func, 'clear'):
+            envoltura.clear = func.clear
+        return envoltura
+    return decorador
+
+def hash_archivo(ruta):
+    """Hash corto (blake2b) del contenido de un archivo."""
+    with open(ruta, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+def ruta_columnar(ruta, hash_origen):
+    """Ruta del sidecar Arrow de un XLSX para una versión concreta de su contenido."""
+    carpeta = os.path.join(os.path.dirname(ruta) or '.', COLUMNAR_DIR)
+    return os.path.join(carpeta, f"{os.path.basename(ruta)}.{hash_origen}.arrow")
+
+def escribir_columnar(df, ruta, hash_origen):
+    """Guarda el DataFrame parseado como Arrow IPC sin comprimir (mapeable en memoria) y borra las versiones anteriores."""
+    destino = ruta_columnar(ruta, hash_origen)
+    carpeta = os.path.dirname(destino)
+    os.makedirs(carpeta, exist_ok=True)
+    try:
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        # Columnas con tipos mezclados: se sigue leyendo el XLSX
+        logger.warning("No se pudo crear la caché columnar de '%s': %s", ruta, e)
+        return
+    temporal = f"{destino}.{threading.get_ident()}.tmp"
+    with pa.OSFile(temporal, 'wb') as f, pa.ipc.new_file(f, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    os.replace(temporal, destino)
+
+    prefijo = f"{os.path.basename(ruta)}."
+    for nombre in os.listdir(carpeta):
+        if nombre.startswith(prefijo) and nombre.endswith('.arrow') and os.path.join(carpeta, nombre) != destino:
+            try:
+                os.remove(os.path.join(carpeta, nombre))
+            except OSError:
+                pass
+
+def leer_excel(ruta):
+    """Lee un XLSX desde su sidecar Arrow si el hash coincide; si no, lo parsea (calamine u openpyxl) y crea el sidecar."""
+    nombre = os.path.basename(ruta)
+    if pa is not None:
+        hash_origen = hash_archivo(ruta)
+        sidecar = ruta_columnar(ruta, hash_origen)
+        if os.path.exists(sidecar):
+            try:
+                with medir_tiempo(f"read_arrow.{nombre}"):
+                    return pa.ipc.open_file(pa.memory_map(sidecar, 'r')).read_all().to_pandas()
+            except (OSError, pa.ArrowInvalid) as e:
+                logger.warning("Caché columnar inválida '%s', se vuelve a parsear el XLSX: %s", sidecar, e)
+
+    with medir_tiempo(f"read_excel.{nombre}"):
+        df = pd.read_excel(ruta, engine=MOTOR_EXCEL)
+    if pa is not None:
+        try:
+            escribir_columnar(df, ruta, hash_origen)
+        except OSError as e:
+            logger.warning("No se pudo escribir la caché columnar de '%s': %s", ruta, e)
+    return df
+
+@st.cache_resource
+def get_bloqueos_archivo():
+    """Un lock (reentrante) por archivo de datos, compartido por las sesiones y las tareas programadas."""
+    return {'lock': threading.Lock(), 'rutas': {}}
+
+def bloqueo_archivo(ruta):
+    """Lock de escritura de un archivo: lo toman los guardados y la compactación nocturna (lectura + reescritura)."""
+    bloqueos = get_bloqueos_archivo()
+    with bloqueos['lock']:
+        return bloqueos['rutas'].setdefault(os.path.abspath(ruta), threading.RLock())
+
+def escribir_excel(df, ruta):
+    """Escribe un DataFrame en XLSX con openpyxl, midiendo el tiempo de escritura."""
+    with bloqueo_archivo(ruta), medir_tiempo(f"to_excel.{os.path.basename(ruta)}"):
+        df.to_excel(ruta, index=False, engine='openpyxl')
+
+def iniciar_perfilado():
+    """Activa cProfile para esta recarga si el entrenador lo habilitó en el panel de rendimiento."""
+    if not st.session_state.get('perf_profile_activo'):
+        return None
+    perfilador = cProfile.Profile()
+    try:
+        perfilador.enable()
+    except ValueError:
+        # Otro perfilador ya está activo en el proceso (Python 3.12+ solo admite uno).
+        return None
+    return perfilador
+
+def finalizar_perfilado(perfilador, usuario):
+    """Detiene cProfile y vuelca las estadísticas de la recarga a un archivo .prof en disco."""
+    if perfilador is None:
+        return None
+    perfilador.disable()
+    os.makedirs(PERF_PROFILES_DIR, exist_ok=True)
+    usuario_seguro = "".join(c if c.isalnum() else '_' for c in str(usuario))
+    ruta = os.path.join(PERF_PROFILES_DIR, f"rerun_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{usuario_seguro}.prof")
+    perfilador.dump_stats(ruta)
+    return ruta
+
+def resumen_latencias():
+    """Devuelve un DataFrame con percentiles de latencia y métricas de caché por etiqueta."""
+    registro = get_perf_registry()
+    with registro['lock']:
+        latencias = {k: np.array(v) for k, v in registro['latencias'].items() if len(v) > 0}
+        llamadas = dict(registro['llamadas'])
+        misses = dict(registro['misses'])
+
+    filas = []
+    for etiqueta, valores in latencias.items():
+        fila = {
+            'Etiqueta': etiqueta,
+            'Muestras': len(valores),
+            'Media (ms)': valores.mean(),
+            'p50 (ms)': np.percentile(valores, 50),
+            'p95 (ms)': np.percentile(valores, 95),
+            'Máx (ms)': valores.max(),
+            'Llamadas': llamadas.get(etiqueta, np.nan),
+            'Misses Caché': misses.get(etiqueta, np.nan),
+        }
+        filas.append(fila)
+
+    df_resumen = pd.DataFrame(filas, columns=['Etiqueta', 'Muestras', 'Media (ms)', 'p50 (ms)', 'p95 (ms)', 'Máx (ms)', 'Llamadas', 'Misses Caché'])
+    df_resumen['Hits Caché'] = df_resumen['Llamadas'] - df_resumen['Misses Caché']
+    df_resumen['% Hit'] = (df_resumen['Hits Caché'] / df_resumen['Llamadas'] * 100).round(1)
+    return df_resumen.sort_values('p95 (ms)', ascending=False).reset_index(drop=True)
+
+def get_latencias(etiqueta):
+    """Copia de la ventana móvil de latencias (ms) de una etiqueta."""
+    registro = get_perf_registry()
+    with registro['lock']:
+        return np.array(registro['latencias'].get(etiqueta, []))
+
+def reset_perf_registry():
+    """Vacía todas las mediciones y contadores."""
+    registro = get_perf_registry()
+    with registro['lock']:
+        registro['latencias'].clear()
+        registro['llamadas'].clear()
+        registro['misses'].clear()
+
+# --- PARTICIÓN DE DATOS POR EQUIPO ---
+
+def equipo_sesion():
+    """Equipo de la sesión actual (el equipo por defecto antes de iniciar sesión)."""
+    return st.session_state.get('equipo', EQUIPO_POR_DEFECTO)
+
+def carpeta_equipo(equipo):
+    """Carpeta de datos del equipo; el equipo por defecto vive en la raíz."""
+    if not equipo or equipo == EQUIPO_POR_DEFECTO:
+        return '.'
+    nombre_seguro = "".join(c if c.isalnum() else '_' for c in str(equipo).strip())
+    return os.path.join(EQUIPOS_DIR, nombre_seguro)
+
+def ruta_equipo(archivo, equipo):
+    """Ruta de un archivo de datos dentro de la partición del equipo (crea la carpeta si falta)."""
+    carpeta = carpeta_equipo(equipo)
+    if carpeta == '.':
+        return archivo
+    os.makedirs(carpeta, exist_ok=True)
+    return os.path.join(carpeta, archivo)
+
+def version_archivo(ruta):
+    """Token barato de versión de un archivo de datos (mtime + tamaño) para claves de caché."""
+    try:
+        estado = os.stat(ruta)
+        return f"{estado.st_mtime_ns}-{estado.st_size}"
+    except OSError:
+        return 'sin-archivo'
+
 # --- FUNCIONES DE CÁLCULO (MOVIDAS AL INICIO PARA EVITAR NAMEERROR) ---
 
 def calculate_tmb_mifflin(peso_kg, altura_cm, edad_anos, sexo):
@@ -67,16 +579,19 @@ def calculate_and_sort_ranking(df):
 
 # --- 2. FUNCIONES DE CARGA DE DATOS (CON CACHÉ) ---
 
+@instrumentar('load_data')
 @st.cache_data(ttl=3600) 
-def load_data():
+def load_data(equipo):
     """Carga los datos de los atletas. Si no existe, lo crea."""
+    registrar_cache_miss('load_data')
+    ruta = ruta_equipo(EXCEL_FILE, equipo)
     df = pd.DataFrame()
-    excel_exists = os.path.exists(EXCEL_FILE)
+    excel_exists = os.path.exists(ruta)
     status_message = None
     
     if excel_exists:
         try:
-            df = pd.read_excel(EXCEL_FILE, engine='openpyxl')
+            df = leer_excel(ruta)
             df.columns = df.columns.str.strip() 
             
             missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
@@ -90,7 +605,7 @@ def load_data():
             excel_exists = False
 
     if not excel_exists or df.empty:
-        status_message = f"Creando el archivo '{EXCEL_FILE}' de ejemplo con la estructura inicial."
+        status_message = f"Creando el archivo '{ruta}' de ejemplo con la estructura inicial."
         data = {
             'ID': [1, 2, 3],
             'Atleta': ['Juan Pérez', 'Ana Gómez', 'Tu Nombre'],
@@ -103,7 +618,7 @@ def load_data():
         }
         df = pd.DataFrame(data, columns=REQUIRED_COLUMNS) 
         
-        df.to_excel(EXCEL_FILE, index=False, engine='openpyxl') 
+        escribir_excel(df, ruta) 
         status_message += " Archivo creado con éxito."
         
     if 'Última_Fecha' in df.columns:
@@ -114,15 +629,18 @@ def load_data():
     
     return df, status_message 
 
+@instrumentar('load_calendar_data')
 @st.cache_data(ttl=600)
-def load_calendar_data():
+def load_calendar_data(equipo):
     """Carga los datos del calendario desde el archivo Excel."""
+    registrar_cache_miss('load_calendar_data')
+    ruta = ruta_equipo(CALENDAR_FILE, equipo)
     calendar_df = pd.DataFrame()
-    excel_exists = os.path.exists(CALENDAR_FILE)
+    excel_exists = os.path.exists(ruta)
     
     if excel_exists:
         try:
-            calendar_df = pd.read_excel(CALENDAR_FILE, engine='openpyxl')
+            calendar_df = leer_excel(ruta)
             calendar_df.columns = calendar_df.columns.str.strip() 
             
             if 'Fecha' in calendar_df.columns:
@@ -140,44 +658,50 @@ def load_calendar_data():
         }
         calendar_df = pd.DataFrame(data, columns=CALENDAR_REQUIRED_COLUMNS) 
         calendar_df['Fecha'] = pd.to_datetime(calendar_df['Fecha'], errors='coerce').dt.date
-        calendar_df.to_excel(CALENDAR_FILE, index=False, engine='openpyxl') 
+        escribir_excel(calendar_df, ruta) 
 
     if 'Habilitado' in calendar_df.columns:
         calendar_df['Habilitado'] = calendar_df['Habilitado'].astype(str).str.lower().str.strip() == 'sí'
 
     return calendar_df
 
+@instrumentar('load_tests_data')
 @st.cache_data(ttl=3600)
-def load_tests_data():
+def load_tests_data(equipo):
     """Carga la lista de pruebas activas."""
+    registrar_cache_miss('load_tests_data')
+    ruta = ruta_equipo(PRUEBAS_FILE, equipo)
     status_message = None
     
-    if not os.path.exists(PRUEBAS_FILE):
+    if not os.path.exists(ruta):
         data = {
             'NombrePrueba': ['Sentadilla', 'Press Banca', 'Peso Muerto', 'Otro'],
             'ColumnaRM': ['Sentadilla_RM', 'PressBanca_RM', 'PesoMuerto_RM', 'N/A'],
             'Visible': ['Sí', 'Sí', 'No', 'Sí']
         }
         df_tests = pd.DataFrame(data)
-        df_tests.to_excel(PRUEBAS_FILE, index=False, engine='openpyxl')
-        status_message = f"Archivo '{PRUEBAS_FILE}' creado con éxito."
+        escribir_excel(df_tests, ruta)
+        status_message = f"Archivo '{ruta}' creado con éxito."
     
     try:
-        df_tests = pd.read_excel(PRUEBAS_FILE, engine='openpyxl')
+        df_tests = leer_excel(ruta)
         df_tests.columns = df_tests.columns.str.strip()
     except Exception as e:
-        status_message = f"Error al cargar {PRUEBAS_FILE}: {e}"
+        status_message = f"Error al cargar {ruta}: {e}"
         return pd.DataFrame(), status_message 
 
     df_tests['Visible'] = df_tests['Visible'].astype(str).str.lower().str.strip().apply(lambda x: True if x == 'sí' else False)
     
     return df_tests, status_message 
 
+@instrumentar('load_perfil_data')
 @st.cache_data(ttl=3600)
-def load_perfil_data():
+def load_perfil_data(equipo):
     """Carga los datos de perfil de los atletas desde el archivo Excel."""
+    registrar_cache_miss('load_perfil_data')
+    ruta = ruta_equipo(PERFILES_FILE, equipo)
     df_perfil = pd.DataFrame()
-    excel_exists = os.path.exists(PERFILES_FILE)
+    excel_exists = os.path.exists(ruta)
     status_message = None
 
     DEFAULT_PROFILE_DATA = {
@@ -194,7 +718,7 @@ def load_perfil_data():
     
     if excel_exists:
         try:
-            df_perfil = pd.read_excel(PERFILES_FILE, engine='openpyxl')
+            df_perfil = leer_excel(ruta)
             df_perfil.columns = df_perfil.columns.str.strip()
             
             if 'Sexo' not in df_perfil.columns:
@@ -205,26 +729,36 @@ def load_perfil_data():
 
     if not excel_exists or df_perfil.empty:
         df_perfil = pd.DataFrame(DEFAULT_PROFILE_DATA, columns=REQUIRED_PROFILE_COLUMNS) 
-        df_perfil.to_excel(PERFILES_FILE, index=False, engine='openpyxl') 
-        status_message = f"Archivo '{PERFILES_FILE}' creado con éxito."
+        escribir_excel(df_perfil, ruta) 
+        status_message = f"Archivo '{ruta}' creado con éxito."
+
+    # Columnas de zonas de FC: también en el perfil por defecto (equipos nuevos o archivo ausente)
+    for col in ['FC_Max_Medida', 'FC_Reposo']:
+        df_perfil[col] = pd.to_numeric(df_perfil[col], errors='coerce') if col in df_perfil.columns else np.nan
+    if 'Modelo_Zonas' not in df_perfil.columns:
+        df_perfil['Modelo_Zonas'] = None
+    df_perfil['Modelo_Zonas'] = df_perfil['Modelo_Zonas'].astype(object)
 
     return df_perfil, status_message
 
+@instrumentar('load_ranking_data')
 @st.cache_data(ttl=3600)
-def load_ranking_data():
+def load_ranking_data(equipo):
     """Carga los datos de ranking, los calcula, ordena y crea el archivo si no existe."""
+    registrar_cache_miss('load_ranking_data')
+    ruta = ruta_equipo(RANKING_FILE, equipo)
     df_ranking = pd.DataFrame()
     status_message = None
-    excel_exists = os.path.exists(RANKING_FILE)
+    excel_exists = os.path.exists(ruta)
     
     if excel_exists:
         try:
-            df_ranking = pd.read_excel(RANKING_FILE, engine='openpyxl')
+            df_ranking = leer_excel(ruta)
             df_ranking.columns = df_ranking.columns.str.strip() 
             
             missing_cols = [col for col in RANKING_REQUIRED_COLUMNS if col not in df_ranking.columns]
             if missing_cols:
-                 status_message = f"ADVERTENCIA: El archivo '{RANKING_FILE}' no tiene las columnas requeridas: {', '.join(missing_cols)}. Favor de corregir el archivo."
+                 status_message = f"ADVERTENCIA: El archivo '{ruta}' no tiene las columnas requeridas: {', '.join(missing_cols)}. Favor de corregir el archivo."
                  full_ranking_cols = RANKING_REQUIRED_COLUMNS + ['Puntos'] 
                  df_ranking = pd.DataFrame(columns=full_ranking_cols) 
             
@@ -241,24 +775,27 @@ def load_ranking_data():
             'Bronces': [1, 0, 1, 2],
         }
         df_ranking = pd.DataFrame(data, columns=RANKING_REQUIRED_COLUMNS) 
-        df_ranking.to_excel(RANKING_FILE, index=False, engine='openpyxl')
-        status_message = f"Archivo '{RANKING_FILE}' creado con éxito."
+        escribir_excel(df_ranking, ruta)
+        status_message = f"Archivo '{ruta}' creado con éxito."
 
     if not df_ranking.empty:
         df_ranking = calculate_and_sort_ranking(df_ranking)
         
     return df_ranking, status_message
 
+@instrumentar('load_readiness_data')
 @st.cache_data(ttl=3600)
-def load_readiness_data():
+def load_readiness_data(equipo):
     """Carga los datos de bienestar/readiness desde el archivo Excel."""
+    registrar_cache_miss('load_readiness_data')
+    ruta = ruta_equipo(READINESS_FILE, equipo)
     df_readiness = pd.DataFrame()
-    excel_exists = os.path.exists(READINESS_FILE)
+    excel_exists = os.path.exists(ruta)
     status_message = None
 
     if excel_exists:
         try:
-            df_readiness = pd.read_excel(READINESS_FILE, engine='openpyxl')
+            df_readiness = leer_excel(ruta)
             df_readiness.columns = df_readiness.columns.str.strip()
             df_readiness['Fecha'] = pd.to_datetime(df_readiness['Fecha'], errors='coerce')
         except:
@@ -274,29 +811,783 @@ def load_readiness_data():
         }
         df_readiness = pd.DataFrame(data, columns=READINESS_REQUIRED_COLUMNS) 
         df_readiness['Fecha'] = pd.to_datetime(df_readiness['Fecha'], errors='coerce')
-        df_readiness.to_excel(READINESS_FILE, index=False, engine='openpyxl') 
-        status_message = f"Archivo '{READINESS_FILE}' creado con éxito."
+        escribir_excel(df_readiness, ruta) 
+        status_message = f"Archivo '{ruta}' creado con éxito."
     
     return df_readiness, status_message
 
+@instrumentar('load_vam_data')
+@st.cache_data(ttl=3600)
+def load_vam_data(equipo):
+    """Carga el historial de pruebas de VAM (Test VAM, Cooper, 5K) y crea el archivo si no existe."""
+    registrar_cache_miss('load_vam_data')
+    ruta = ruta_equipo(VAM_FILE, equipo)
+    df_vam = pd.DataFrame()
+    status_message = None
+    excel_exists = os.path.exists(ruta)
+
+    if excel_exists:
+        try:
+            df_vam = leer_excel(ruta)
+            df_vam.columns = df_vam.columns.str.strip()
+        except:
+            excel_exists = False
+
+    if not excel_exists:
+        df_vam = pd.DataFrame(columns=VAM_REQUIRED_COLUMNS)
+        escribir_excel(df_vam, ruta)
+        status_message = f"Archivo '{ruta}' creado con éxito."
+
+    df_vam = df_vam.reindex(columns=VAM_REQUIRED_COLUMNS)
+    df_vam['Fecha'] = pd.to_datetime(df_vam['Fecha'], errors='coerce')
+    for col in ['Distancia_m', 'Tiempo_s', 'VAM_kmh']:
+        df_vam[col] = pd.to_numeric(df_vam[col], errors='coerce')
+    return df_vam, status_message
+
+@instrumentar('load_pesajes_data')
+@st.cache_data(ttl=3600)
+def load_pesajes_data(equipo):
+    """Carga el registro diario de peso corporal y crea el archivo si no existe."""
+    registrar_cache_miss('load_pesajes_data')
+    ruta = ruta_equipo(PESAJES_FILE, equipo)
+    df_pesajes = pd.DataFrame()
+    status_message = None
+    excel_exists = os.path.exists(ruta)
+
+    if excel_exists:
+        try:
+            df_pesajes = leer_excel(ruta)
+            df_pesajes.columns = df_pesajes.columns.str.strip()
+        except:
+            excel_exists = False
+
+    if not excel_exists:
+        df_pesajes = pd.DataFrame(columns=PESAJES_REQUIRED_COLUMNS)
+        escribir_excel(df_pesajes, ruta)
+        status_message = f"Archivo '{ruta}' creado con éxito."
+
+    df_pesajes = df_pesajes.reindex(columns=PESAJES_REQUIRED_COLUMNS)
+    df_pesajes['Fecha'] = pd.to_datetime(df_pesajes['Fecha'], errors='coerce')
+    df_pesajes['Peso_kg'] = pd.to_numeric(df_pesajes['Peso_kg'], errors='coerce')
+    return df_pesajes, status_message
+
+@instrumentar('load_plantillas_data')
+@st.cache_data(ttl=3600)
+def load_plantillas_data(equipo):
+    """Carga las plantillas de periodización y crea una plantilla de ejemplo si no existe el archivo."""
+    registrar_cache_miss('load_plantillas_data')
+    ruta = ruta_equipo(PLANTILLAS_FILE, equipo)
+    df_plantillas = pd.DataFrame()
+    status_message = None
+    excel_exists = os.path.exists(ruta)
+
+    if excel_exists:
+        try:
+            df_plantillas = leer_excel(ruta)
+            df_plantillas.columns = df_plantillas.columns.str.strip()
+        except:
+            excel_exists = False
+
+    if not excel_exists or df_plantillas.empty:
+        # Fuerza básica: 2 semanas de acumulación, 1 de intensificación y 1 de descarga
+        semanas = [('Acumulación', 1, 4, 8, '%RM', 70), ('Acumulación', 2, 4, 6, '%RM', 75),
+                   ('Intensificación', 3, 5, 3, '%RM', 85), ('Descarga', 4, 3, 5, 'RIR', 4)]
+        dias = [(1, 'Sentadilla'), (1, 'Press Banca'), (2, 'Peso Muerto'), (2, 'Press Banca')]
+        filas = [('Fuerza Básica 4 Semanas', bloque, semana, dia, ejercicio, series, reps, tipo, intensidad)
+                 for bloque, semana, series, reps, tipo, intensidad in semanas for dia, ejercicio in dias]
+        df_plantillas = pd.DataFrame(filas, columns=PLANTILLAS_REQUIRED_COLUMNS)
+        escribir_excel(df_plantillas, ruta)
+        status_message = f"Archivo '{ruta}' creado con éxito."
+
+    df_plantillas = df_plantillas.reindex(columns=PLANTILLAS_REQUIRED_COLUMNS)
+    for col in ['Semana', 'Dia', 'Series', 'Reps', 'Intensidad']:
+        df_plantillas[col] = pd.to_numeric(df_plantillas[col], errors='coerce')
+    return df_plantillas, status_message
+
+@instrumentar('load_lesiones_data')
+@st.cache_data(ttl=3600)
+def load_lesiones_data(equipo):
+    """Carga el registro de lesiones y molestias y crea el archivo si no existe."""
+    registrar_cache_miss('load_lesiones_data')
+    ruta = ruta_equipo(LESIONES_FILE, equipo)
+    df_lesiones = pd.DataFrame()
+    status_message = None
+    excel_exists = os.path.exists(ruta)
+
+    if excel_exists:
+        try:
+            df_lesiones = leer_excel(ruta)
+            df_lesiones.columns = df_lesiones.columns.str.strip()
+        except:
+            excel_exists = False
+
+    if not excel_exists:
+        df_lesiones = pd.DataFrame(columns=LESIONES_REQUIRED_COLUMNS)
+        escribir_excel(df_lesiones, ruta)
+        status_message = f"Archivo '{ruta}' creado con éxito."
+
+    df_lesiones = df_lesiones.reindex(columns=LESIONES_REQUIRED_COLUMNS)
+    df_lesiones['Inicio'] = pd.to_datetime(df_lesiones['Inicio'], errors='coerce')
+    df_lesiones['Severidad'] = pd.to_numeric(df_lesiones['Severidad'], errors='coerce')
+    return df_lesiones, status_message
+
+@st.cache_data(ttl=3600)
+def load_politica_autorregulacion(equipo):
+    """Carga la política de autorregulación del equipo (valores por defecto si no hay archivo)."""
+    politica = dict(POLITICA_POR_DEFECTO)
+    ruta = ruta_equipo(POLITICA_FILE, equipo)
+    if os.path.exists(ruta):
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                politica.update({k: v for k, v in json.load(f).items() if k in POLITICA_POR_DEFECTO})
+        except Exception:
+            pass
+    return politica
+
+def save_politica_autorregulacion(politica):
+    """Guarda la política de autorregulación del equipo de la sesión."""
+    equipo = equipo_sesion()
+    try:
+        with open(ruta_equipo(POLITICA_FILE, equipo), 'w', encoding='utf-8') as f:
+            json.dump(politica, f, ensure_ascii=False, indent=2)
+        load_politica_autorregulacion.clear(equipo)
+        return True
+    except Exception as e:
+        st.error(f"Error al guardar la política: {e}")
+        return False
+
+@instrumentar('load_equipos_data')
+@st.cache_data(ttl=3600)
+def load_equipos_data():
+    """Carga la lista de equipos (clubes) alojados en esta instancia."""
+    registrar_cache_miss('load_equipos_data')
+    df_equipos = pd.DataFrame()
+
+    if os.path.exists(EQUIPOS_FILE):
+        try:
+            df_equipos = leer_excel(EQUIPOS_FILE)
+            df_equipos.columns = df_equipos.columns.str.strip()
+        except:
+            df_equipos = pd.DataFrame()
+
+    if df_equipos.empty or 'Equipo' not in df_equipos.columns:
+        df_equipos = pd.DataFrame({'Equipo': [EQUIPO_POR_DEFECTO], 'Habilitado': ['Sí']})
+        escribir_excel(df_equipos, EQUIPOS_FILE)
+
+    if 'Habilitado' not in df_equipos.columns:
+        df_equipos['Habilitado'] = 'Sí'
+    df_equipos['Equipo'] = df_equipos['Equipo'].astype(str).str.strip()
+    df_equipos['Habilitado'] = df_equipos['Habilitado'].astype(str).str.lower().str.strip() == 'sí'
+    return df_equipos
+
+def crear_equipo(nombre, entrenador, contrasena):
+    """Registra un nuevo equipo, crea su carpeta y su archivo de atletas con el entrenador indicado como único usuario.
+
+    Se rechaza si el nombre está vacío, si faltan las credenciales o si su carpeta coincide con la de otro
+    equipo ('Club A', 'Club_A' y 'Club-A' comparten carpeta). El resto de archivos se generan en la primera carga.
+    """
+    nombre = str(nombre).strip()
+    entrenador = str(entrenador).strip()
+    df_equipos = load_equipos_data()
+    if not nombre or not entrenador or not contrasena:
+        return False
+    carpeta = carpeta_equipo(nombre)
+    carpetas_existentes = {carpeta_equipo(e) for e in df_equipos['Equipo']}
+    if nombre.lower() in df_equipos['Equipo'].str.lower().values or carpeta in carpetas_existentes or os.path.exists(carpeta):
+        return False
+
+    df_equipos = pd.concat([df_equipos, pd.DataFrame([{'Equipo': nombre, 'Habilitado': True}])], ignore_index=True)
+    df_equipos['Habilitado'] = df_equipos['Habilitado'].apply(lambda x: 'Sí' if x else 'No')
+    df_entrenador = pd.DataFrame([{'ID': 1, 'Atleta': entrenador, 'Contraseña': str(contrasena), 'Rol': 'Entrenador'}], columns=REQUIRED_COLUMNS)
+    try:
+        os.makedirs(carpeta)
+        escribir_excel(df_entrenador, os.path.join(carpeta, EXCEL_FILE))
+        escribir_excel(df_equipos, EQUIPOS_FILE)
+        load_equipos_data.clear()
+        return True
+    except Exception as e:
+        st.error(f"Error al crear el equipo: {e}")
+        return False
+
+# --- REGISTRO COMPARTIDO DE DATASETS (INMUTABLE Y COMPACTO ENTRE SESIONES) ---
+
+# Archivo y loader de cada dataset que se comparte entre sesiones
+LOADERS_DATASET = {
+    'atletas': (EXCEL_FILE, load_data),
+    'calendario': (CALENDAR_FILE, load_calendar_data),
+    'pruebas': (PRUEBAS_FILE, load_tests_data),
+    'perfiles': (PERFILES_FILE, load_perfil_data),
+    'ranking': (RANKING_FILE, load_ranking_data),
+    'readiness': (READINESS_FILE, load_readiness_data),
+    'vam': (VAM_FILE, load_vam_data),
+    'pesajes': (PESAJES_FILE, load_pesajes_data),
+    'plantillas': (PLANTILLAS_FILE, load_plantillas_data),
+    'lesiones': (LESIONES_FILE, load_lesiones_data),
+}
+# Columnas de texto con pocos valores distintos que se guardan como 'category'
+COLUMNAS_CATEGORICAS = {
+    'atletas': ['Rol'],
+    'perfiles': ['Genero', 'Categoria', 'Division', 'Sexo', 'Modelo_Zonas'],
+    'ranking': ['Categoria'],
+    'readiness': ['Atleta'],
+    'vam': ['Atleta', 'Tipo'],
+    'pesajes': ['Atleta'],
+    'plantillas': ['Plantilla', 'Bloque', 'Ejercicio', 'Tipo_Intensidad'],
+    'lesiones': ['Atleta', 'Region', 'Estado'],
+}
+
+@st.cache_resource
+def get_registro_datasets():
+    """Registro por proceso con una única copia de cada dataset y equipo, compartida por todas las sesiones."""
+    return {'lock': threading.Lock(), 'entradas': {}, 'cargas_frio': deque(maxlen=20)}
+
+def tipos_compactos(df, dataset):
+    """Convierte a 'category' las columnas de texto repetitivas del dataset."""
+    columnas = [
+        c for c in COLUMNAS_CATEGORICAS.get(dataset, [])
+        if c in df.columns and (df[c].dtype == object or pd.api.types.is_string_dtype(df[c]))
+    ]
+    return df.astype({c: 'category' for c in columnas}) if columnas else df
+
+def a_objeto(df):
+    """Copia editable: las columnas 'category' vuelven a object (st.data_editor y las asignaciones admiten valores nuevos)."""
+    categoricas = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    return df.astype({c: object for c in categoricas}) if categoricas else df.copy()
+
+def dataset_compartido(dataset, equipo):
+    """Devuelve (df, estado) del registro compartido; solo se recarga cuando cambia la versión del archivo.
+
+    El DataFrame es el mismo objeto para todas las sesiones: no se modifica en sitio. Las
+    selecciones y columnas derivadas se hacen sobre vistas (copy-on-write) y los guardados
+    trabajan sobre a_objeto(df).
+    """
+    archivo, loader = LOADERS_DATASET[dataset]
+    registro = get_registro_datasets()
+    version = version_archivo(ruta_equipo(archivo, equipo))
+    with registro['lock']:
+        entrada = registro['entradas'].get((dataset, equipo))
+    if entrada is not None and entrada['version'] == version:
+        return entrada['df'], entrada['estado']
+
+    if entrada is not None:
+        # Versión distinta: la caché del loader (ttl) aún tiene la anterior, se vacía antes de recargar
+        loader.clear(equipo)
+    inicio = time_mod.perf_counter()
+    resultado = loader(equipo)
+    df, estado = resultado if isinstance(resultado, tuple) else (resultado, None)
+    df = tipos_compactos(df, dataset)
+    segundos = time_mod.perf_counter() - inicio
+    # La versión anterior se conserva para medir los saltos de la validación
+    previo = entrada['df'] if entrada is not None else None
+    if dataset in ESQUEMAS_DATASET:
+        validar_dataset(df, dataset, equipo, version, previo)
+    with registro['lock']:
+        registro['entradas'][(dataset, equipo)] = {
+            'version': version, 'df': df, 'estado': estado, 'segundos': segundos, 'previo': previo,
+        }
+    return df, estado
+
+def dataset_vigente(dataset, equipo):
+    """True si el registro ya tiene la versión actual del archivo del dataset."""
+    registro = get_registro_datasets()
+    with registro['lock']:
+        entrada = registro['entradas'].get((dataset, equipo))
+    return entrada is not None and entrada['version'] == version_archivo(ruta_equipo(LOADERS_DATASET[dataset][0], equipo))
+
+def cargar_datasets(equipo, datasets):
+    """Carga los datasets del equipo; los que no están vigentes se parsean en paralelo (uno por hilo).
+
+    La espera total es la del libro más lento y no la suma de todos. Cada carga en frío queda en
+    el registro con el tiempo de cada archivo para el panel de rendimiento.
+    """
+    pendientes = [d for d in datasets if not dataset_vigente(d, equipo)]
+    if len(pendientes) > 1:
+        ctx = get_script_run_ctx()
+        inicio = time_mod.perf_counter()
+        with medir_tiempo('carga_frio.total'), ThreadPoolExecutor(
+            max_workers=min(CARGA_MAX_HILOS, len(pendientes)), thread_name_prefix='carga-datasets',
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+        ) as pool:
+            list(pool.map(lambda d: dataset_compartido(d, equipo), pendientes))
+
+        registro = get_registro_datasets()
+        with registro['lock']:
+            por_dataset = {d: registro['entradas'][(d, equipo)]['segundos'] for d in pendientes}
+            registro['cargas_frio'].append({
+                'Fecha': datetime.now(), 'Equipo': equipo, 'Motor': MOTOR_EXCEL, 'Hilos': min(CARGA_MAX_HILOS, len(pendientes)),
+                'Total (s)': time_mod.perf_counter() - inicio, 'Suma (s)': sum(por_dataset.values()), 'Por dataset': por_dataset,
+            })
+    return {d: dataset_compartido(d, equipo) for d in datasets}
+
+def ultima_carga_frio():
+    """Última carga en frío registrada (o None)."""
+    registro = get_registro_datasets()
+    with registro['lock']:
+        return dict(registro['cargas_frio'][-1]) if registro['cargas_frio'] else None
+
+# --- BUS DE CAMBIOS ENTRE SESIONES (CONTADORES DE VERSIÓN + VIGILANTE DE ARCHIVOS) ---
+
+@st.cache_resource
+def get_bus_cambios():
+    """Estado compartido del bus: contador de cambios por (dataset, equipo), sesiones suscritas y un hilo que vigila los archivos."""
+    bus = {'lock': threading.Lock(), 'contadores': defaultdict(int), 'versiones': {}, 'sesiones': {}, 'pendientes': set()}
+    hilo = threading.Thread(target=_bucle_vigilante, args=(bus,), daemon=True, name='bus-cambios')
+    hilo.start()
+    return bus
+
+def datasets_de_la_vista():
+    """Datasets de los que dependen los componentes visibles de la sesión según su rol."""
+    if not st.session_state.get('logged_in'):
+        return frozenset()
+    if st.session_state.get('rol') == 'Entrenador':
+        return frozenset(LOADERS_DATASET)
+    return frozenset(DATASETS_VISTA_ATLETA)
+
+def suscribir_sesion(equipo):
+    """Registra la sesión actual (equipo, datasets visibles y hora de la ejecución); esta ejecución ya lee los datos al día."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    bus = get_bus_cambios()
+    with bus['lock']:
+        bus['sesiones'][ctx.session_id] = {'equipo': equipo, 'datasets': datasets_de_la_vista(), 'ultima': time_mod.monotonic()}
+        bus['pendientes'].discard(ctx.session_id)
+        for dataset, (archivo, _) in LOADERS_DATASET.items():
+            bus['versiones'].setdefault((dataset, equipo), version_archivo(ruta_equipo(archivo, equipo)))
+
+def _recargar_sesiones(bus):
+    """Pide una nueva ejecución a las sesiones con cambios pendientes que llevan BUS_RECARGA_MIN_S sin ejecutarse.
+
+    Las ráfagas de cambios se agrupan en una sola recarga y las sesiones en uso (ejecutadas hace poco) no se
+    interrumpen: recogen la nueva versión en su siguiente interacción. Usa la API interna (protegida) de Streamlit.
+    """
+    if not BUS_RECARGA_SESIONES:
+        return
+    ahora = time_mod.monotonic()
+    with bus['lock']:
+        destinos = [
+            sid for sid in bus['pendientes']
+            if sid in bus['sesiones'] and ahora - bus['sesiones'][sid]['ultima'] >= BUS_RECARGA_MIN_S
+        ]
+        bus['pendientes'].difference_update(destinos)
+    if not destinos:
+        return
+    try:
+        from streamlit.runtime import Runtime
+        gestor = Runtime.instance()._session_mgr
+    except Exception:
+        return
+    for sid in destinos:
+        try:
+            info = gestor.get_active_session_info(sid)
+            if info is None:
+                with bus['lock']:
+                    bus['sesiones'].pop(sid, None)
+                continue
+            with bus['lock']:
+                bus['sesiones'][sid]['ultima'] = ahora
+            info.session.request_rerun(info.session._client_state)
+        except Exception as e:
+            logger.warning("No se pudo recargar la sesión %s: %s", sid, e)
+
+def publicar_cambio(dataset, equipo, origen=None):
+    """Anota un cambio del dataset: sube su contador, invalida solo su entrada de caché y marca para recarga las sesiones que lo muestran."""
+    if dataset not in LOADERS_DATASET:
+        return
+    archivo, loader = LOADERS_DATASET[dataset]
+    loader.clear(equipo)
+    registro = get_registro_datasets()
+    with registro['lock']:
+        registro['entradas'].pop((dataset, equipo), None)
+    bus = get_bus_cambios()
+    with bus['lock']:
+        bus['contadores'][(dataset, equipo)] += 1
+        bus['versiones'][(dataset, equipo)] = version_archivo(ruta_equipo(archivo, equipo))
+        bus['pendientes'].update(
+            sid for sid, sesion in bus['sesiones'].items()
+            if sid != origen and sesion['equipo'] == equipo and dataset in sesion['datasets']
+        )
+
+def _bucle_vigilante(bus):
+    """Detecta cambios hechos fuera de la app (o por otro proceso) comparando mtime+tamaño de los archivos vigilados."""
+    while True:
+        time_mod.sleep(BUS_INTERVALO_S)
+        with bus['lock']:
+            vigilados = dict(bus['versiones'])
+        for (dataset, equipo), version_previa in vigilados.items():
+            try:
+                version = version_archivo(ruta_equipo(LOADERS_DATASET[dataset][0], equipo))
+                if version != version_previa:
+                    publicar_cambio(dataset, equipo)
+            except Exception:
+                logger.exception("Error en el bus de cambios (%s/%s)", dataset, equipo)
+        _recargar_sesiones(bus)
+
+def resumen_bus_cambios():
+    """Sesiones suscritas por equipo y contador de cambios de cada dataset."""
+    bus = get_bus_cambios()
+    with bus['lock']:
+        sesiones = pd.Series([sesion['equipo'] for sesion in bus['sesiones'].values()], dtype=object).value_counts()
+        filas = [{'Equipo': e, 'Dataset': d, 'Cambios': n} for (d, e), n in bus['contadores'].items()]
+    return sesiones, pd.DataFrame(filas, columns=['Equipo', 'Dataset', 'Cambios'])
+
+# --- CALIDAD DE DATOS: VALIDACIÓN DECLARATIVA Y DETECCIÓN DE ANOMALÍAS ---
+
+CALIDAD_COLUMNAS = ['Fila', 'Atleta', 'Columna', 'Valor', 'Regla', 'Severidad', 'Detalle']
+
+def _incidencias(df, mascara, columna, regla, severidad, detalle):
+    """Filas de incidencia para las posiciones marcadas (detalle escalar o un valor por fila)."""
+    pos = np.flatnonzero(np.asarray(mascara, dtype=bool))
+    if not len(pos):
+        return None
+    detalle = np.asarray(detalle, dtype=object)[pos] if np.ndim(detalle) else np.full(len(pos), detalle, dtype=object)
+    return pd.DataFrame({
+        'Fila': df.index[pos],
+        'Atleta': df['Atleta'].astype(object).to_numpy()[pos] if 'Atleta' in df.columns else None,
+        'Columna': columna,
+        'Valor': df[columna].astype(object).to_numpy()[pos] if columna in df.columns else None,
+        'Regla': regla,
+        'Severidad': severidad,
+        'Detalle': detalle,
+    })
+
+def z_robusto(valores):
+    """z robusto (mediana y MAD escalada); 0 si hay pocos datos o no hay dispersión."""
+    valores = np.asarray(valores, dtype=float)
+    validos = valores[~np.isnan(valores)]
+    if len(validos) < CALIDAD_MIN_MUESTRA:
+        return np.zeros(len(valores))
+    mediana = np.median(validos)
+    mad = np.median(np.abs(validos - mediana)) * 1.4826
+    return (valores - mediana) / mad if mad > 0 else np.zeros(len(valores))
+
+def _saltos_serie(df, columna, umbral, serie, orden):
+    """Cambio relativo de cada registro contra la mediana de los 3 anteriores del mismo atleta."""
+    v = pd.to_numeric(df[columna], errors='coerce')
+    ordenado = pd.DataFrame({
+        'serie': df[serie].astype(object).astype(str).str.strip(), 'orden': pd.to_datetime(df[orden], errors='coerce'), 'v': v,
+    }).dropna(subset=['v']).sort_values(['serie', 'orden'], kind='stable')
+    grupos = ordenado.groupby('serie', sort=False)['v']
+    referencia = pd.concat([grupos.shift(k) for k in (1, 2, 3)], axis=1).median(axis=1)
+    return (ordenado['v'] / referencia - 1).reindex(df.index), referencia.reindex(df.index), umbral
+
+def _saltos_version(df, columna, umbral, clave, df_previo):
+    """Cambio relativo de cada fila contra la versión anterior del dataset (misma clave)."""
+    if df_previo is None or clave not in df_previo.columns or columna not in df_previo.columns:
+        return None, None, umbral
+    previos = pd.Series(
+        pd.to_numeric(df_previo[columna], errors='coerce').to_numpy(), index=df_previo[clave].astype(object).astype(str).str.strip()
+    )
+    previos = previos[~previos.index.duplicated()]
+    referencia = pd.Series(df[clave].astype(object).astype(str).str.strip().map(previos).to_numpy(dtype=float), index=df.index)
+    return pd.to_numeric(df[columna], errors='coerce') / referencia - 1, referencia, umbral
+
+def _vacios(serie):
+    """Máscara de valores vacíos (NaN/None y, en columnas de texto, cadenas en blanco)."""
+    vacia = serie.isna().to_numpy()
+    if serie.dtype == object or pd.api.types.is_string_dtype(serie) or isinstance(serie.dtype, pd.CategoricalDtype):
+        vacia = vacia | serie.astype(object).astype(str).str.strip().eq('').to_numpy()
+    return vacia
+
+def _detalle_en(mascara, formato, *columnas):
+    """Texto de detalle solo para las posiciones marcadas (evita formatear todas las filas)."""
+    detalle = np.full(len(mascara), '', dtype=object)
+    pos = np.flatnonzero(mascara)
+    detalle[pos] = [formato(*valores) for valores in zip(*(np.asarray(c)[pos] for c in columnas))]
+    return detalle
+
+def validar_df(df, esquema, df_previo=None):
+    """Aplica el esquema declarativo al DataFrame y devuelve una fila por incidencia (columnas CALIDAD_COLUMNAS).
+
+    Errores: columna obligatoria ausente o vacía, tipo, rango, valor no permitido y duplicados.
+    Avisos: atípicos (z robusto) y saltos por atleta contra su historial o la versión anterior.
+    """
+    partes = []
+    for columna, regla in esquema.get('columnas', {}).items():
+        if columna not in df.columns:
+            if regla.get('requerida'):
+                partes.append(pd.DataFrame([{'Fila': None, 'Atleta': None, 'Columna': columna, 'Valor': None,
+                                             'Regla': 'Columna ausente', 'Severidad': 'Error', 'Detalle': 'Falta la columna en el archivo'}]))
+            continue
+
+        serie = df[columna]
+        vacia = _vacios(serie)
+        if regla.get('requerida'):
+            partes.append(_incidencias(df, vacia, columna, 'Obligatorio', 'Error', 'Valor vacío'))
+
+        tipo = regla.get('tipo')
+        if tipo == 'numero':
+            valores = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+            partes.append(_incidencias(df, np.isnan(valores) & ~vacia, columna, 'Tipo', 'Error', 'No es un número'))
+            minimo, maximo = regla.get('min', -np.inf), regla.get('max', np.inf)
+            fuera = (valores < minimo) | (valores > maximo)
+            partes.append(_incidencias(df, fuera, columna, 'Rango', 'Error', f"Fuera de [{minimo:g}, {maximo:g}]"))
+            if regla.get('atipicos'):
+                z = z_robusto(np.where(fuera, np.nan, valores))
+                atipico = np.abs(z) > CALIDAD_Z_ATIPICO
+                partes.append(_incidencias(df, atipico, columna, 'Atípico', 'Aviso', _detalle_en(atipico, lambda x: f"z robusto = {x:+.1f}", z)))
+        elif tipo == 'fecha':
+            fechas = pd.to_datetime(serie, errors='coerce')
+            partes.append(_incidencias(df, fechas.isna().to_numpy() & ~vacia, columna, 'Tipo', 'Error', 'No es una fecha'))
+
+        if 'valores' in regla:
+            no_permitido = ~serie.astype(object).astype(str).str.strip().isin(regla['valores']).to_numpy() & ~vacia
+            partes.append(_incidencias(df, no_permitido, columna, 'Valor permitido', 'Error', f"Debe ser: {', '.join(regla['valores'])}"))
+
+    for columnas in esquema.get('unicas', []):
+        columnas = [columnas] if isinstance(columnas, str) else columnas
+        if not all(c in df.columns for c in columnas):
+            continue
+        normalizadas = pd.DataFrame({c: df[c].astype(object).astype(str).str.strip().str.casefold() for c in columnas})
+        repetida = normalizadas.duplicated(keep=False).to_numpy() & ~df[columnas].isna().any(axis=1).to_numpy()
+        partes.append(_incidencias(df, repetida, columnas[0], 'Duplicado', 'Error', f"{' + '.join(columnas)} repetido"))
+
+    saltos = esquema.get('saltos')
+    if saltos:
+        for columna, umbral in saltos['columnas'].items():
+            if columna not in df.columns:
+                continue
+            if 'serie' in saltos:
+                if saltos['serie'] not in df.columns or saltos['orden'] not in df.columns:
+                    continue
+                cambio, referencia, umbral = _saltos_serie(df, columna, umbral, saltos['serie'], saltos['orden'])
+            else:
+                cambio, referencia, umbral = _saltos_version(df, columna, umbral, saltos['clave'], df_previo)
+            if cambio is None:
+                continue
+            salto = (cambio.abs() > umbral).to_numpy()
+            detalle = _detalle_en(salto, lambda r, c: f"{r:g} → {r * (1 + c):g} ({c:+.0%})", referencia, cambio)
+            partes.append(_incidencias(df, salto, columna, 'Salto por atleta', 'Aviso', detalle))
+
+    partes = [p for p in partes if p is not None]
+    if not partes:
+        return pd.DataFrame(columns=CALIDAD_COLUMNAS)
+    incidencias = pd.concat(partes, ignore_index=True)
+    incidencias['Valor'] = incidencias['Valor'].astype(object).where(incidencias['Valor'].notna(), None).map(lambda v: '' if v is None else str(v))
+    return incidencias
+
+@instrumentar('validar_dataset')
+@st.cache_data(max_entries=100)
+def validar_dataset(_df, dataset, equipo, version, _df_previo=None):
+    """Incidencias de calidad de una versión concreta del dataset (se calcula una sola vez por versión)."""
+    registrar_cache_miss('validar_dataset')
+    return validar_df(_df, ESQUEMAS_DATASET[dataset], _df_previo)
+
+def informe_calidad(equipo):
+    """Incidencias de todos los datasets del equipo en el registro compartido (una fila por incidencia)."""
+    registro = get_registro_datasets()
+    with registro['lock']:
+        entradas = {d: e for (d, eq), e in registro['entradas'].items() if eq == equipo and d in ESQUEMAS_DATASET}
+    partes = [
+        validar_dataset(e['df'], d, equipo, e['version'], e.get('previo')).assign(Dataset=d)
+        for d, e in entradas.items()
+    ]
+    partes = [p for p in partes if not p.empty]
+    if not partes:
+        return pd.DataFrame(columns=['Dataset'] + CALIDAD_COLUMNAS)
+    return pd.concat(partes, ignore_index=True)[['Dataset'] + CALIDAD_COLUMNAS]
+
+def validar_guardado(dataset, df_antes, df_nuevo, etiquetas):
+    """Valida las filas que se van a escribir: los errores bloquean el guardado y los avisos se notifican.
+
+    Devuelve True si se puede guardar.
+    """
+    if dataset not in ESQUEMAS_DATASET:
+        return True
+    incidencias = validar_df(df_nuevo, ESQUEMAS_DATASET[dataset], df_antes)
+    incidencias = incidencias[incidencias['Fila'].isin(list(etiquetas))]
+    textos = [
+        f"{atleta if isinstance(atleta, str) else ''} · {columna}: {regla} ({detalle})"
+        for atleta, columna, regla, detalle in incidencias[['Atleta', 'Columna', 'Regla', 'Detalle']].itertuples(index=False)
+    ]
+    errores = [t for t, severidad in zip(textos, incidencias['Severidad']) if severidad == 'Error']
+    if errores:
+        st.error("No se guardó: corrige los datos marcados.\n\n- " + "\n- ".join(errores[:10]))
+        return False
+    for texto in textos[:5]:
+        st.toast(f"Revisa: {texto}", icon="⚠️")
+    return True
+
+# --- CONSOLA SQL SOBRE LOS DATASETS (MOTOR EMBEBIDO EN PROCESO) ---
+
+# Registros append-only (CSV) que también se exponen como tablas: tabla -> (archivo, columnas)
+TABLAS_SQL_REGISTROS = {
+    'series': (SERIES_LOG_FILE, SERIES_COLUMNS),
+    'vbt': (VBT_LOG_FILE, VBT_COLUMNS),
+    'asistencia': (ASISTENCIA_LOG_FILE, ASISTENCIA_COLUMNS),
+}
+CONSULTAS_SQL_EJEMPLO = {
+    'Readiness medio por atleta con su ranking': (
+        'SELECT r.Atleta, COUNT(*) AS Registros, ROUND(AVG(r."Sueño"), 2) AS Sueno_Medio,\n'
+        '       ROUND(AVG(r.Molestias), 2) AS Molestias_Medias, ROUND(AVG(r.Disposicion), 2) AS Disposicion_Media,\n'
+        '       k.Categoria, k.Posicion\n'
+        'FROM readiness r\nLEFT JOIN ranking k ON k.Atleta = r.Atleta\n'
+        'GROUP BY r.Atleta, k.Categoria, k.Posicion\nORDER BY Disposicion_Media DESC'
+    ),
+    'Fuerza relativa media por categoría': (
+        'SELECT p.Categoria, COUNT(*) AS Atletas,\n'
+        '       ROUND(AVG((a.Sentadilla_RM + a.PressBanca_RM) / a.PesoCorporal), 2) AS Fuerza_Relativa_Media\n'
+        'FROM atletas a\nJOIN perfiles p ON p.Atleta = a.Atleta\n'
+        'WHERE a.PesoCorporal > 0\nGROUP BY p.Categoria\nORDER BY Fuerza_Relativa_Media DESC'
+    ),
+    'Medallero por categoría': (
+        'SELECT Categoria, SUM(Oros) AS Oros, SUM(Platas) AS Platas, SUM(Bronces) AS Bronces, SUM(Puntos) AS Puntos\n'
+        'FROM ranking\nGROUP BY Categoria\nORDER BY Puntos DESC'
+    ),
+    'Eventos habilitados': 'SELECT Evento, Fecha, Detalle\nFROM calendario\nWHERE Habilitado\nORDER BY Fecha',
+}
+# Acciones que el autorizador de SQLite deja pasar (solo lectura; 33 = SQLITE_RECURSIVE)
+ACCIONES_SQLITE_LECTURA = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, getattr(sqlite3, 'SQLITE_RECURSIVE', 33)}
+
+@st.cache_resource
+def get_motor_sql():
+    """Conexión SQL en memoria por equipo (con la versión de datos con la que se construyó) y su esquema."""
+    return {'lock': threading.Lock(), 'conexiones': {}}
+
+def versiones_sql(equipo):
+    """Versión de cada archivo expuesto como tabla: clave de la conexión y de la caché de resultados."""
+    archivos = {d: a for d, (a, _) in LOADERS_DATASET.items()} | {t: a for t, (a, _) in TABLAS_SQL_REGISTROS.items()}
+    return tuple(sorted((tabla, version_archivo(ruta_equipo(archivo, equipo))) for tabla, archivo in archivos.items()))
+
+def tablas_sql(equipo):
+    """DataFrames que se exponen al motor: datasets del registro compartido y registros CSV del equipo."""
+    tablas = {
+        dataset: dataset_compartido(dataset, equipo)[0].drop(columns=SQL_COLUMNAS_OCULTAS.get(dataset, []), errors='ignore')
+        for dataset in LOADERS_DATASET
+    }
+    for tabla, (archivo, columnas) in TABLAS_SQL_REGISTROS.items():
+        ruta = ruta_equipo(archivo, equipo)
+        tablas[tabla] = pd.read_csv(ruta, parse_dates=['Fecha'], on_bad_lines='skip') if os.path.exists(ruta) else pd.DataFrame(columns=columnas)
+    return tablas
+
+def _autorizador_sqlite(accion, *_):
+    """Autorizador de SQLite: deniega cualquier escritura, ATTACH o PRAGMA."""
+    return sqlite3.SQLITE_OK if accion in ACCIONES_SQLITE_LECTURA else sqlite3.SQLITE_DENY
+
+def _conexion_sql(motor, equipo, versiones):
+    """Conexión del equipo con todas las tablas; solo se reconstruye si cambió la versión de algún archivo (bajo motor['lock'])."""
+    actual = motor['conexiones'].get(equipo)
+    if actual is not None and actual['versiones'] == versiones:
+        return actual
+
+    with medir_tiempo('sql.construir_conexion'):
+        tablas = tablas_sql(equipo)
+        if duckdb is not None:
+            # DuckDB lee los DataFrames registrados sin copiarlos y no puede tocar archivos del servidor
+            con = duckdb.connect(':memory:')
+            for nombre, df in tablas.items():
+                con.register(nombre, df)
+            con.execute("SET enable_external_access = false")
+            con.execute("SET lock_configuration = true")
+        else:
+            con = sqlite3.connect(':memory:', check_same_thread=False)
+            for nombre, df in tablas.items():
+                a_objeto(df).to_sql(nombre, con, index=False)
+            con.set_authorizer(_autorizador_sqlite)
+
+    if actual is not None:
+        actual['con'].close()
+    esquema = pd.DataFrame([
+        {'Tabla': nombre, 'Filas': len(df), 'Columnas': ', '.join(f"{c} ({df[c].dtype})" for c in df.columns)}
+        for nombre, df in tablas.items()
+    ])
+    motor['conexiones'][equipo] = {'versiones': versiones, 'con': con, 'esquema': esquema}
+    return motor['conexiones'][equipo]
+
+def esquema_sql(equipo):
+    """Tablas disponibles en la consola con su número de filas y columnas (tipo pandas)."""
+    motor = get_motor_sql()
+    with motor['lock']:
+        return _conexion_sql(motor, equipo, versiones_sql(equipo))['esquema']
+
+def normalizar_consulta(sql):
+    """Quita comentarios y el ';' final y comprueba que sea una única sentencia SELECT/WITH."""
+    sql = re.sub(r'--[^\n]*|/\*.*?\*/', ' ', sql, flags=re.S).strip().rstrip(';').strip()
+    if not sql:
+        raise ValueError("La consulta está vacía.")
+    if ';' in sql:
+        raise ValueError("Solo se admite una sentencia por consulta.")
+    if not re.match(r'(?is)^(select|with)\b', sql):
+        raise ValueError("Solo se admiten consultas de lectura (SELECT o WITH).")
+    return sql
+
+def _nombres_unicos(columnas):
+    """Renombra columnas repetidas (p. ej. 'Atleta' de dos tablas en un JOIN) como 'Atleta_1', 'Atleta_2'..."""
+    vistos = defaultdict(int)
+    nombres = []
+    for c in columnas:
+        nombres.append(f"{c}_{vistos[c]}" if vistos[c] else c)
+        vistos[c] += 1
+    return nombres
+
+@instrumentar('ejecutar_consulta_sql')
+@st.cache_data(max_entries=200, ttl=3600)
+def ejecutar_consulta_sql(sql, equipo, versiones):
+    """Ejecuta una consulta de solo lectura; el resultado se cachea por (consulta, equipo, versión de los datos).
+
+    Devuelve (df, truncado, segundos). Las consultas que superan SQL_TIEMPO_MAX_S se interrumpen.
+    """
+    registrar_cache_miss('ejecutar_consulta_sql')
+    motor = get_motor_sql()
+    with motor['lock']:
+        con = _conexion_sql(motor, equipo, versiones)['con']
+        temporizador = threading.Timer(SQL_TIEMPO_MAX_S, con.interrupt)
+        inicio = time_mod.perf_counter()
+        temporizador.start()
+        try:
+            if duckdb is not None:
+                df = con.sql(sql).limit(SQL_MAX_FILAS + 1).df()
+            else:
+                cursor = con.execute(sql)
+                df = pd.DataFrame(cursor.fetchmany(SQL_MAX_FILAS + 1), columns=[d[0] for d in cursor.description])
+        finally:
+            temporizador.cancel()
+        segundos = time_mod.perf_counter() - inicio
+    df.columns = _nombres_unicos(df.columns)
+    return df.iloc[:SQL_MAX_FILAS], len(df) > SQL_MAX_FILAS, segundos
+
+def resultado_a_parquet(df):
+    """Bytes Parquet del resultado (las columnas de tipos mezclados se exportan como texto)."""
+    buffer = io.BytesIO()
+    try:
+        df.to_parquet(buffer, index=False)
+    except Exception:
+        buffer = io.BytesIO()
+        mezcladas = {c: df[c].map(lambda v: None if pd.isna(v) else str(v)) for c in df.columns if df[c].dtype == object}
+        df.assign(**mezcladas).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
 
 # --- 3. CARGA DE DATOS AL INICIO DE LA APP Y MUESTREO DE TOASTS ---
 
-df_atletas, initial_status = load_data() 
-df_calendario_full = load_calendar_data() 
-df_calendario = df_calendario_full[df_calendario_full['Habilitado'] == True].copy() 
-df_pruebas_full, tests_status = load_tests_data() 
-df_pruebas = df_pruebas_full[df_pruebas_full['Visible'] == True].copy() 
-df_perfiles, perfil_status = load_perfil_data() 
-df_ranking, ranking_status = load_ranking_data()
-df_readiness, readiness_status = load_readiness_data()
+perfilador_rerun = iniciar_perfilado()
+inicio_rerun = time_mod.perf_counter()
+
+equipo_actual = equipo_sesion()
+
+datasets_sesion = cargar_datasets(equipo_actual, list(LOADERS_DATASET))
+suscribir_sesion(equipo_actual)
+
+df_atletas, initial_status = datasets_sesion['atletas']
+df_calendario_full = datasets_sesion['calendario'][0]
+df_calendario = df_calendario_full[df_calendario_full['Habilitado'] == True]
+df_pruebas_full, tests_status = datasets_sesion['pruebas']
+df_pruebas = df_pruebas_full[df_pruebas_full['Visible'] == True]
+df_perfiles, perfil_status = datasets_sesion['perfiles']
+df_ranking, ranking_status = datasets_sesion['ranking']
+df_readiness, readiness_status = datasets_sesion['readiness']
+df_vam, vam_status = datasets_sesion['vam']
+df_pesajes, pesajes_status = datasets_sesion['pesajes']
+df_plantillas, plantillas_status = datasets_sesion['plantillas']
+df_lesiones, lesiones_status = datasets_sesion['lesiones']
 
 
 # --- 4. FUNCIONES AUXILIARES ---
 
-def check_login(username, password):
-    """Verifica el usuario y contraseña contra el DataFrame."""
-    user_row = df_atletas[df_atletas['Atleta'].str.lower() == username.lower()]
+def check_login(username, password, equipo):
+    """Verifica el usuario y contraseña contra los atletas del equipo seleccionado."""
+    df_equipo = load_data(equipo)[0]
+    user_row = df_equipo[df_equipo['Atleta'].str.lower() == username.lower()]
     
     if not user_row.empty:
         if user_row['Contraseña'].iloc[0] == password:
@@ -305,15 +1596,22 @@ def check_login(username, password):
 
 def login_form():
     """Muestra el formulario de inicio de sesión en el cuerpo principal de la app."""
+    equipos_habilitados = load_equipos_data().query('Habilitado')['Equipo'].tolist() or [EQUIPO_POR_DEFECTO]
+
     with st.form("login_form"):
+        if len(equipos_habilitados) > 1:
+            equipo = st.selectbox("Equipo", options=equipos_habilitados)
+        else:
+            equipo = equipos_habilitados[0]
         username = st.text_input("Usuario (Nombre del Atleta)")
         password = st.text_input("Contraseña", type="password")
         submitted = st.form_submit_button("Entrar")
 
         if submitted:
-            success, rol, atleta_nombre = check_login(username, password)
+            success, rol, atleta_nombre = check_login(username, password, equipo)
             if success:
                 st.session_state['logged_in'] = True
+                st.session_state['equipo'] = equipo
                 st.session_state['rol'] = rol
                 st.session_state['atleta_nombre'] = atleta_nombre
                 st.success(f"Bienvenido, {atleta_nombre} ({rol})!")
@@ -327,6 +1625,7 @@ def logout():
         st.sidebar.button("Cerrar Sesión", on_click=lambda: st.session_state.clear())
         st.sidebar.markdown(f"**Conectado como:** {st.session_state['atleta_nombre']}")
         st.sidebar.markdown(f"**Rol:** {st.session_state['rol']}")
+        st.sidebar.markdown(f"**Equipo:** {equipo_sesion()}")
 
 def calcular_porcentaje_rm(rm_value, porcentaje):
     """Calcula el peso basado en un porcentaje del RM, redondeando a 0.5 kg."""
@@ -361,7 +1660,7 @@ def descomponer_placas(peso_total, peso_barra):
         return "Barra Sola o Peso Inválido", {}
 
     peso_a_cargar = (peso_total - peso_barra) / 2
-    placas_disponibles = [25.0, 20.0, 15.0, 10.0, 5.0, 2.5, 1.25, 0.5] 
+    placas_disponibles = PLACAS_DISPONIBLES
     placas_por_lado = {}
 
     peso_restante = peso_a_cargar
@@ -381,12 +1680,244 @@ def descomponer_placas(peso_total, peso_barra):
 
     return peso_cargado_total, placas_por_lado
 
+# --- BITÁCORA DE AUDITORÍA (MUTACIONES APPEND-ONLY CON REPLAY) ---
+
+def _valor_json(valor):
+    """Normaliza un valor de celda a un tipo serializable en JSON y comparable entre versiones."""
+    if valor is None or (not isinstance(valor, (list, dict, str)) and pd.isna(valor)):
+        return None
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        if valor.hour == 0 and valor.minute == 0 and valor.second == 0:
+            return valor.strftime('%Y-%m-%d')
+        return valor.isoformat()
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor)
+    if isinstance(valor, str):
+        return valor.strip()
+    return valor
+
+def _indexar_por_clave(df, clave):
+    """Indexa el DataFrame por su clave (simple o compuesta) como texto; sin clave usa la posición."""
+    df = df.reset_index(drop=True)
+    if clave is None:
+        claves = df.index.astype(str)
+    else:
+        columnas_clave = [clave] if isinstance(clave, str) else list(clave)
+        claves = df[columnas_clave].map(_valor_json).astype(str).agg(' | '.join, axis=1)
+    df.index = pd.Index(claves, name='_clave')
+    return df[~df.index.duplicated(keep='last')]
+
+def _normalizar_df(df):
+    """Aplica '_valor_json' a todas las celdas conservando None (no NaN) en columnas object."""
+    df_norm = df.astype(object).map(_valor_json).astype(object)
+    return df_norm.where(df_norm.notna(), None)
+
+def calcular_diff_filas(df_antes, df_despues, clave, columnas_ignoradas=()):
+    """Calcula altas, bajas y cambios por fila entre dos versiones de un dataset.
+
+    Las columnas de AUDIT_COLUMNAS_EXCLUIDAS (credenciales) se descartan siempre, además de 'columnas_ignoradas'.
+    """
+    antes = _indexar_por_clave(df_antes, clave)
+    despues = _indexar_por_clave(df_despues, clave)
+
+    excluidas = set(columnas_ignoradas) | set(AUDIT_COLUMNAS_EXCLUIDAS)
+    columnas = [c for c in dict.fromkeys(list(antes.columns) + list(despues.columns)) if c not in excluidas]
+    antes = _normalizar_df(antes.reindex(columns=columnas))
+    despues = _normalizar_df(despues.reindex(columns=columnas))
+
+    cambios = []
+    for k in despues.index.difference(antes.index, sort=False):
+        cambios.append({'op': 'alta', 'clave': k, 'antes': None, 'despues': despues.loc[k].to_dict()})
+    for k in antes.index.difference(despues.index, sort=False):
+        cambios.append({'op': 'baja', 'clave': k, 'antes': antes.loc[k].to_dict(), 'despues': None})
+
+    comunes = antes.index.intersection(despues.index, sort=False)
+    if len(comunes) > 0:
+        valores_antes = antes.loc[comunes].to_numpy()
+        valores_despues = despues.loc[comunes].to_numpy()
+        distintos = valores_antes != valores_despues
+        for fila in np.flatnonzero(distintos.any(axis=1)):
+            cols = np.flatnonzero(distintos[fila])
+            cambios.append({
+                'op': 'cambio',
+                'clave': comunes[fila],
+                'antes': {columnas[c]: valores_antes[fila, c] for c in cols},
+                'despues': {columnas[c]: valores_despues[fila, c] for c in cols},
+            })
+    return cambios
+
+@st.cache_resource
+def get_audit_writer():
+    """Cola compartida y hilo escritor que vuelca la bitácora por lotes sin bloquear la interfaz."""
+    estado = {'cola': queue.Queue(), 'lock': threading.Lock()}
+    hilo = threading.Thread(target=_bucle_auditoria, args=(estado,), daemon=True, name='auditoria-writer')
+    hilo.start()
+    atexit.register(lambda: (estado['cola'].put(None), estado['cola'].join()))
+    return estado
+
+def _escribir_lote_auditoria(estado, lote):
+    """Añade un lote de entradas al final del archivo JSONL de auditoría."""
+    por_equipo = defaultdict(list)
+    for entrada in lote:
+        por_equipo[entrada.get('equipo', EQUIPO_POR_DEFECTO)].append(entrada)
+
+    with estado['lock'], medir_tiempo('auditoria.flush'):
+        for equipo, entradas in por_equipo.items():
+            with open(ruta_equipo(AUDIT_LOG_FILE, equipo), 'a', encoding='utf-8') as f:
+                for entrada in entradas:
+                    f.write(json.dumps(entrada, ensure_ascii=False, default=str) + '\n')
+
+def _bucle_auditoria(estado):
+    """Agrupa entradas hasta AUDIT_BATCH_SIZE o AUDIT_FLUSH_SECONDS; un None fuerza el volcado inmediato."""
+    cola = estado['cola']
+    while True:
+        entrada = cola.get()
+        recibidas = 1
+        lote = []
+        limite = time_mod.monotonic() + AUDIT_FLUSH_SECONDS
+        while entrada is not None:
+            lote.append(entrada)
+            restante = limite - time_mod.monotonic()
+            if len(lote) >= AUDIT_BATCH_SIZE or restante <= 0:
+                break
+            try:
+                entrada = cola.get(timeout=restante)
+                recibidas += 1
+            except queue.Empty:
+                break
+        try:
+            if lote:
+                _escribir_lote_auditoria(estado, lote)
+        except Exception:
+            logger.exception("Error al escribir la bitácora de auditoría")
+        finally:
+            for _ in range(recibidas):
+                cola.task_done()
+
+def flush_auditoria():
+    """Espera a que todas las entradas pendientes estén escritas en disco."""
+    cola = get_audit_writer()['cola']
+    cola.put(None)
+    cola.join()
+
+def registrar_mutacion(dataset, df_antes, df_despues, clave, columnas_ignoradas=(), equipo=None, actor=None):
+    """Encola en la bitácora el diff por filas de un guardado, con actor y marca de tiempo.
+
+    Las tareas en segundo plano (sin sesión) indican 'equipo' y 'actor' explícitamente.
+    """
+    try:
+        cambios = calcular_diff_filas(df_antes, df_despues, clave, columnas_ignoradas)
+    except Exception:
+        logger.exception("No se pudo calcular el diff de auditoría de '%s'", dataset)
+        return 0
+    if not cambios:
+        return 0
+
+    get_audit_writer()['cola'].put({
+        'ts': datetime.now().isoformat(timespec='seconds'),
+        'equipo': equipo or equipo_sesion(),
+        'actor': actor or st.session_state.get('atleta_nombre', 'sistema'),
+        'rol': None if actor else st.session_state.get('rol'),
+        'dataset': dataset,
+        'clave': clave,
+        'cambios': cambios,
+    })
+    return len(cambios)
+
+@st.cache_resource
+def get_lector_auditoria():
+    """Entradas ya parseadas de cada bitácora y el desplazamiento (bytes) hasta el que se leyó."""
+    return {'lock': threading.Lock(), 'rutas': {}}
+
+def leer_auditoria(dataset=None):
+    """Lee la bitácora del equipo de la sesión, opcionalmente filtrada por dataset.
+
+    No espera al hilo escritor: solo parsea las líneas completas añadidas desde la última lectura
+    (lo que aún está en la cola aparece en la siguiente). Si el archivo encoge, se relee entero.
+    """
+    ruta = ruta_equipo(AUDIT_LOG_FILE, equipo_sesion())
+    lector = get_lector_auditoria()
+    with lector['lock']:
+        cache = lector['rutas'].setdefault(ruta, {'offset': 0, 'entradas': []})
+        tamano = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+        if tamano < cache['offset']:
+            cache.update(offset=0, entradas=[])
+        if tamano > cache['offset']:
+            with open(ruta, 'rb') as f:
+                f.seek(cache['offset'])
+                bloque = f.read(tamano - cache['offset'])
+            completo = bloque[:bloque.rfind(b'\n') + 1]
+            nuevas = []
+            for linea in completo.decode('utf-8').splitlines():
+                if not linea.strip():
+                    continue
+                try:
+                    nuevas.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    continue
+            cache['offset'] += len(completo)
+            if nuevas:
+                cache['entradas'] = sorted(cache['entradas'] + nuevas, key=lambda e: e['ts'])
+        entradas = cache['entradas']
+    return [e for e in entradas if dataset is None or e.get('dataset') == dataset]
+
+def aplicar_cambios(df, clave, cambios, inverso=False):
+    """Aplica (o deshace, si 'inverso') una lista de cambios por fila sobre un DataFrame."""
+    df_idx = _indexar_por_clave(df, clave).astype(object)
+    for cambio in (reversed(cambios) if inverso else cambios):
+        op = cambio['op']
+        destino = cambio['antes'] if inverso else cambio['despues']
+        if inverso:
+            op = {'alta': 'baja', 'baja': 'alta'}.get(op, op)
+        k = cambio['clave']
+
+        if op == 'baja':
+            df_idx = df_idx.drop(index=k, errors='ignore')
+        elif op == 'alta':
+            for col in destino:
+                if col not in df_idx.columns:
+                    df_idx[col] = None
+            df_idx.loc[k] = pd.Series(destino)
+        elif k in df_idx.index:
+            for col, valor in destino.items():
+                if col not in df_idx.columns:
+                    df_idx[col] = None
+                df_idx.at[k, col] = valor
+    return df_idx.reset_index(drop=True)
+
+def reconstruir_dataset(dataset, df_referencia, fecha_referencia, fecha_objetivo):
+    """Reconstruye el estado de un dataset en 'fecha_objetivo' reproduciendo la bitácora sobre una instantánea.
+
+    Si la fecha objetivo es posterior a la instantánea se aplican los cambios hacia adelante;
+    si es anterior se deshacen, del más reciente al más antiguo.
+    """
+    ref = fecha_referencia.isoformat(timespec='seconds')
+    obj = fecha_objetivo.isoformat(timespec='seconds')
+    # Solo se llama desde la vista previa de restauración (a demanda): aquí sí se espera a que la bitácora esté volcada
+    flush_auditoria()
+    entradas = leer_auditoria(dataset)
+    df = df_referencia
+
+    if obj >= ref:
+        for entrada in [e for e in entradas if ref < e['ts'] <= obj]:
+            df = aplicar_cambios(df, entrada['clave'], entrada['cambios'])
+    else:
+        for entrada in reversed([e for e in entradas if obj < e['ts'] <= ref]):
+            df = aplicar_cambios(df, entrada['clave'], entrada['cambios'], inverso=True)
+    return df
+
+@instrumentar('save_main_data')
 def save_main_data(df_edited):
     """Guarda el DataFrame editado de atletas en el archivo XLSX, forzando Última_Fecha al final."""
     try:
         # 1. Limpieza y preparación
         df_edited.columns = df_edited.columns.str.strip()
         df_edited = df_edited.dropna(subset=['Atleta', 'Contraseña'], how='any')
+        df_edited = asignar_ids_nuevos(df_edited)
 
         # Convertir a fecha compatible (solo la columna que se sabe que es fecha)
         if 'Última_Fecha' in df_edited.columns:
@@ -402,22 +1933,28 @@ def save_main_data(df_edited):
         valid_cols = [col for col in cols if not pd.isna(df_edited[col]).all()]
         df_to_save = df_edited[valid_cols].copy()
         
+        equipo = equipo_sesion()
+        df_antes = load_data(equipo)[0]
+
         # 3. Sobrescribir el archivo Excel
-        df_to_save.to_excel(EXCEL_FILE, index=False, engine='openpyxl')
+        escribir_excel(df_to_save, ruta_equipo(EXCEL_FILE, equipo))
+        registrar_mutacion('atletas', df_antes, df_to_save, 'ID')
         
-        # 4. Limpiar la caché de los datos principales
-        load_data.clear()
+        # 4. Invalidar la caché de los datos principales (solo la del equipo) y avisar a las demás sesiones
+        publicar_cambio('atletas', equipo, origen=sesion_actual_id())
         
         return True
     except Exception as e:
         st.error(f"Error al guardar los datos de atletas: {e}")
         return False
 
+@instrumentar('save_readiness_data')
 def save_readiness_data(atleta, fecha, sueno, molestias, disposicion):
     """Añade una nueva fila al archivo readiness_data.xlsx, actualiza el archivo y el DataFrame global."""
     
+    equipo = equipo_sesion()
     try:
-        current_df, _ = load_readiness_data()
+        current_df, _ = load_readiness_data(equipo)
         if current_df.empty:
              current_df = pd.DataFrame(columns=READINESS_REQUIRED_COLUMNS)
     except Exception:
@@ -436,16 +1973,22 @@ def save_readiness_data(atleta, fecha, sueno, molestias, disposicion):
     df_updated = pd.concat([current_df, new_df], ignore_index=True)
     
     try:
-        df_updated.to_excel(READINESS_FILE, index=False, engine='openpyxl')
-        load_readiness_data.clear() 
-        return load_readiness_data()[0], True
+        escribir_excel(df_updated, ruta_equipo(READINESS_FILE, equipo))
+        registrar_mutacion('readiness', current_df, df_updated, None)
+        publicar_cambio('readiness', equipo, origen=sesion_actual_id())
+        return load_readiness_data(equipo)[0], True
         
     except Exception as e:
         st.error(f"Error al guardar los datos de bienestar: {e}")
         return current_df, False
     
+@instrumentar('save_tests_data')
 def save_tests_data(df_edited):
     """Guarda el DataFrame editado de pruebas activas en el archivo XLSX."""
+    equipo = equipo_sesion()
+    df_antes = load_tests_data(equipo)[0]
+    df_despues = df_edited.copy()
+
     # 1. Aseguramos que la columna 'Visible' tenga 'Sí' o 'No' al guardar en Excel
     df_edited['Visible'] = df_edited['Visible'].apply(lambda x: 'Sí' if x else 'No')
     
@@ -454,18 +1997,24 @@ def save_tests_data(df_edited):
     
     try:
         # 2. Sobrescribir el archivo Excel
-        df_to_save.to_excel(PRUEBAS_FILE, index=False, engine='openpyxl')
+        escribir_excel(df_to_save, ruta_equipo(PRUEBAS_FILE, equipo))
+        registrar_mutacion('pruebas', df_antes, df_despues, 'NombrePrueba')
         
-        # 3. Limpiar la caché de las pruebas para que la calculadora se actualice
-        load_tests_data.clear()
+        # 3. Invalidar la caché de las pruebas para que la calculadora se actualice en todas las sesiones
+        publicar_cambio('pruebas', equipo, origen=sesion_actual_id())
         
         return True
     except Exception as e:
         st.error(f"Error al guardar las pruebas: {e}")
         return False
 
+@instrumentar('save_calendar_data')
 def save_calendar_data(df_edited):
     """Guarda el DataFrame editado de calendario en el archivo XLSX."""
+    equipo = equipo_sesion()
+    df_antes = load_calendar_data(equipo)
+    df_despues = df_edited.dropna(subset=['Evento', 'Fecha'], how='any')[CALENDAR_REQUIRED_COLUMNS]
+
     # 1. Aseguramos que la columna 'Habilitado' tenga 'Sí' o 'No' al guardar en Excel
     df_edited['Habilitado'] = df_edited['Habilitado'].apply(lambda x: 'Sí' if x else 'No')
     df_edited_cleaned = df_edited.dropna(subset=['Evento', 'Fecha'], how='any') # Limpiar filas sin datos esenciales
@@ -475,16 +2024,18 @@ def save_calendar_data(df_edited):
     
     try:
         # 3. Sobrescribir el archivo Excel
-        df_to_save.to_excel(CALENDAR_FILE, index=False, engine='openpyxl')
+        escribir_excel(df_to_save, ruta_equipo(CALENDAR_FILE, equipo))
+        registrar_mutacion('calendario', df_antes, df_despues, ['Evento', 'Fecha'])
         
-        # 4. Limpiar la caché del calendario para que se actualice
-        load_calendar_data.clear()
+        # 4. Invalidar la caché del calendario y avisar a las demás sesiones
+        publicar_cambio('calendario', equipo, origen=sesion_actual_id())
         
         return True
     except Exception as e:
         st.error(f"Error al guardar el calendario: {e}")
         return False
 
+@instrumentar('save_ranking_data')
 def save_ranking_data(df_edited):
     """Guarda el DataFrame editado del ranking, recalculando y ordenando primero."""
     
@@ -498,13 +2049,1919 @@ def save_ranking_data(df_edited):
     df_to_save = df_sorted[RANKING_REQUIRED_COLUMNS]
     
     try:
-        df_to_save.to_excel(RANKING_FILE, index=False, engine='openpyxl')
-        load_ranking_data.clear() 
+        equipo = equipo_sesion()
+        df_antes = load_ranking_data(equipo)[0]
+        escribir_excel(df_to_save, ruta_equipo(RANKING_FILE, equipo))
+        registrar_mutacion('ranking', df_antes, df_to_save, 'Atleta', columnas_ignoradas=('Posicion', 'Puntos'))
+        publicar_cambio('ranking', equipo, origen=sesion_actual_id())
         return True
     except Exception as e:
         st.error(f"Error al guardar el ranking: {e}")
         return False
 
+@instrumentar('save_perfil_data')
+def save_perfil_data(df_edited):
+    """Guarda el DataFrame completo de perfiles en el archivo XLSX."""
+    df_cleaned = df_edited.dropna(subset=['Atleta'], how='any').copy()
+
+    try:
+        equipo = equipo_sesion()
+        df_antes = load_perfil_data(equipo)[0]
+        escribir_excel(df_cleaned, ruta_equipo(PERFILES_FILE, equipo))
+        registrar_mutacion('perfiles', df_antes, df_cleaned, 'Atleta')
+        publicar_cambio('perfiles', equipo, origen=sesion_actual_id())
+        return True
+    except Exception as e:
+        st.error(f"Error al guardar los perfiles: {e}")
+        return False
+
+@instrumentar('save_plantillas_data')
+def save_plantillas_data(df_edited):
+    """Guarda el DataFrame completo de plantillas de periodización en el archivo XLSX."""
+    df_cleaned = df_edited.dropna(subset=['Plantilla', 'Ejercicio'], how='any')[PLANTILLAS_REQUIRED_COLUMNS].copy()
+
+    try:
+        equipo = equipo_sesion()
+        df_antes = load_plantillas_data(equipo)[0]
+        escribir_excel(df_cleaned, ruta_equipo(PLANTILLAS_FILE, equipo))
+        registrar_mutacion('plantillas', df_antes, df_cleaned, DATASETS_EDITABLES['plantillas']['clave_auditoria'])
+        publicar_cambio('plantillas', equipo, origen=sesion_actual_id())
+        return True
+    except Exception as e:
+        st.error(f"Error al guardar las plantillas: {e}")
+        return False
+
+def save_lesiones_data(df_edited):
+    """Guarda el DataFrame completo del registro de lesiones en el archivo XLSX."""
+    df_cleaned = df_edited.dropna(subset=['Atleta', 'Region'], how='any').reindex(columns=LESIONES_REQUIRED_COLUMNS)
+
+    try:
+        equipo = equipo_sesion()
+        df_antes = load_lesiones_data(equipo)[0]
+        escribir_excel(df_cleaned, ruta_equipo(LESIONES_FILE, equipo))
+        registrar_mutacion('lesiones', df_antes, df_cleaned, DATASETS_EDITABLES['lesiones']['clave_auditoria'])
+        publicar_cambio('lesiones', equipo, origen=sesion_actual_id())
+        return True
+    except Exception as e:
+        st.error(f"Error al guardar el registro de lesiones: {e}")
+        return False
+
+def get_dataset_actual(dataset):
+    """Devuelve la versión actual (cacheada) de un dataset auditable del equipo de la sesión."""
+    equipo = equipo_sesion()
+    if dataset == 'atletas':
+        return load_data(equipo)[0]
+    if dataset == 'calendario':
+        return load_calendar_data(equipo)
+    if dataset == 'pruebas':
+        return load_tests_data(equipo)[0]
+    if dataset == 'ranking':
+        return load_ranking_data(equipo)[0]
+    if dataset == 'readiness':
+        return load_readiness_data(equipo)[0]
+    if dataset == 'perfiles':
+        return load_perfil_data(equipo)[0]
+    if dataset == 'vam':
+        return load_vam_data(equipo)[0]
+    if dataset == 'pesajes':
+        return load_pesajes_data(equipo)[0]
+    if dataset == 'plantillas':
+        return load_plantillas_data(equipo)[0]
+    if dataset == 'lesiones':
+        return load_lesiones_data(equipo)[0]
+    raise ValueError(f"Dataset desconocido: {dataset}")
+
+def restaurar_dataset(dataset, df_restaurado):
+    """Guarda una versión reconstruida usando el guardado normal del dataset (queda registrada en la bitácora)."""
+    if dataset == 'atletas':
+        return save_main_data(df_restaurado)
+    if dataset == 'calendario':
+        df_restaurado['Habilitado'] = df_restaurado['Habilitado'].astype(bool)
+        return save_calendar_data(df_restaurado)
+    if dataset == 'pruebas':
+        df_restaurado['Visible'] = df_restaurado['Visible'].astype(bool)
+        return save_tests_data(df_restaurado)
+    if dataset == 'ranking':
+        return save_ranking_data(df_restaurado)
+    if dataset == 'perfiles':
+        return save_perfil_data(df_restaurado)
+    if dataset == 'plantillas':
+        return save_plantillas_data(df_restaurado)
+    if dataset == 'lesiones':
+        return save_lesiones_data(df_restaurado)
+    st.error(f"El dataset '{dataset}' no admite restauración.")
+    return False
+
+# --- GUARDADO POR DELTAS DEL EDITOR (SOLO FILAS MODIFICADAS) ---
+
+# Configuración de cada dataset editable: archivo, clave de fila, columnas obligatorias y columnas Sí/No
+DATASETS_EDITABLES = {
+    'atletas': {'archivo': EXCEL_FILE, 'clave': 'ID', 'requeridas': ['Atleta', 'Contraseña'], 'booleanas': []},
+    'calendario': {'archivo': CALENDAR_FILE, 'clave': 'Evento', 'clave_auditoria': ['Evento', 'Fecha'], 'requeridas': ['Evento', 'Fecha'], 'booleanas': ['Habilitado']},
+    'pruebas': {'archivo': PRUEBAS_FILE, 'clave': 'NombrePrueba', 'requeridas': ['NombrePrueba', 'ColumnaRM'], 'booleanas': ['Visible']},
+    'ranking': {'archivo': RANKING_FILE, 'clave': 'Atleta', 'requeridas': ['Atleta'], 'booleanas': []},
+    'perfiles': {'archivo': PERFILES_FILE, 'clave': 'Atleta', 'requeridas': ['Atleta'], 'booleanas': []},
+    'vam': {'archivo': VAM_FILE, 'clave': None, 'requeridas': ['Atleta', 'VAM_kmh'], 'booleanas': []},
+    'pesajes': {'archivo': PESAJES_FILE, 'clave': None, 'requeridas': ['Atleta', 'Peso_kg'], 'booleanas': []},
+    'plantillas': {'archivo': PLANTILLAS_FILE, 'clave': 'Plantilla', 'clave_auditoria': ['Plantilla', 'Semana', 'Dia', 'Ejercicio'], 'requeridas': ['Plantilla', 'Ejercicio'], 'booleanas': []},
+    'lesiones': {'archivo': LESIONES_FILE, 'clave': 'Atleta', 'clave_auditoria': ['Atleta', 'Region', 'Inicio'], 'requeridas': ['Atleta', 'Region', 'Inicio'], 'booleanas': []},
+}
+
+def sesion_actual_id():
+    """Identificador de la sesión de Streamlit que ejecuta el script (None fuera de una sesión)."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def limpiar_cache_dataset(dataset):
+    """Invalida únicamente la entrada de caché del dataset indicado para el equipo de la sesión y avisa al bus."""
+    publicar_cambio(dataset, equipo_sesion(), origen=sesion_actual_id())
+
+def asignar_ids_nuevos(df):
+    """Asigna IDs consecutivos a las filas sin ID de forma vectorizada (admite IDs tipo 'RUU426')."""
+    if 'ID' not in df.columns:
+        return df
+    sin_id = df['ID'].isna()
+    if not sin_id.any():
+        return df
+
+    ids = df.loc[~sin_id, 'ID'].astype(str).str.strip()
+    partes = ids.str.extract(r'^(\D*)(\d+)$')
+    numeros = pd.to_numeric(partes[1], errors='coerce')
+    max_num = int(numeros.max()) if numeros.notna().any() else 0
+    nuevos_num = max_num + np.arange(1, int(sin_id.sum()) + 1)
+
+    df = df.copy()
+    prefijos = partes[0].dropna()
+    if prefijos.empty or (prefijos == '').all():
+        df['ID'] = df['ID'].astype(object)
+        df.loc[sin_id, 'ID'] = nuevos_num
+    else:
+        prefijo = prefijos.mode().iloc[0]
+        ancho = int(partes[1].dropna().str.len().max())
+        df.loc[sin_id, 'ID'] = prefijo + pd.Series(nuevos_num).astype(str).str.zfill(ancho).to_numpy()
+    return df
+
+def extraer_deltas_editor(df_mostrado, df_editado, estado_editor):
+    """Traduce el estado de st.data_editor (posiciones) a etiquetas de fila del DataFrame mostrado."""
+    estado_editor = estado_editor or {}
+    borradas = [df_mostrado.index[int(p)] for p in estado_editor.get('deleted_rows', [])]
+    editadas = {}
+    for pos, columnas in estado_editor.get('edited_rows', {}).items():
+        etiqueta = df_mostrado.index[int(pos)]
+        if etiqueta not in borradas:
+            editadas[etiqueta] = [c for c in columnas if c in df_editado.columns]
+    nuevas = df_editado.loc[df_editado.index.difference(df_mostrado.index, sort=False)]
+    return {'editadas': editadas, 'borradas': borradas, 'nuevas': nuevas}
+
+def aplicar_deltas(df_completo, df_editado, deltas):
+    """Aplica las deltas del editor sobre el DataFrame completo (el mostrado puede ser solo una página)."""
+    df_nuevo = df_completo.drop(index=deltas['borradas'])
+    for etiqueta, columnas in deltas['editadas'].items():
+        for col in columnas:
+            if col not in df_nuevo.columns:
+                df_nuevo[col] = None
+            df_nuevo.at[etiqueta, col] = df_editado.at[etiqueta, col]
+
+    nuevas = deltas['nuevas']
+    if not nuevas.empty:
+        inicio = int(df_completo.index.max()) + 1 if len(df_completo) else 0
+        nuevas = nuevas.set_axis(pd.RangeIndex(inicio, inicio + len(nuevas)))
+        deltas['nuevas'] = nuevas
+        df_nuevo = pd.concat([df_nuevo, nuevas])
+    return df_nuevo
+
+def _valor_excel(valor, booleana=False):
+    """Convierte un valor de pandas al tipo nativo que openpyxl escribe en una celda."""
+    if booleana:
+        return 'Sí' if valor is True or valor == 1 or str(valor).lower() in ('true', 'sí') else 'No'
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, pd.Timestamp):
+        valor = valor.to_pydatetime()
+    if isinstance(valor, datetime) and valor.time() == time(0, 0):
+        return valor.date()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+def escribir_deltas_excel(ruta, df_base, df_nuevo, deltas, clave, booleanas=()):
+    """Parchea en el XLSX solo las celdas editadas, las filas nuevas y las borradas.
+
+    La fila de Excel de cada etiqueta es 'etiqueta + 2' (encabezado + base 1), válido para los
+    DataFrames que salen de los loaders. Antes de escribir se comprueba que la clave de cada fila
+    coincide; si el archivo cambió por fuera devuelve False y no toca nada.
+    """
+    with bloqueo_archivo(ruta), medir_tiempo(f"patch_excel.{os.path.basename(ruta)}"):
+        libro = openpyxl.load_workbook(ruta)
+        hoja = libro.active
+        encabezados = {str(c.value).strip(): c.column for c in hoja[1] if c.value is not None}
+
+        col_clave = encabezados.get(clave)
+        for etiqueta in list(deltas['editadas']) + list(deltas['borradas']):
+            if col_clave is None or not isinstance(etiqueta, (int, np.integer)):
+                return False
+            if _valor_json(hoja.cell(int(etiqueta) + 2, col_clave).value) != _valor_json(df_base.at[etiqueta, clave]):
+                return False
+
+        for etiqueta, columnas in deltas['editadas'].items():
+            for col in columnas:
+                if col not in encabezados:
+                    encabezados[col] = hoja.max_column + 1
+                    hoja.cell(1, encabezados[col]).value = col
+                hoja.cell(int(etiqueta) + 2, encabezados[col]).value = _valor_excel(df_nuevo.at[etiqueta, col], col in booleanas)
+
+        for etiqueta in sorted(deltas['borradas'], reverse=True):
+            hoja.delete_rows(int(etiqueta) + 2)
+
+        for col in deltas['nuevas'].columns:
+            if col not in encabezados:
+                encabezados[col] = hoja.max_column + 1
+                hoja.cell(1, encabezados[col]).value = col
+        # Las filas vacías con formato al final de la hoja no cuentan: se escribe tras la última con datos
+        ultima_fila = hoja.max_row
+        while ultima_fila > 1 and all(c.value is None for c in hoja[ultima_fila]):
+            ultima_fila -= 1
+        for desplazamiento, registro in enumerate(deltas['nuevas'].to_dict('records'), start=1):
+            for col, valor in registro.items():
+                hoja.cell(ultima_fila + desplazamiento, encabezados[col]).value = _valor_excel(valor, col in booleanas)
+
+        libro.save(ruta)
+    return True
+
+@instrumentar('guardar_cambios_editor')
+def guardar_cambios_editor(dataset, df_completo, df_mostrado, df_editado, editor_key):
+    """Guarda solo las filas que cambiaron en un st.data_editor.
+
+    Devuelve None si no hay cambios, True si se guardó y False si hubo un error.
+    """
+    config = DATASETS_EDITABLES[dataset]
+    deltas = extraer_deltas_editor(df_mostrado, df_editado, st.session_state.get(editor_key))
+    if not (deltas['editadas'] or deltas['borradas'] or len(deltas['nuevas'])):
+        return None
+
+    df_completo = a_objeto(df_completo)
+    try:
+        df_nuevo = aplicar_deltas(df_completo, df_editado, deltas)
+
+        # Igual que en el guardado completo: las filas sin datos obligatorios se descartan
+        afectadas = list(deltas['editadas']) + list(deltas['nuevas'].index)
+        incompletas = df_nuevo.loc[afectadas, config['requeridas']].isna().any(axis=1)
+        incompletas = incompletas[incompletas].index
+        if len(incompletas):
+            df_nuevo = df_nuevo.drop(index=incompletas)
+            deltas['borradas'] += [e for e in incompletas if e in deltas['editadas']]
+            deltas['editadas'] = {e: c for e, c in deltas['editadas'].items() if e not in incompletas}
+            deltas['nuevas'] = deltas['nuevas'].drop(index=incompletas, errors='ignore')
+
+        if dataset == 'atletas' and len(deltas['nuevas']):
+            df_nuevo = asignar_ids_nuevos(df_nuevo)
+            deltas['nuevas'] = df_nuevo.loc[deltas['nuevas'].index]
+
+        if dataset == 'ranking':
+            # Solo se reescriben las posiciones que cambian tras recalcular el orden
+            posicion_antes = df_completo['Posicion']
+            df_nuevo = calculate_and_sort_ranking(df_nuevo)
+            comunes = df_nuevo.index.intersection(posicion_antes.index)
+            movidas = comunes[df_nuevo.loc[comunes, 'Posicion'].to_numpy() != posicion_antes.loc[comunes].to_numpy()]
+            for etiqueta in movidas:
+                deltas['editadas'].setdefault(etiqueta, [])
+                if 'Posicion' not in deltas['editadas'][etiqueta]:
+                    deltas['editadas'][etiqueta].append('Posicion')
+            deltas['nuevas'] = df_nuevo.loc[deltas['nuevas'].index, RANKING_REQUIRED_COLUMNS]
+
+        if not validar_guardado(dataset, df_completo, df_nuevo, list(deltas['editadas']) + list(deltas['nuevas'].index)):
+            return False
+
+        parcheado = escribir_deltas_excel(
+            ruta_equipo(config['archivo'], equipo_sesion()), df_completo, df_nuevo, deltas, config['clave'], config['booleanas']
+        )
+        if not parcheado:
+            # El archivo no coincide con la versión en caché: guardado completo como respaldo
+            return restaurar_dataset(dataset, df_nuevo.drop(columns=['Puntos'], errors='ignore'))
+
+        etiquetas_antes = [e for e in list(deltas['editadas']) + list(deltas['borradas']) if e in df_completo.index]
+        etiquetas_despues = [e for e in list(deltas['editadas']) + list(deltas['nuevas'].index) if e in df_nuevo.index]
+        registrar_mutacion(
+            dataset, df_completo.loc[etiquetas_antes], df_nuevo.loc[etiquetas_despues], config.get('clave_auditoria', config['clave']),
+            columnas_ignoradas=('Posicion', 'Puntos')
+        )
+
+        limpiar_cache_dataset(dataset)
+        return True
+    except Exception as e:
+        st.error(f"Error al guardar los cambios de {dataset}: {e}")
+        return False
+
+@instrumentar('actualizar_celdas')
+def actualizar_celdas(dataset, df_completo, cambios):
+    """Actualiza celdas sueltas ({etiqueta: {columna: valor}}) con el mismo parcheo por deltas que los editores."""
+    config = DATASETS_EDITABLES[dataset]
+    df_completo = a_objeto(df_completo)
+    df_nuevo = df_completo.copy()
+    for etiqueta, campos in cambios.items():
+        for col, valor in campos.items():
+            if col not in df_nuevo.columns or isinstance(valor, str):
+                df_nuevo[col] = df_nuevo[col].astype(object) if col in df_nuevo.columns else None
+            df_nuevo.at[etiqueta, col] = valor
+    etiquetas = list(cambios)
+    deltas = {'editadas': {e: list(c) for e, c in cambios.items()}, 'borradas': [], 'nuevas': df_nuevo.iloc[0:0]}
+    if not validar_guardado(dataset, df_completo, df_nuevo, etiquetas):
+        return False
+
+    try:
+        ruta = ruta_equipo(config['archivo'], equipo_sesion())
+        if not escribir_deltas_excel(ruta, df_completo, df_nuevo, deltas, config['clave'], config['booleanas']):
+            return restaurar_dataset(dataset, df_nuevo)
+        registrar_mutacion(dataset, df_completo.loc[etiquetas], df_nuevo.loc[etiquetas], config.get('clave_auditoria', config['clave']))
+        limpiar_cache_dataset(dataset)
+        return True
+    except Exception as e:
+        st.error(f"Error al actualizar {dataset}: {e}")
+        return False
+
+def actualizar_campos_fila(dataset, df_completo, etiqueta, campos):
+    """Actualiza unas celdas de una sola fila (atajo de actualizar_celdas)."""
+    return actualizar_celdas(dataset, df_completo, {etiqueta: campos})
+
+@instrumentar('anexar_filas_dataset')
+def anexar_filas_dataset(dataset, df_actual, df_nuevas):
+    """Añade filas al final del XLSX de un registro append-only sin reescribir el archivo."""
+    config = DATASETS_EDITABLES[dataset]
+    df_nuevas = df_nuevas.dropna(subset=config['requeridas'], how='any')
+    if df_nuevas.empty:
+        return False
+    df_combinado = pd.concat([df_actual, df_nuevas], ignore_index=True)
+    if not validar_guardado(dataset, df_actual, df_combinado, df_combinado.index[len(df_actual):]):
+        return False
+    deltas = {'editadas': {}, 'borradas': [], 'nuevas': df_nuevas}
+
+    try:
+        ruta = ruta_equipo(config['archivo'], equipo_sesion())
+        if not os.path.exists(ruta) or not escribir_deltas_excel(ruta, df_actual, df_nuevas, deltas, config['clave'], config['booleanas']):
+            escribir_excel(df_combinado, ruta)
+        registrar_mutacion(dataset, df_actual.iloc[0:0], df_nuevas, None)
+        limpiar_cache_dataset(dataset)
+        return True
+    except Exception as e:
+        st.error(f"Error al guardar en {dataset}: {e}")
+        return False
+
+# --- ZONAS DE FRECUENCIA CARDÍACA PERSONALIZADAS (TODO EL EQUIPO) ---
+
+ZONAS_PORCENTAJES = np.array([0.50, 0.60, 0.70, 0.80, 0.90, 1.00])
+
+@instrumentar('calcular_zonas_equipo')
+@st.cache_data(max_entries=50)
+def calcular_zonas_equipo(_df_perfiles, equipo, version):
+    """Calcula de una vez las zonas de todo el equipo (se recalcula solo cuando cambia el archivo de perfiles).
+
+    FC Máx: la medida si existe, si no Tanaka (208 - 0.7 * edad). Modelo '% FC Máx' o Karvonen
+    (reserva de FC: reposo + % * (máx - reposo)). Devuelve la tabla ancha (una fila por atleta)
+    y la tabla larga (Atleta, Zona) lista para graficar.
+    """
+    registrar_cache_miss('calcular_zonas_equipo')
+    df = _df_perfiles
+    n = len(df)
+
+    edad = pd.to_numeric(df['Edad'], errors='coerce') if 'Edad' in df.columns else pd.Series(np.nan, index=df.index)
+    tanaka = (208 - 0.7 * edad.where(edad > 0)).round()
+    medida = pd.to_numeric(df.get('FC_Max_Medida', pd.Series(np.nan, index=df.index)), errors='coerce')
+    fc_max = medida.where(medida > 0, tanaka).to_numpy(dtype=float)
+    reposo = pd.to_numeric(df.get('FC_Reposo', pd.Series(np.nan, index=df.index)), errors='coerce').fillna(FC_REPOSO_POR_DEFECTO).to_numpy(dtype=float)
+    modelo = df.get('Modelo_Zonas', pd.Series(None, index=df.index)).astype(object).fillna(MODELOS_ZONAS[0]).astype(str)
+    karvonen = modelo.str.lower().str.contains('karvonen').to_numpy()
+
+    base = np.where(karvonen, reposo, 0.0)[:, None]
+    rango = np.where(karvonen, fc_max - reposo, fc_max)[:, None]
+    limites = np.round(base + rango * ZONAS_PORCENTAJES[None, :])
+
+    df_ancho = pd.DataFrame({
+        'Atleta': df['Atleta'].to_numpy(),
+        'FC_Max': fc_max,
+        'Fuente FC Máx': np.where(medida.where(medida > 0).notna(), 'Medida', 'Tanaka'),
+        'FC_Reposo': reposo,
+        'Modelo': np.where(karvonen, MODELOS_ZONAS[1], MODELOS_ZONAS[0]),
+    })
+    for z in range(5):
+        df_ancho[f'Z{z + 1} Mín'] = limites[:, z]
+        df_ancho[f'Z{z + 1} Máx'] = limites[:, z + 1]
+
+    nombres_zona = ZONAS_FC_NOMBRES[1:]
+    df_largo = pd.DataFrame({
+        'Atleta': np.repeat(df['Atleta'].to_numpy(), 5),
+        'Zona': np.tile(nombres_zona, n),
+        'Mínimo (ppm)': limites[:, :5].ravel(),
+        'Máximo (ppm)': limites[:, 1:].ravel(),
+    }).set_index(['Atleta', 'Zona'])
+
+    return df_ancho, df_largo
+
+# --- PRUEBAS DE VAM: RITMOS DEL EQUIPO Y PREDICCIONES (RIEGEL) ---
+
+def calcular_vam_kmh(tipo, distancia_m, tiempo_s):
+    """VAM (km/h) a partir de una prueba: velocidad media corregida por la fracción de VAM que se sostiene."""
+    if not tiempo_s or not distancia_m:
+        return np.nan
+    return (distancia_m / tiempo_s) * 3.6 / TIPOS_PRUEBA_VAM.get(tipo, 1.0)
+
+@instrumentar('save_vam_result')
+def save_vam_result(atleta, fecha, tipo, distancia_m, tiempo_s):
+    """Registra un resultado de prueba de VAM (se añade como fila nueva, nunca se sobreescribe)."""
+    df_actual = load_vam_data(equipo_sesion())[0]
+    nueva = pd.DataFrame([{
+        'Atleta': atleta,
+        'Fecha': pd.to_datetime(fecha),
+        'Tipo': tipo,
+        'Distancia_m': distancia_m,
+        'Tiempo_s': tiempo_s,
+        'VAM_kmh': round(calcular_vam_kmh(tipo, distancia_m, tiempo_s), 2),
+    }], columns=VAM_REQUIRED_COLUMNS)
+    return anexar_filas_dataset('vam', df_actual, nueva)
+
+def formatear_tiempo(segundos):
+    """Formatea segundos como 'm:ss' (o 'h:mm:ss') de forma vectorizada; valores no válidos -> 'N/D'."""
+    seg = np.asarray(segundos, dtype=float)
+    valido = np.isfinite(seg) & (seg > 0)
+    total = np.where(valido, np.round(seg), 0).astype(np.int64).ravel()
+    horas, resto = np.divmod(total, 3600)
+    minutos, segs = np.divmod(resto, 60)
+    mm = pd.Series(minutos).astype(str)
+    ss = pd.Series(segs).astype(str).str.zfill(2)
+    texto = np.where(horas > 0, pd.Series(horas).astype(str) + ':' + mm.str.zfill(2) + ':' + ss, mm + ':' + ss)
+    return np.where(valido.ravel(), texto, 'N/D').reshape(seg.shape)
+
+@instrumentar('ultimas_pruebas_vam')
+@st.cache_data(max_entries=50)
+def ultimas_pruebas_vam(_df_vam, equipo, version):
+    """Última prueba válida de cada atleta (una fila por atleta, indexada por 'Atleta')."""
+    registrar_cache_miss('ultimas_pruebas_vam')
+    df = _df_vam.dropna(subset=['Atleta', 'VAM_kmh'])
+    df = df[df['VAM_kmh'] > 0]
+    return df.sort_values('Fecha', kind='stable').groupby('Atleta', sort=True).tail(1).set_index('Atleta')
+
+def tabla_ritmos(vam_kmh, porcentajes):
+    """Ritmos (min/km) para cada VAM y cada % VAM en una sola operación matricial."""
+    vam = np.asarray(vam_kmh, dtype=float).reshape(-1, 1)
+    pct = np.asarray(porcentajes, dtype=float).reshape(1, -1)
+    with np.errstate(divide='ignore'):
+        seg_km = 3600 / (vam * pct / 100)
+    return formatear_tiempo(seg_km)
+
+def predecir_tiempos_riegel(distancia_m, tiempo_s, distancias_objetivo):
+    """Tiempos previstos (s) con la fórmula de Riegel T2 = T1 * (D2 / D1) ^ 1.06, por atleta y distancia."""
+    d1 = np.asarray(distancia_m, dtype=float).reshape(-1, 1)
+    t1 = np.asarray(tiempo_s, dtype=float).reshape(-1, 1)
+    d2 = np.asarray(distancias_objetivo, dtype=float).reshape(1, -1)
+    return t1 * (d2 / d1) ** RIEGEL_EXPONENTE
+
+@instrumentar('hoja_intervalos_equipo')
+@st.cache_data(max_entries=100)
+def hoja_intervalos_equipo(_df_ultimas, equipo, version, pct_vam, distancia_rep_m, repeticiones, recuperacion_s):
+    """Genera de una vez la hoja de series (tiempo por repetición y ritmo) para todos los corredores."""
+    registrar_cache_miss('hoja_intervalos_equipo')
+    vam = _df_ultimas['VAM_kmh'].to_numpy(dtype=float)
+    velocidad_ms = vam * (pct_vam / 100) / 3.6
+    tiempo_rep = distancia_rep_m / velocidad_ms
+    return pd.DataFrame({
+        'Atleta': _df_ultimas.index,
+        'VAM (km/h)': vam.round(2),
+        'Velocidad (km/h)': (velocidad_ms * 3.6).round(2),
+        'Ritmo (min/km)': formatear_tiempo(1000 / velocidad_ms),
+        f'Tiempo por {int(distancia_rep_m)} m': formatear_tiempo(tiempo_rep),
+        'Series': f"{repeticiones} x {int(distancia_rep_m)} m / {int(recuperacion_s)} s rec.",
+        'Tiempo Total': formatear_tiempo(repeticiones * tiempo_rep + (repeticiones - 1) * recuperacion_s),
+    })
+
+# --- REGISTRO DE PESO: TENDENCIA (EWMA), RITMO SEMANAL Y TMB/GET DEL EQUIPO ---
+
+@instrumentar('save_pesaje')
+def save_pesaje(atleta, fecha, peso_kg):
+    """Añade un pesaje al registro diario y actualiza 'PesoCorporal' del atleta con el último valor."""
+    equipo = equipo_sesion()
+    nueva = pd.DataFrame([{'Atleta': atleta, 'Fecha': pd.to_datetime(fecha), 'Peso_kg': peso_kg}], columns=PESAJES_REQUIRED_COLUMNS)
+    if not anexar_filas_dataset('pesajes', load_pesajes_data(equipo)[0], nueva):
+        return False
+
+    df_atletas_actual = load_data(equipo)[0]
+    filas_atleta = df_atletas_actual.index[df_atletas_actual['Atleta'] == atleta]
+    if len(filas_atleta) and 'PesoCorporal' in df_atletas_actual.columns:
+        actualizar_campos_fila('atletas', df_atletas_actual, filas_atleta[0], {'PesoCorporal': peso_kg})
+    return True
+
+@instrumentar('tendencia_peso')
+@st.cache_data(max_entries=50)
+def tendencia_peso(_df_pesajes, equipo, version):
+    """Serie diaria por atleta con el peso de tendencia (media exponencial) y resumen con el ritmo semanal.
+
+    El ritmo (kg/sem) compara la tendencia del último pesaje con la de 7 días antes.
+    """
+    registrar_cache_miss('tendencia_peso')
+    df = _df_pesajes.dropna(subset=['Atleta', 'Fecha', 'Peso_kg'])
+    df = df.assign(Fecha=df['Fecha'].dt.normalize().astype('datetime64[ns]'))
+    diario = df.groupby(['Atleta', 'Fecha'], sort=True)['Peso_kg'].mean().reset_index()
+    diario['Tendencia'] = (
+        diario.groupby('Atleta')['Peso_kg']
+        .ewm(alpha=PESO_EWMA_ALFA, adjust=False).mean()
+        .reset_index(level=0, drop=True)
+        .round(2)
+    )
+
+    ultimos = diario.groupby('Atleta', sort=True).tail(1)
+    referencia = pd.merge_asof(
+        ultimos.assign(Fecha_ref=ultimos['Fecha'] - pd.Timedelta(days=7)).sort_values('Fecha_ref'),
+        diario[['Atleta', 'Fecha', 'Tendencia']].assign(Fecha_ref=diario['Fecha']).rename(columns={'Fecha': 'Fecha_previa', 'Tendencia': 'Tendencia_ref'}).sort_values('Fecha_ref'),
+        on='Fecha_ref', by='Atleta', direction='backward',
+    )
+    dias = (referencia['Fecha'] - referencia['Fecha_previa']).dt.days
+    referencia['Ritmo_kg_sem'] = ((referencia['Tendencia'] - referencia['Tendencia_ref']) * 7 / dias).round(2)
+    resumen = referencia.set_index('Atleta').sort_index()[['Fecha', 'Peso_kg', 'Tendencia', 'Ritmo_kg_sem']].rename(columns={'Fecha': 'Último pesaje', 'Peso_kg': 'Último peso'})
+    return diario, resumen
+
+def ritmo_objetivo_kg_sem(objetivo_label):
+    """Cambio de peso semanal esperado (kg/sem) para el ajuste calórico del objetivo."""
+    return round(OBJETIVOS_PESO.get(objetivo_label, 0) * 7 / KCAL_POR_KG, 2)
+
+@instrumentar('calcular_tmb_equipo')
+@st.cache_data(max_entries=50)
+def calcular_tmb_equipo(_df_perfiles, _df_atletas, _df_resumen_peso, equipo, version, factor_actividad):
+    """TMB (Mifflin-St Jeor) y GET de todo el equipo en una sola pasada vectorizada.
+
+    Usa el peso de tendencia si el atleta tiene pesajes y, si no, 'PesoCorporal'.
+    """
+    registrar_cache_miss('calcular_tmb_equipo')
+    columnas_perfil = [c for c in ['Atleta', 'Categoria', 'Division', 'Edad', 'Altura_cm', 'Sexo'] if c in _df_perfiles.columns]
+    df = _df_perfiles[columnas_perfil].drop_duplicates('Atleta').set_index('Atleta')
+    peso_ficha = _df_atletas.drop_duplicates('Atleta').set_index('Atleta')['PesoCorporal'] if 'PesoCorporal' in _df_atletas.columns else pd.Series(dtype=float)
+    peso_tendencia = pd.to_numeric(_df_resumen_peso['Tendencia'].reindex(df.index), errors='coerce')
+    df['Peso (kg)'] = peso_tendencia.fillna(pd.to_numeric(peso_ficha, errors='coerce').reindex(df.index)).astype(float)
+    df['Ritmo (kg/sem)'] = _df_resumen_peso['Ritmo_kg_sem'].reindex(df.index)
+
+    peso = df['Peso (kg)'].to_numpy(dtype=float)
+    altura = pd.to_numeric(df.get('Altura_cm'), errors='coerce').to_numpy(dtype=float)
+    edad = pd.to_numeric(df.get('Edad'), errors='coerce').to_numpy(dtype=float)
+    constante = np.where(df.get('Sexo', pd.Series('Hombre', index=df.index)).to_numpy() == 'Mujer', -161, 5)
+    validos = (peso > 0) & (altura > 0) & (edad > 0)
+    tmb = np.where(validos, 10 * peso + 6.25 * altura - 5 * edad + constante, np.nan)
+    df['TMB (kcal)'] = np.round(tmb)
+    df['GET (kcal)'] = np.round(tmb * factor_actividad)
+    df['Agua (L)'] = np.round(peso * 0.035, 1)
+
+    if 'Division' in df.columns:
+        df['Margen División (kg)'] = (df['Peso (kg)'] - limite_division_kg(df['Division'])).round(2)
+    return df.reset_index()
+
+def limite_division_kg(divisiones):
+    """Extrae el límite numérico (kg) de textos de división como '60 kg' o '-57,5 kg'."""
+    numero = divisiones.astype(str).str.extract(r'(\d+(?:[.,]\d+)?)')[0].str.replace(',', '.')
+    return pd.to_numeric(numero, errors='coerce')
+
+# --- PLANIFICADOR DE CORTE DE PESO (DIVISIÓN + CALENDARIO) ---
+
+@instrumentar('indice_competencias')
+@st.cache_data(max_entries=50)
+def indice_competencias(_df_calendario, equipo, version):
+    """Índice ordenado de competiciones habilitadas (fechas como datetime64[D]) para búsquedas binarias."""
+    registrar_cache_miss('indice_competencias')
+    df = _df_calendario.dropna(subset=['Fecha'])
+    if 'Habilitado' in df.columns:
+        df = df[df['Habilitado'] == True]
+    texto = (df['Evento'].astype(str) + ' ' + df.get('Detalle', pd.Series('', index=df.index)).astype(str)).str.lower()
+    es_competencia = texto.str.contains('|'.join(PALABRAS_COMPETENCIA), regex=True)
+    if 'Tipo' in df.columns:
+        es_competencia |= df['Tipo'].astype(str).str.lower().str.startswith('compet')
+    df = df[es_competencia]
+    fechas = pd.to_datetime(df['Fecha']).to_numpy().astype('datetime64[D]')
+    orden = np.argsort(fechas, kind='stable')
+    return fechas[orden], df['Evento'].to_numpy()[orden]
+
+def proxima_competencia(indice, fecha_desde):
+    """Devuelve (fecha, evento) de la primera competición en o después de 'fecha_desde', o (None, None)."""
+    fechas, eventos = indice
+    pos = np.searchsorted(fechas, np.datetime64(fecha_desde, 'D'), side='left')
+    if pos >= len(fechas):
+        return None, None
+    return pd.Timestamp(fechas[pos]).date(), eventos[pos]
+
+@instrumentar('planificar_cortes_peso')
+@st.cache_data(max_entries=50)
+def planificar_cortes_peso(_df_tmb_equipo, equipo, version, fecha_inicio, fecha_competencia):
+    """Trayectoria diaria de peso y calorías hasta la competición para todo el equipo, en una sola pasada.
+
+    El exceso sobre el límite de la división se reparte de forma lineal entre hoy y el pesaje; el
+    ritmo semanal (% del peso) se clasifica como seguro, agresivo o no seguro. Devuelve el resumen
+    por atleta y la trayectoria en formato largo (Atleta, Fecha).
+    """
+    registrar_cache_miss('planificar_cortes_peso')
+    df = _df_tmb_equipo.dropna(subset=['Peso (kg)']).copy()
+    df['Límite (kg)'] = limite_division_kg(df['Division']) if 'Division' in df.columns else np.nan
+    df = df.dropna(subset=['Límite (kg)'])
+    dias = max((fecha_competencia - fecha_inicio).days, 1)
+
+    peso = df['Peso (kg)'].to_numpy(dtype=float)
+    exceso = np.clip(peso - df['Límite (kg)'].to_numpy(dtype=float), 0, None)
+    perdida_diaria = exceso / dias
+    pct_semanal = perdida_diaria * 7 / peso * 100
+    deficit = perdida_diaria * KCAL_POR_KG
+    kcal_objetivo = df['GET (kcal)'].to_numpy(dtype=float) - deficit
+
+    df['Días'] = dias
+    df['Exceso (kg)'] = exceso.round(2)
+    df['Ritmo (kg/sem)'] = (perdida_diaria * 7).round(2)
+    df['Ritmo (% peso/sem)'] = pct_semanal.round(2)
+    df['Déficit (kcal/día)'] = np.round(deficit)
+    df['Kcal Objetivo'] = np.round(kcal_objetivo)
+    df['Estado'] = np.select(
+        [exceso <= 0, pct_semanal <= CORTE_SEGURO_PCT_SEM, pct_semanal <= CORTE_MAX_PCT_SEM],
+        ['✅ En peso', '🟢 Seguro', '🟠 Agresivo'],
+        default='🔴 No seguro'
+    )
+    df.loc[kcal_objetivo < df['TMB (kcal)'].to_numpy(dtype=float), 'Estado'] += ' · kcal < TMB'
+
+    pasos = np.arange(dias + 1)
+    trayectoria_peso = peso[:, None] - perdida_diaria[:, None] * pasos[None, :]
+    df_trayectoria = pd.DataFrame({
+        'Atleta': np.repeat(df['Atleta'].to_numpy(), len(pasos)),
+        'Fecha': np.tile(pd.date_range(fecha_inicio, periods=len(pasos)).to_numpy(), len(df)),
+        'Peso Plan (kg)': trayectoria_peso.ravel().round(2),
+        'Kcal Objetivo': np.repeat(np.round(kcal_objetivo), len(pasos)),
+    })
+
+    columnas = ['Atleta', 'Division', 'Peso (kg)', 'Límite (kg)', 'Exceso (kg)', 'Días', 'Ritmo (kg/sem)', 'Ritmo (% peso/sem)', 'Déficit (kcal/día)', 'Kcal Objetivo', 'Estado']
+    return df.reindex(columns=columnas).sort_values('Ritmo (% peso/sem)', ascending=False), df_trayectoria
+
+# --- SIMULACIÓN MONTE CARLO DEL RANKING (PRÓXIMAS COMPETICIONES) ---
+
+def probabilidades_medalla(df_ranking, competencias_previas):
+    """P(oro, plata, bronce, sin medalla) por atleta y competición a partir de su historial de medallas.
+
+    Las tasas observadas (medallas / competiciones) se suavizan hacia la media de la categoría con
+    MC_PRIOR_COMPETENCIAS competiciones de peso, para que un historial corto no dé probabilidades 0 o 1.
+    """
+    medallas = df_ranking[['Oros', 'Platas', 'Bronces']].to_numpy(dtype=float)
+    n_comp = max(float(competencias_previas), medallas.sum(axis=1).max(initial=0.0), 1.0)
+    categorias = df_ranking['Categoria'].astype(object).fillna('Sin categoría').to_numpy()
+    media_categoria = pd.DataFrame(medallas / n_comp).groupby(categorias).transform('mean').to_numpy()
+    tasas = (medallas + MC_PRIOR_COMPETENCIAS * media_categoria) / (n_comp + MC_PRIOR_COMPETENCIAS)
+    return np.column_stack([tasas, np.clip(1 - tasas.sum(axis=1), 0, 1)])
+
+@instrumentar('simular_temporadas')
+@st.cache_data(max_entries=20)
+def simular_temporadas(_df_ranking, equipo, version, n_competencias, competencias_previas, n_temporadas=MC_TEMPORADAS, semilla=MC_SEMILLA):
+    """Simula 'n_temporadas' temporadas de 'n_competencias' competiciones por lotes de MC_LOTE.
+
+    En cada competición y categoría el oro, la plata y el bronce se sortean en ese orden, una sola
+    vez cada uno: el ganador sale de los atletas aún sin medalla con probabilidad igual a su tasa
+    de esa medalla (reescaladas si en la categoría suman más de 1; el resto es para rivales de
+    otros equipos). El orden final usa la misma jerarquía que calculate_and_sort_ranking
+    (empates: orden actual).
+    Devuelve (resumen por atleta, probabilidad de cada posición final por atleta).
+    """
+    registrar_cache_miss('simular_temporadas')
+    df = _df_ranking.sort_values('Posicion', kind='stable').reset_index(drop=True)
+    n = len(df)
+    base = df[['Oros', 'Platas', 'Bronces']].to_numpy(dtype=np.int64)
+    codigos_cat, _ = pd.factorize(df['Categoria'].astype(object).fillna('Sin categoría'))
+
+    # Sorteo de medallas en columnas agrupadas por categoría: cada una es un tramo contiguo. Las
+    # probabilidades acumuladas de cada tramo se desplazan para que no se solapen, así un único
+    # searchsorted por medalla resuelve el ganador de todas las categorías y temporadas del lote
+    agrupado = np.argsort(codigos_cat, kind='stable')
+    cat_agrupada = codigos_cat[agrupado]
+    prob_agrupada = probabilidades_medalla(df, competencias_previas)[agrupado, :3]
+    inicio_cat = np.flatnonzero(np.r_[True, cat_agrupada[1:] != cat_agrupada[:-1]])
+    fin_cat = np.r_[inicio_cat[1:], n]
+    suma_cat = np.add.reduceat(prob_agrupada, inicio_cat, axis=0)
+    desplazamiento = np.arange(len(inicio_cat)) * (suma_cat.max(initial=0) + 2)
+    acumulada = np.cumsum(prob_agrupada, axis=0)
+    acumulada -= np.repeat(acumulada[inicio_cat] - prob_agrupada[inicio_cat], fin_cat - inicio_cat, axis=0)
+    acumulada += desplazamiento[cat_agrupada][:, None]
+    k = int(base.max(initial=0)) + n_competencias + 1   # Base de la clave lexicográfica (Oros, Platas, Bronces)
+
+    # Orden por (categoría, clave): cada categoría ocupa un tramo fijo, así la posición dentro
+    # de la categoría es la del tramo y no depende de la temporada
+    n_cat = np.bincount(codigos_cat)
+    pos_en_tramo = np.arange(n) - np.repeat(np.cumsum(n_cat) - n_cat, n_cat) + 1
+    clave_max = k ** 3
+
+    rng = np.random.default_rng(semilla)
+    conteo_pos = np.zeros(n * n, dtype=np.int64)
+    podio_cat = np.zeros(n, dtype=np.int64)
+    primero_cat = np.zeros(n, dtype=np.int64)
+    medallas_sim = np.zeros((n, 3))
+    rango = np.broadcast_to(np.arange(n), (MC_LOTE, n))
+    tramo = np.broadcast_to(pos_en_tramo, (MC_LOTE, n))
+
+    for inicio in range(0, n_temporadas, MC_LOTE):
+        lote = min(MC_LOTE, n_temporadas - inicio)
+        # Una columna extra recoge las medallas que se llevan rivales de otros equipos
+        medallas_lote = np.zeros((3, lote, n + 1), dtype=np.int32)
+        filas = np.arange(lote)[:, None]
+        for _ in range(n_competencias):
+            # Ganadores ya sorteados en esta competición (n = rival de otro equipo), de menor a mayor columna
+            excluidos = []
+            for j in range(3):
+                p_excluidos = [np.where(x < n, prob_agrupada[np.minimum(x, n - 1), j], 0.0) for x in excluidos]
+                restante = np.maximum(suma_cat[:, j] - sum(p_excluidos), 1.0)
+                objetivo = desplazamiento + rng.random((lote, len(inicio_cat))) * restante
+                ganador = np.searchsorted(acumulada[:, j], objetivo, side='right')
+                for x, p_x in zip(excluidos, p_excluidos):
+                    # Saltar a un atleta ya premiado equivale a buscar su 'p' más allá en el acumulado
+                    objetivo += np.where(ganador >= x, p_x, 0.0)
+                    ganador = np.searchsorted(acumulada[:, j], objetivo, side='right')
+                ganador = np.where(ganador < fin_cat, ganador, n)
+                medallas_lote[j][filas, ganador] += 1
+                if j == 0:
+                    excluidos = [ganador]
+                elif j == 1:
+                    excluidos = [np.minimum(excluidos[0], ganador), np.maximum(excluidos[0], ganador)]
+        medallas_lote = medallas_lote[:, :, :n]
+        medallas_lote[:, :, agrupado] = medallas_lote.copy()
+        oros, platas, bronces = (base[:, j] + medallas_lote[j] for j in range(3))
+        clave = (oros * k + platas) * k + bronces
+
+        orden = np.argsort(-clave, axis=1, kind='stable')
+        posicion = np.empty_like(orden)
+        np.put_along_axis(posicion, orden, rango[:lote], axis=1)
+        conteo_pos += np.bincount((np.arange(n) * n + posicion).ravel(), minlength=n * n)
+
+        orden_cat = np.argsort(codigos_cat * clave_max + (clave_max - 1 - clave), axis=1, kind='stable')
+        pos_cat = np.empty_like(orden_cat)
+        np.put_along_axis(pos_cat, orden_cat, tramo[:lote], axis=1)
+        podio_cat += (pos_cat <= 3).sum(axis=0)
+        primero_cat += (pos_cat == 1).sum(axis=0)
+        medallas_sim += np.column_stack([oros.sum(axis=0), platas.sum(axis=0), bronces.sum(axis=0)])
+
+    dist = conteo_pos.reshape(n, n) / n_temporadas
+    resumen = pd.DataFrame({
+        'Atleta': df['Atleta'].to_numpy(),
+        'Categoria': df['Categoria'].to_numpy(),
+        'Posición Actual': df['Posicion'].to_numpy(),
+        'Posición Esperada': (dist * np.arange(1, n + 1)).sum(axis=1).round(2),
+        'P(1º General)': dist[:, 0] * 100,
+        'P(Top 3 General)': dist[:, :3].sum(axis=1) * 100,
+        'P(1º Categoría)': primero_cat / n_temporadas * 100,
+        'P(Podio Categoría)': podio_cat / n_temporadas * 100,
+        'Oros Esperados': (medallas_sim[:, 0] / n_temporadas).round(2),
+        'Platas Esperadas': (medallas_sim[:, 1] / n_temporadas).round(2),
+        'Bronces Esperados': (medallas_sim[:, 2] / n_temporadas).round(2),
+    })
+    distribucion = pd.DataFrame(dist * 100, index=df['Atleta'].to_numpy(), columns=[f"{i}º" for i in range(1, n + 1)])
+    return resumen, distribucion
+
+# --- OPTIMIZADOR DE INSCRIPCIONES POR CATEGORÍA (DP EXACTO) ---
+
+def candidatos_inscripcion(df_ranking, df_atletas, competencias_previas, peso_fuerza, pesos_medalla=PUNTOS_MEDALLA, df_perfiles=None):
+    """Valor esperado por competición de inscribir a cada atleta del ranking.
+
+    Parte de sus probabilidades de medalla (historial) y lo corrige con su fuerza relativa
+    (suma de RM / peso corporal) normalizada dentro de la categoría: valor * (1 + peso_fuerza * z).
+    Si se pasan los perfiles, añade la división de cada atleta y su límite en kg.
+    """
+    df = df_ranking[['Atleta', 'Categoria', 'Oros', 'Platas', 'Bronces']].drop_duplicates('Atleta').reset_index(drop=True)
+    df['Categoria'] = df['Categoria'].astype(object).fillna('Sin categoría').astype(str).str.strip()
+    prob = probabilidades_medalla(df, competencias_previas)
+
+    columnas_rm = [c for c in df_atletas.columns if str(c).endswith('_RM')]
+    fichas = df_atletas.drop_duplicates('Atleta').set_index('Atleta').reindex(df['Atleta'])
+    peso = pd.to_numeric(fichas['PesoCorporal'], errors='coerce').to_numpy() if 'PesoCorporal' in fichas.columns else np.full(len(df), np.nan)
+    suma_rm = fichas[columnas_rm].apply(pd.to_numeric, errors='coerce').sum(axis=1, min_count=1).to_numpy()
+    fuerza = np.where(peso > 0, suma_rm / np.where(peso > 0, peso, 1), np.nan)
+
+    grupos = pd.Series(fuerza).groupby(df['Categoria'].to_numpy())
+    z = ((pd.Series(fuerza) - grupos.transform('mean')) / grupos.transform('std')).fillna(0).clip(-3, 3).to_numpy()
+    valor = (prob[:, :3] @ pesos_medalla) * np.clip(1 + peso_fuerza * z, 0, None)
+
+    if df_perfiles is not None and 'Division' in df_perfiles.columns:
+        division = df_perfiles.drop_duplicates('Atleta').set_index('Atleta')['Division'].reindex(df['Atleta']).astype(object)
+    else:
+        division = pd.Series(np.nan, index=df['Atleta'], dtype=object)
+
+    return pd.DataFrame({
+        'Atleta': df['Atleta'].to_numpy(),
+        'Categoria': df['Categoria'].to_numpy(),
+        'Peso (kg)': peso,
+        'Division': division.to_numpy(),
+        'Límite (kg)': limite_division_kg(division).to_numpy(),
+        'Fuerza Relativa': np.round(fuerza, 2),
+        'P(Oro)': prob[:, 0] * 100,
+        'P(Plata)': prob[:, 1] * 100,
+        'P(Bronce)': prob[:, 2] * 100,
+        'Valor Esperado': np.round(valor, 3),
+    })
+
+@instrumentar('optimizar_inscripciones')
+def optimizar_inscripciones(df_candidatos, cupos, limite_total=None, exigir_division=False):
+    """Selección que maximiza la suma de 'Valor Esperado' con cupos por categoría y un máximo total opcional.
+
+    Programación dinámica exacta sobre (inscritos en la categoría, inscritos totales): cada categoría
+    se procesa atleta a atleta y al cerrarla solo se conserva el mejor estado por inscritos totales.
+    Con 'exigir_division' solo son elegibles los atletas cuyo peso registrado está dentro del límite
+    de su división; el resto queda fuera con su motivo. Devuelve (candidatos con 'Inscrito' y 'Motivo', valor total).
+    """
+    df = df_candidatos[df_candidatos['Categoria'].map(cupos).fillna(0) > 0].copy()
+    df['Motivo'] = ''
+    if exigir_division:
+        peso = df['Peso (kg)'].astype(float)
+        limite = df['Límite (kg)'].astype(float)
+        df.loc[limite.isna(), 'Motivo'] = 'Sin división'
+        df.loc[limite.notna() & ~(peso > 0), 'Motivo'] = 'Sin peso registrado'
+        df.loc[(peso > limite) & (df['Motivo'] == ''), 'Motivo'] = 'Sobre el límite de su división'
+    excluidos = df[df['Motivo'] != '']
+    df = df[df['Motivo'] == ''].sort_values(['Categoria', 'Valor Esperado'], ascending=[True, False])
+    valores = df['Valor Esperado'].to_numpy(dtype=float)
+    categorias = df['Categoria'].to_numpy()
+
+    max_total = int(sum(min(int(cupos[c]), int((categorias == c).sum())) for c in pd.unique(categorias)))
+    max_total = min(max_total, int(limite_total)) if limite_total else max_total
+
+    dp = np.full(max_total + 1, -np.inf)
+    dp[0] = 0.0
+    decisiones, cierres = [], []
+    for categoria in pd.unique(categorias):
+        indices = np.flatnonzero(categorias == categoria)
+        cupo = min(int(cupos[categoria]), len(indices), max_total)
+        estado = np.full((cupo + 1, max_total + 1), -np.inf)
+        estado[0] = dp
+        tomas = []
+        for i in indices:
+            if cupo == 0:
+                tomas.append(None)
+                continue
+            candidato = estado[:-1, :-1] + valores[i]
+            mejora = candidato > estado[1:, 1:]
+            estado[1:, 1:] = np.where(mejora, candidato, estado[1:, 1:])
+            tomas.append(mejora)
+        cierre = estado.argmax(axis=0)
+        dp = np.take_along_axis(estado, cierre[None], axis=0)[0]
+        decisiones.append((indices, tomas))
+        cierres.append(cierre)
+
+    j = int(np.argmax(dp))
+    valor_total = float(dp[j])
+    elegidos = []
+    for (indices, tomas), cierre in zip(reversed(decisiones), reversed(cierres)):
+        t = cierre[j]
+        for i, toma in zip(reversed(indices), reversed(tomas)):
+            if t > 0 and toma is not None and toma[t - 1, j - 1]:
+                elegidos.append(i)
+                t, j = t - 1, j - 1
+
+    df['Inscrito'] = False
+    df.iloc[elegidos, df.columns.get_loc('Inscrito')] = True
+    excluidos = excluidos.assign(Inscrito=False)
+    resultado = pd.concat([df, excluidos], ignore_index=True) if len(excluidos) else df
+    return resultado.sort_values(['Inscrito', 'Categoria', 'Valor Esperado'], ascending=[False, True, False]).reset_index(drop=True), valor_total
+
+# --- PROGRAMAS DE ENTRENAMIENTO (PERIODIZACIÓN A PARTIR DE PLANTILLAS Y RM) ---
+
+@st.cache_resource
+def get_programas_store():
+    """Planes generados por equipo y plantilla, con la firma de RM de cada atleta para regenerar solo los que cambian."""
+    return {'lock': threading.Lock(), 'planes': {}}
+
+def porcentaje_intensidad(tipos, intensidades):
+    """% de RM de cada fila de plantilla: el valor directo si es %RM o el punto medio de RIR_TO_PERCENT si es RIR."""
+    medio_rir = {rir: (minimo + maximo) / 2 for rir, (minimo, maximo) in RIR_TO_PERCENT.items()}
+    tipos = pd.Series(tipos).astype(str).str.upper().to_numpy()
+    intensidades = pd.Series(intensidades, dtype=float)
+    por_rir = intensidades.round().map(medio_rir).to_numpy(dtype=float)
+    return np.where(tipos == 'RIR', por_rir, intensidades.to_numpy())
+
+def placas_vectorizadas(pesos, peso_barra):
+    """Descomposición en placas por lado para muchos pesos a la vez (mismo criterio voraz que descomponer_placas)."""
+    pesos = np.asarray(pesos, dtype=float)
+    if not len(pesos):
+        return np.array([], dtype=object)
+    restante = np.clip((pesos - peso_barra) / 2, 0, None)
+    texto = pd.Series('', index=range(len(pesos)), dtype=object)
+    for placa in PLACAS_DISPONIBLES:
+        cantidad = np.floor((restante + 0.01) / placa).astype(int)
+        restante = restante - cantidad * placa
+        parte = pd.Series(cantidad, dtype=object).astype(str) + f"×{placa:g}"
+        separador = np.where(texto.str.len() > 0, ' + ', '')
+        texto = texto.where(cantidad == 0, texto + separador + parte)
+    return np.where(pesos > peso_barra, texto.to_numpy(), 'Barra sola')
+
+def _generar_planes(df_plantilla, df_rms, peso_barra):
+    """Cruza la plantilla con las RM (Atleta, Ejercicio, RM) y calcula cargas y placas en bloque."""
+    plan = df_plantilla.merge(df_rms, on='Ejercicio', how='inner')
+    pct = porcentaje_intensidad(plan['Tipo_Intensidad'], plan['Intensidad'])
+    carga = np.round(plan['RM'].to_numpy(dtype=float) * pct / 100 * 2) / 2
+    plan['% RM'] = np.round(pct, 1)
+    plan['Carga (kg)'] = carga
+    plan['Placas por lado'] = placas_vectorizadas(carga, peso_barra)
+    columnas = ['Atleta', 'Bloque', 'Semana', 'Dia', 'Ejercicio', 'Series', 'Reps', 'Tipo_Intensidad', 'Intensidad', '% RM', 'RM', 'Carga (kg)', 'Placas por lado']
+    return plan[columnas]
+
+@instrumentar('programas_equipo')
+def programas_equipo(equipo, plantilla, df_plantilla, version_plantillas, df_atletas, mapa_rm, peso_barra):
+    """Devuelve el plan completo de todos los atletas para una plantilla y la lista de atletas regenerados.
+
+    Cada atleta guarda una firma (hash) de sus RM: si la plantilla o la barra no cambian, solo se
+    recalculan los atletas cuya firma cambió; el resto se sirve desde el almacén en memoria.
+    """
+    columnas_rm = [c for c in dict.fromkeys(mapa_rm.values()) if c in df_atletas.columns]
+    df_rm_ancho = df_atletas.drop_duplicates('Atleta').set_index('Atleta')[columnas_rm].apply(pd.to_numeric, errors='coerce')
+    firmas = pd.Series(pd.util.hash_pandas_object(df_rm_ancho, index=True).to_numpy(), index=df_rm_ancho.index)
+
+    store = get_programas_store()
+    clave = (equipo, plantilla)
+    with store['lock']:
+        previo = store['planes'].get(clave)
+        if previo is None or previo['version'] != (version_plantillas, peso_barra, tuple(sorted(mapa_rm.items()))):
+            cambiados = firmas.index
+            planes = pd.DataFrame()
+        else:
+            firmas_previas = previo['firmas'].reindex(firmas.index)
+            cambiados = firmas.index[firmas_previas.to_numpy() != firmas.to_numpy()]
+            planes = previo['planes'][previo['planes']['Atleta'].isin(firmas.index.difference(cambiados))]
+
+        if len(cambiados):
+            df_rms = (
+                df_rm_ancho.loc[cambiados].rename_axis('Atleta').reset_index()
+                .melt(id_vars='Atleta', var_name='ColumnaRM', value_name='RM')
+                .merge(pd.DataFrame(list(mapa_rm.items()), columns=['Ejercicio', 'ColumnaRM']), on='ColumnaRM')
+                .query('RM > 0')[['Atleta', 'Ejercicio', 'RM']]
+            )
+            plantilla_filas = df_plantilla[df_plantilla['Plantilla'] == plantilla].drop(columns='Plantilla')
+            planes = pd.concat([planes, _generar_planes(plantilla_filas, df_rms, peso_barra)], ignore_index=True)
+
+        planes = planes.sort_values(['Atleta', 'Semana', 'Dia'], kind='stable', ignore_index=True)
+        store['planes'][clave] = {
+            'version': (version_plantillas, peso_barra, tuple(sorted(mapa_rm.items()))),
+            'firmas': firmas,
+            'planes': planes,
+        }
+    return planes, list(cambiados)
+
+# --- REGISTRO DE SERIES Y e1RM PRECALCULADO (AGREGACIÓN EN SEGUNDO PLANO) ---
+
+def calcular_e1rm(carga, reps, rir):
+    """e1RM vectorizado: media de Epley y Brzycki sobre las repeticiones efectivas (reps + RIR)."""
+    carga = np.asarray(carga, dtype=float)
+    reps_efectivas = np.asarray(reps, dtype=float) + np.nan_to_num(np.asarray(rir, dtype=float))
+    epley = carga * (1 + reps_efectivas / 30)
+    brzycki = carga * 36 / (37 - np.clip(reps_efectivas, 1, 36))
+    e1rm = np.where(reps_efectivas <= 12, (epley + brzycki) / 2, epley)
+    return np.where(reps_efectivas <= 1, carga, e1rm)
+
+@st.cache_resource
+def get_agregador_series():
+    """Estado compartido del agregador: mejor e1RM diario por equipo y un hilo que procesa solo las series nuevas."""
+    estado = {'cola': queue.Queue(), 'lock': threading.Lock(), 'equipos': {}}
+    hilo = threading.Thread(target=_bucle_agregador_series, args=(estado,), daemon=True, name='series-agregador')
+    hilo.start()
+    return estado
+
+def _bucle_agregador_series(estado):
+    """Procesa las peticiones de agregación (una por equipo) en segundo plano."""
+    cola = estado['cola']
+    while True:
+        equipo = cola.get()
+        try:
+            _agregar_series_nuevas(estado, equipo)
+        except Exception:
+            logger.exception("Error al agregar el registro de series de '%s'", equipo)
+        finally:
+            cola.task_done()
+
+def _agregar_series_nuevas(estado, equipo):
+    """Lee el registro desde el último byte procesado y acumula el mejor e1RM por atleta, ejercicio y día."""
+    ruta = ruta_equipo(SERIES_LOG_FILE, equipo)
+    with estado['lock']:
+        previo = estado['equipos'].get(equipo) or {'offset': 0, 'diario': pd.DataFrame(columns=['Atleta', 'Ejercicio', 'Fecha', 'e1RM', 'Volumen'])}
+        if not os.path.exists(ruta):
+            estado['equipos'][equipo] = previo
+            return
+        with open(ruta, 'rb') as f:
+            f.seek(previo['offset'])
+            datos = f.read()
+
+    # Solo líneas completas: una escritura a medias se procesa en la siguiente pasada
+    corte = datos.rfind(b'\n') + 1
+    if corte == 0:
+        with estado['lock']:
+            estado['equipos'].setdefault(equipo, previo)
+        return
+
+    bloques = [previo['diario']]
+    with medir_tiempo('series.agregacion'):
+        lector = pd.read_csv(
+            io.BytesIO(datos[:corte]), names=SERIES_COLUMNS, header=0 if previo['offset'] == 0 else None,
+            chunksize=SERIES_CHUNK_FILAS, parse_dates=['Fecha']
+        )
+        for bloque in lector:
+            bloque = bloque.dropna(subset=['Atleta', 'Ejercicio', 'Carga_kg', 'Reps'])
+            bloque = bloque.assign(
+                Fecha=pd.to_datetime(bloque['Fecha'], errors='coerce').dt.normalize(),
+                e1RM=calcular_e1rm(bloque['Carga_kg'], bloque['Reps'], bloque['RIR']),
+                Volumen=pd.to_numeric(bloque['Carga_kg'], errors='coerce') * pd.to_numeric(bloque['Reps'], errors='coerce'),
+            )
+            bloques.append(bloque.groupby(['Atleta', 'Ejercicio', 'Fecha'], as_index=False).agg(e1RM=('e1RM', 'max'), Volumen=('Volumen', 'sum')))
+        # e1RM: mejor del día; Volumen (kg x reps): se acumula entre bloques y pasadas
+        diario = (
+            pd.concat(bloques, ignore_index=True)
+            .groupby(['Atleta', 'Ejercicio', 'Fecha'], as_index=False)
+            .agg(e1RM=('e1RM', 'max'), Volumen=('Volumen', 'sum'))
+        )
+
+    with estado['lock']:
+        estado['equipos'][equipo] = {'offset': previo['offset'] + corte, 'diario': diario, 'actualizado': datetime.now()}
+
+@instrumentar('registrar_serie')
+def registrar_serie(atleta, ejercicio, carga_kg, reps, rir):
+    """Añade una serie al final del registro CSV del equipo y avisa al agregador."""
+    equipo = equipo_sesion()
+    ruta = ruta_equipo(SERIES_LOG_FILE, equipo)
+    fila = pd.DataFrame([[datetime.now().isoformat(timespec='seconds'), atleta, ejercicio, carga_kg, reps, rir]], columns=SERIES_COLUMNS)
+    estado = get_agregador_series()
+    try:
+        with estado['lock']:
+            fila.to_csv(ruta, mode='a', header=not os.path.exists(ruta), index=False)
+        estado['cola'].put(equipo)
+        return True
+    except Exception as e:
+        st.error(f"Error al registrar la serie: {e}")
+        return False
+
+def e1rm_equipo(equipo, ventana_dias=E1RM_VENTANA_DIAS):
+    """Mejor e1RM reciente por atleta y ejercicio, leído solo del agregado precalculado (nunca del registro)."""
+    estado = get_agregador_series()
+    with estado['lock']:
+        agregado = estado['equipos'].get(equipo)
+    if agregado is None:
+        # Primera consulta del equipo: la agregación inicial corre en segundo plano
+        estado['cola'].put(equipo)
+        return pd.DataFrame(columns=['Atleta', 'Ejercicio', 'e1RM', 'Fecha'])
+
+    diario = agregado['diario']
+    recientes = diario[diario['Fecha'] >= pd.Timestamp(datetime.now().date() - timedelta(days=ventana_dias))]
+    mejores = recientes.sort_values('e1RM').groupby(['Atleta', 'Ejercicio'], as_index=False).tail(1)
+    return mejores.assign(e1RM=mejores['e1RM'].round(1)).reset_index(drop=True)
+
+def propuestas_rm(df_e1rm, df_atletas, mapa_rm, umbral=E1RM_UMBRAL_PROPUESTA):
+    """Compara el e1RM con la RM registrada y devuelve las subidas que superan el umbral.
+
+    Solo se proponen aumentos: un e1RM menor suele venir de series submáximas, no de una pérdida de fuerza.
+    """
+    columnas_rm = [c for c in dict.fromkeys(mapa_rm.values()) if isinstance(c, str) and c != 'N/A']
+    rms = (
+        df_atletas.reindex(columns=['Atleta'] + columnas_rm).drop_duplicates('Atleta')
+        .melt(id_vars='Atleta', var_name='ColumnaRM', value_name='RM')
+        .merge(pd.DataFrame(list(mapa_rm.items()), columns=['Ejercicio', 'ColumnaRM']), on='ColumnaRM')
+    )
+    df = df_e1rm.merge(rms, on=['Atleta', 'Ejercicio'], how='inner')
+    df['RM'] = pd.to_numeric(df['RM'], errors='coerce')
+    df['Propuesta'] = np.round(df['e1RM'] * 2) / 2
+    df['Cambio (%)'] = ((df['Propuesta'] / df['RM'] - 1) * 100).round(1)
+    cambia = df['RM'].isna() | (df['Cambio (%)'] >= umbral * 100)
+    return df.loc[cambia, ['Atleta', 'Ejercicio', 'ColumnaRM', 'RM', 'e1RM', 'Propuesta', 'Cambio (%)', 'Fecha']].reset_index(drop=True)
+
+# --- VBT: PERFILES CARGA-VELOCIDAD CON AJUSTE INCREMENTAL ---
+
+def leer_csv_vbt(contenido, atleta_defecto, ejercicio_defecto, solo_atleta_defecto=False):
+    """Normaliza un CSV de encoder a VBT_COLUMNS reconociendo los nombres de columna habituales.
+
+    Con 'solo_atleta_defecto' (importación de un atleta) se descartan las filas de otros atletas.
+    """
+    primera_linea = contenido.split(b'\n', 1)[0].decode('utf-8', errors='ignore')
+    separador = ';' if primera_linea.count(';') > primera_linea.count(',') else ','
+    df = pd.read_csv(io.BytesIO(contenido), sep=separador, decimal=',' if separador == ';' else '.')
+    columnas = {str(c).lower().strip(): c for c in df.columns}
+
+    datos = {}
+    for destino, alias in VBT_ALIAS_COLUMNAS.items():
+        origen = next((columnas[a] for a in alias if a in columnas), None)
+        datos[destino] = df[origen] if origen is not None else None
+    if datos['Carga_kg'] is None or datos['Velocidad_ms'] is None:
+        raise ValueError("El CSV necesita columnas de carga (load, carga, kg) y velocidad media (mean velocity, velocidad, mv).")
+
+    df_reps = pd.DataFrame({
+        'Fecha': pd.to_datetime(datos['Fecha'], errors='coerce').dt.normalize() if datos['Fecha'] is not None else pd.Timestamp(datetime.now().date()),
+        'Atleta': datos['Atleta'] if datos['Atleta'] is not None else atleta_defecto,
+        'Ejercicio': datos['Ejercicio'] if datos['Ejercicio'] is not None else ejercicio_defecto,
+        'Carga_kg': pd.to_numeric(datos['Carga_kg'], errors='coerce'),
+        'Velocidad_ms': pd.to_numeric(datos['Velocidad_ms'], errors='coerce'),
+    }, columns=VBT_COLUMNS)
+    df_reps['Fecha'] = df_reps['Fecha'].fillna(pd.Timestamp(datetime.now().date()))
+    if solo_atleta_defecto:
+        propias = df_reps['Atleta'].astype(str).str.strip().str.lower() == str(atleta_defecto).strip().lower()
+        df_reps = df_reps[propias].assign(Atleta=atleta_defecto)
+    return df_reps.dropna(subset=['Atleta', 'Ejercicio', 'Carga_kg', 'Velocidad_ms']).query('Carga_kg > 0 and Velocidad_ms > 0')
+
+@st.cache_resource
+def get_vbt_store():
+    """Estadísticos suficientes (n, Σx, Σy, Σxy, Σx², Σy²) por atleta, ejercicio y día, y los perfiles ya ajustados."""
+    return {'lock': threading.Lock(), 'equipos': {}}
+
+def _estadisticos_vbt(df_reps):
+    """Suma los estadísticos suficientes de la recta carga-velocidad por (Atleta, Ejercicio, Fecha)."""
+    x = df_reps['Carga_kg'].to_numpy(dtype=float)
+    y = df_reps['Velocidad_ms'].to_numpy(dtype=float)
+    return (
+        pd.DataFrame({
+            'Atleta': df_reps['Atleta'].to_numpy(), 'Ejercicio': df_reps['Ejercicio'].to_numpy(),
+            'Fecha': pd.to_datetime(df_reps['Fecha']).dt.normalize().to_numpy(),
+            'n': 1.0, 'sx': x, 'sy': y, 'sxy': x * y, 'sxx': x * x, 'syy': y * y,
+        })
+        .groupby(['Atleta', 'Ejercicio', 'Fecha']).sum()
+    )
+
+def ajustar_rectas_vbt(stats):
+    """Mínimos cuadrados vectorizados a partir de los estadísticos: pendiente, intercepto y R² por fila."""
+    n, sx, sy, sxy, sxx, syy = (stats[c].to_numpy(dtype=float) for c in ['n', 'sx', 'sy', 'sxy', 'sxx', 'syy'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covarianza = n * sxy - sx * sy
+        var_x = n * sxx - sx ** 2
+        var_y = n * syy - sy ** 2
+        pendiente = np.where(var_x > 1e-9, covarianza / var_x, np.nan)
+        intercepto = (sy - pendiente * sx) / n
+        r2 = np.where((var_x > 1e-9) & (var_y > 1e-12), covarianza ** 2 / (var_x * var_y), np.nan)
+    valido = (n >= 2) & (pendiente < 0)
+    return np.where(valido, pendiente, np.nan), np.where(valido, intercepto, np.nan), r2
+
+def _recalcular_perfiles_vbt(stats):
+    """Perfil global (todas las fechas) y 1RM diaria; si el día no tiene rango de cargas usa la pendiente global."""
+    globales = stats.groupby(level=['Atleta', 'Ejercicio']).sum()
+    pendiente, intercepto, r2 = ajustar_rectas_vbt(globales)
+    mvt = globales.index.get_level_values('Ejercicio').map(lambda e: VBT_MVT.get(str(e).strip(), VBT_MVT_POR_DEFECTO)).to_numpy(dtype=float)
+    perfiles = pd.DataFrame({
+        'Reps': globales['n'].astype(int).to_numpy(),
+        'Pendiente': pendiente, 'Intercepto': intercepto, 'R2': r2, 'MVT': mvt,
+        '1RM Estimada': (mvt - intercepto) / pendiente,
+    }, index=globales.index)
+
+    pend_dia, _, _ = ajustar_rectas_vbt(stats)
+    pend_global = perfiles['Pendiente'].reindex(stats.index.droplevel('Fecha')).to_numpy()
+    pend_dia = np.where((stats['n'].to_numpy() >= 3) & np.isfinite(pend_dia), pend_dia, pend_global)
+    x_media = (stats['sx'] / stats['n']).to_numpy()
+    y_media = (stats['sy'] / stats['n']).to_numpy()
+    mvt_dia = perfiles['MVT'].reindex(stats.index.droplevel('Fecha')).to_numpy()
+    diario = pd.DataFrame({
+        'Reps': stats['n'].astype(int).to_numpy(),
+        '1RM del Día': x_media + (mvt_dia - y_media) / pend_dia,
+    }, index=stats.index)
+    return perfiles.round({'Pendiente': 4, 'Intercepto': 3, 'R2': 3, '1RM Estimada': 1}), diario.round(1)
+
+def actualizar_perfiles_vbt(equipo):
+    """Suma a los estadísticos solo las repeticiones nuevas del registro y reajusta los perfiles."""
+    store = get_vbt_store()
+    ruta = ruta_equipo(VBT_LOG_FILE, equipo)
+    with store['lock']:
+        previo = store['equipos'].get(equipo) or {'offset': 0, 'stats': None, 'perfiles': None, 'diario': None}
+        if not os.path.exists(ruta):
+            store['equipos'][equipo] = previo
+            return previo
+        with open(ruta, 'rb') as f:
+            f.seek(previo['offset'])
+            datos = f.read()
+        corte = datos.rfind(b'\n') + 1
+        if corte == 0:
+            store['equipos'][equipo] = previo
+            return previo
+
+        with medir_tiempo('vbt.refit'):
+            nuevas = pd.read_csv(io.BytesIO(datos[:corte]), names=VBT_COLUMNS, header=0 if previo['offset'] == 0 else None)
+            stats = _estadisticos_vbt(nuevas)
+            if previo['stats'] is not None:
+                stats = pd.concat([previo['stats'], stats]).groupby(level=['Atleta', 'Ejercicio', 'Fecha']).sum()
+            perfiles, diario = _recalcular_perfiles_vbt(stats)
+
+        actual = {'offset': previo['offset'] + corte, 'stats': stats, 'perfiles': perfiles, 'diario': diario}
+        store['equipos'][equipo] = actual
+        return actual
+
+@instrumentar('importar_repeticiones_vbt')
+def importar_repeticiones_vbt(df_reps):
+    """Añade las repeticiones al registro VBT del equipo y reajusta de forma incremental."""
+    equipo = equipo_sesion()
+    ruta = ruta_equipo(VBT_LOG_FILE, equipo)
+    try:
+        with get_vbt_store()['lock']:
+            df_reps.assign(Fecha=pd.to_datetime(df_reps['Fecha']).dt.strftime('%Y-%m-%d'))[VBT_COLUMNS].to_csv(
+                ruta, mode='a', header=not os.path.exists(ruta), index=False
+            )
+        actualizar_perfiles_vbt(equipo)
+        return True
+    except Exception as e:
+        st.error(f"Error al importar las repeticiones VBT: {e}")
+        return False
+
+def perfiles_vbt(equipo):
+    """Perfiles ya ajustados del equipo (solo se procesa el registro la primera vez tras arrancar)."""
+    with get_vbt_store()['lock']:
+        actual = get_vbt_store()['equipos'].get(equipo)
+    return actual if actual is not None else actualizar_perfiles_vbt(equipo)
+
+def carga_para_velocidad(pendiente, intercepto, velocidad_objetivo):
+    """Carga (kg, múltiplo de 0.5) a la que el perfil predice la velocidad objetivo."""
+    carga = (np.asarray(velocidad_objetivo, dtype=float) - intercepto) / pendiente
+    return np.round(carga * 2) / 2
+
+# --- ASISTENCIA: CHECK-IN POR QR (MODO KIOSKO) Y TASAS MATERIALIZADAS ---
+
+@st.cache_resource
+def secreto_qr():
+    """Clave de la instancia para firmar los QR; se guarda en QR_SECRETO_FILE la primera vez."""
+    if os.path.exists(QR_SECRETO_FILE):
+        with open(QR_SECRETO_FILE, encoding='utf-8') as f:
+            secreto = f.read().strip()
+        if secreto:
+            return secreto.encode()
+    secreto = secrets.token_hex(16)
+    with open(QR_SECRETO_FILE, 'w', encoding='utf-8') as f:
+        f.write(secreto)
+    return secreto.encode()
+
+def ids_texto(ids):
+    """IDs normalizados como texto (1, 1.0 y ' 1' son el mismo atleta; admite IDs tipo 'RUU426')."""
+    ids = pd.Series(ids, dtype=object)
+    numeros = pd.to_numeric(ids, errors='coerce')
+    enteros = numeros.notna() & (numeros % 1 == 0)
+    texto = ids.astype(str).str.strip()
+    texto[enteros] = numeros[enteros].astype('int64').astype(str)
+    return texto.where(ids.notna(), None)
+
+def _firma_qr(equipo, id_atleta):
+    return hmac.new(secreto_qr(), f"{equipo}:{id_atleta}".encode(), hashlib.sha256).hexdigest()[:10]
+
+def token_asistencia(equipo, id_atleta):
+    """Contenido del QR de un atleta: su ID y una firma HMAC (no se puede fabricar el de otro atleta)."""
+    id_atleta = ids_texto([id_atleta]).iloc[0]
+    return f"KS-{id_atleta}-{_firma_qr(equipo, id_atleta)}"
+
+def leer_token_asistencia(equipo, token):
+    """ID del atleta si el token escaneado es válido para el equipo (None si no)."""
+    coincidencia = re.fullmatch(r'KS-(.+)-([0-9a-f]{10})', str(token).strip())
+    if coincidencia is None:
+        return None
+    id_atleta, firma = coincidencia.groups()
+    return id_atleta if hmac.compare_digest(firma, _firma_qr(equipo, id_atleta)) else None
+
+def imagen_qr(token):
+    """PNG del código QR (None si la librería 'qrcode' no está instalada)."""
+    if qrcode is None:
+        return None
+    buffer = io.BytesIO()
+    qrcode.make(token, box_size=8, border=2).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=20)
+def credenciales_qr_zip(_df_atletas, equipo, version):
+    """ZIP con el QR (PNG) de cada atleta y un CSV con los tokens para imprimir credenciales."""
+    fichas = _df_atletas[['ID', 'Atleta']].dropna(subset=['ID'])
+    tokens = [token_asistencia(equipo, i) for i in fichas['ID']]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('tokens.csv', fichas.assign(Token=tokens).to_csv(index=False))
+        for atleta, token in zip(fichas['Atleta'], tokens):
+            png = imagen_qr(token)
+            if png is not None:
+                nombre_archivo = re.sub(r'[^\w\-]+', '_', str(atleta)).strip('_')
+                zf.writestr(f"{nombre_archivo}.png", png)
+    return buffer.getvalue()
+
+@st.cache_resource
+def get_asistencia():
+    """Estado compartido: claves ya registradas por equipo (idempotencia), cola de check-ins y vistas materializadas."""
+    estado = {'cola': queue.Queue(), 'lock': threading.Lock(), 'equipos': {}}
+    hilo = threading.Thread(target=_bucle_asistencia, args=(estado,), daemon=True, name='asistencia-writer')
+    hilo.start()
+    atexit.register(lambda: (estado['cola'].put(None), estado['cola'].join()))
+    return estado
+
+def _equipo_asistencia(estado, equipo):
+    """Estado del equipo (bajo estado['lock']); la primera vez lee el registro completo y materializa las tasas."""
+    if equipo not in estado['equipos']:
+        ruta = ruta_equipo(ASISTENCIA_LOG_FILE, equipo)
+        df = pd.read_csv(ruta, dtype={'ID': str}, on_bad_lines='skip') if os.path.exists(ruta) else pd.DataFrame(columns=ASISTENCIA_COLUMNS)
+        df = df.assign(ID=ids_texto(df['ID']).to_numpy(), Fecha=df['Fecha'].astype(str))
+        estado['equipos'][equipo] = {
+            'registros': df,
+            'claves': set(zip(df['Fecha'], df['Sesion'], df['ID'])),
+            'vista': None,
+        }
+    return estado['equipos'][equipo]
+
+def registrar_asistencia(equipo, df_atletas, lectura, sesion, fecha=None, permitir_id=False):
+    """Check-in idempotente: valida el QR firmado, descarta repetidos y encola la escritura.
+
+    Un ID tecleado solo se acepta con 'permitir_id' (check-in manual del entrenador), nunca en el kiosko.
+    Devuelve (resultado, atleta) con resultado 'ok', 'repetida', 'invalido' o 'desconocido'.
+    """
+    lectura = str(lectura).strip()
+    id_atleta = leer_token_asistencia(equipo, lectura)
+    if id_atleta is None:
+        if not permitir_id or not lectura or lectura.startswith('KS-'):
+            return 'invalido', None
+        id_atleta = ids_texto([lectura]).iloc[0]
+
+    ids = ids_texto(df_atletas['ID'])
+    coincidencias = df_atletas['Atleta'].to_numpy()[(ids == id_atleta).to_numpy()]
+    if not len(coincidencias):
+        return 'desconocido', None
+    atleta = str(coincidencias[0])
+
+    fecha = (fecha or datetime.now().date()).isoformat()
+    clave = (fecha, sesion, id_atleta)
+    estado = get_asistencia()
+    with estado['lock']:
+        datos = _equipo_asistencia(estado, equipo)
+        if clave in datos['claves']:
+            return 'repetida', atleta
+        datos['claves'].add(clave)
+    estado['cola'].put((equipo, {
+        'Marca': datetime.now().isoformat(timespec='seconds'), 'Fecha': fecha, 'Sesion': sesion, 'ID': id_atleta, 'Atleta': atleta,
+    }))
+    return 'ok', atleta
+
+def sesiones_del_dia(df_calendario, fecha=None):
+    """Sesiones seleccionables en el kiosko: entrenamiento habitual + eventos del calendario de ese día."""
+    fecha = pd.Timestamp(fecha or datetime.now().date())
+    del_dia = df_calendario.loc[pd.to_datetime(df_calendario['Fecha'], errors='coerce').dt.normalize() == fecha, 'Evento']
+    return [ASISTENCIA_SESION_POR_DEFECTO] + [e for e in del_dia.dropna().astype(str).str.strip().unique() if e != ASISTENCIA_SESION_POR_DEFECTO]
+
+def asistentes_registrados(equipo, sesion, fecha=None):
+    """Check-ins aceptados para la sesión del día (incluye los que aún esperan en el lote)."""
+    fecha = (fecha or datetime.now().date()).isoformat()
+    estado = get_asistencia()
+    with estado['lock']:
+        claves = _equipo_asistencia(estado, equipo)['claves']
+        return sum(1 for f, s, _ in claves if f == fecha and s == sesion)
+
+def _escribir_lote_asistencia(estado, lote):
+    """Añade el lote al CSV de cada equipo con una sola escritura y rematerializa sus tasas."""
+    por_equipo = defaultdict(list)
+    for equipo, fila in lote:
+        por_equipo[equipo].append(fila)
+
+    for equipo, filas in por_equipo.items():
+        ruta = ruta_equipo(ASISTENCIA_LOG_FILE, equipo)
+        nuevas = pd.DataFrame(filas, columns=ASISTENCIA_COLUMNS)
+        with medir_tiempo('asistencia.flush'):
+            nuevas.to_csv(ruta, mode='a', header=not os.path.exists(ruta), index=False)
+        with estado['lock']:
+            datos = _equipo_asistencia(estado, equipo)
+            datos['registros'] = pd.concat([datos['registros'], nuevas], ignore_index=True)
+            datos['vista'] = None
+
+def _bucle_asistencia(estado):
+    """Agrupa check-ins hasta ASISTENCIA_BATCH_SIZE o ASISTENCIA_FLUSH_SECONDS; un None fuerza el volcado inmediato."""
+    cola = estado['cola']
+    while True:
+        entrada = cola.get()
+        recibidas = 1
+        lote = []
+        limite = time_mod.monotonic() + ASISTENCIA_FLUSH_SECONDS
+        while entrada is not None:
+            lote.append(entrada)
+            restante = limite - time_mod.monotonic()
+            if len(lote) >= ASISTENCIA_BATCH_SIZE or restante <= 0:
+                break
+            try:
+                entrada = cola.get(timeout=restante)
+                recibidas += 1
+            except queue.Empty:
+                break
+        try:
+            if lote:
+                _escribir_lote_asistencia(estado, lote)
+        except Exception:
+            logger.exception("Error al escribir el registro de asistencia")
+        finally:
+            for _ in range(recibidas):
+                cola.task_done()
+
+def flush_asistencia():
+    """Espera a que todos los check-ins pendientes estén escritos en disco."""
+    cola = get_asistencia()['cola']
+    cola.put(None)
+    cola.join()
+
+def materializar_asistencia(df_registros, df_atletas):
+    """Tasas de asistencia por sesión (asistentes / plantilla) y por atleta (sesiones asistidas / sesiones celebradas)."""
+    plantilla = df_atletas[df_atletas['Rol'].astype(object).astype(str).str.strip() != 'Entrenador'][['ID', 'Atleta']]
+    plantilla = plantilla.assign(ID=ids_texto(plantilla['ID']).to_numpy()).dropna(subset=['ID'])
+
+    # Los entrenadores pueden registrarse, pero no cuentan en la tasa de la sesión
+    por_sesion = (
+        df_registros.assign(Asistentes=df_registros['ID'].isin(plantilla['ID']).astype(int))
+        .groupby(['Fecha', 'Sesion'], as_index=False)['Asistentes'].sum()
+        .sort_values('Fecha', ascending=False, ignore_index=True)
+    )
+    por_sesion['Tasa (%)'] = (100 * por_sesion['Asistentes'] / max(len(plantilla), 1)).round(1)
+
+    n_sesiones = len(por_sesion)
+    conteos = df_registros.groupby('ID').agg(Asistencias=('Sesion', 'size'), Ultima=('Fecha', 'max'))
+    por_atleta = plantilla.join(conteos, on='ID')
+    por_atleta['Asistencias'] = por_atleta['Asistencias'].fillna(0).astype(int)
+    por_atleta['Tasa (%)'] = (100 * por_atleta['Asistencias'] / max(n_sesiones, 1)).round(1)
+    por_atleta = por_atleta.rename(columns={'Ultima': 'Última Asistencia'}).sort_values('Tasa (%)', ascending=False, ignore_index=True)
+    return {'sesiones': por_sesion, 'atletas': por_atleta, 'n_sesiones': n_sesiones, 'actualizado': datetime.now()}
+
+def vista_asistencia(equipo, df_atletas):
+    """Tasas materializadas del equipo; solo se recalculan tras escribir un lote nuevo."""
+    estado = get_asistencia()
+    with estado['lock']:
+        datos = _equipo_asistencia(estado, equipo)
+        if datos['vista'] is None:
+            with medir_tiempo('asistencia.materializar'):
+                datos['vista'] = materializar_asistencia(datos['registros'], df_atletas)
+        return datos['vista']
+
+# --- AUTORREGULACIÓN DE CARGAS SEGÚN READINESS ---
+
+def calcular_srd(sueno, molestias, disposicion):
+    """Puntuación SRD (1-5) vectorizada: media de sueño, ausencia de molestias y disposición."""
+    return (np.asarray(sueno, dtype=float) + (5 - np.asarray(molestias, dtype=float)) + np.asarray(disposicion, dtype=float)) / 3
+
+@instrumentar('indice_readiness')
+@st.cache_data(max_entries=50)
+def indice_readiness(_df_readiness, equipo, version):
+    """Último check-in de cada atleta con su línea base móvil, como tabla indexada y diccionario para consultas O(1).
+
+    La línea base es la media del SRD de los check-ins de los 28 días anteriores (sin incluir el actual).
+    """
+    registrar_cache_miss('indice_readiness')
+    df = _df_readiness.dropna(subset=['Atleta', 'Fecha']).sort_values(['Atleta', 'Fecha'], kind='stable')
+    df = df.assign(
+        Fecha=pd.to_datetime(df['Fecha']).astype('datetime64[ns]'),
+        SRD=calcular_srd(df['Sueño'], df['Molestias'], df['Disposicion']),
+    ).reset_index(drop=True)
+    # El resultado sale en orden (Atleta, Fecha), el mismo orden en que ya está ordenado df
+    df['Base'] = (
+        df.groupby('Atleta', sort=True)
+        .rolling(READINESS_VENTANA_BASE, on='Fecha', closed='left')['SRD'].mean()
+        .to_numpy()
+    )
+    ultimos = df.groupby('Atleta', sort=True).tail(1).set_index('Atleta')[['Fecha', 'SRD', 'Base']]
+    ultimos = ultimos.round({'SRD': 2, 'Base': 2})
+    return ultimos, ultimos.to_dict('index')
+
+def aplicar_autorregulacion(srd, base, politica):
+    """Ajuste de carga (%), RIR adicional y estado para uno o muchos atletas a la vez."""
+    srd = np.asarray(srd, dtype=float)
+    base = np.asarray(base, dtype=float)
+    sin_dato = np.isnan(srd)
+    bajo = srd < politica['umbral_bajo']
+    adecuado = ~bajo & (srd < politica['umbral_optimo'])
+    ajuste = np.select([bajo, adecuado], [politica['ajuste_bajo_pct'], politica['ajuste_adecuado_pct']], default=0.0)
+    caida = np.nan_to_num(base - srd) >= politica['caida_base']
+    ajuste = np.where(caida, ajuste + politica['ajuste_caida_pct'], ajuste)
+    rir_extra = np.where(bajo, int(politica['rir_extra_bajo']), 0)
+    estado = np.select([bajo, adecuado], ['🔴 Bajo', '🟡 Adecuado'], default='🟢 Óptimo')
+    estado = np.where(caida & ~sin_dato, np.char.add(estado.astype(str), ' · ↓ base'), estado)
+    return np.where(sin_dato, 0.0, ajuste), np.where(sin_dato, 0, rir_extra), np.where(sin_dato, 'Sin check-in', estado)
+
+@instrumentar('cargas_ajustadas_equipo')
+def cargas_ajustadas_equipo(df_atletas, columna_rm, porcentaje, df_readiness_idx, politica):
+    """Carga prescrita y ajustada por readiness para todo el equipo en una sola pasada."""
+    df = df_atletas[['Atleta']].drop_duplicates('Atleta').copy()
+    df['RM'] = pd.to_numeric(df_atletas.drop_duplicates('Atleta')[columna_rm], errors='coerce').to_numpy() if columna_rm in df_atletas.columns else np.nan
+    df = df.join(df_readiness_idx, on='Atleta')
+    ajuste, _, estado = aplicar_autorregulacion(df['SRD'], df['Base'], politica)
+    carga = df['RM'].to_numpy(dtype=float) * porcentaje / 100
+    df['Carga Prescrita'] = np.round(carga * 2) / 2
+    df['Ajuste (%)'] = ajuste
+    df['Carga Ajustada'] = np.round(carga * (1 + ajuste / 100) * 2) / 2
+    df['Estado'] = estado
+    return df.rename(columns={'Fecha': 'Último check-in', 'Base': 'Base SRD'}).dropna(subset=['RM'])
+
+# --- LESIONES Y SEÑALES DE RIESGO (MOLESTIAS, READINESS Y CARGA) ---
+
+def carga_diaria_equipo(equipo):
+    """Volumen diario (kg x reps) por atleta, leído del agregado del registro de series (nunca del CSV)."""
+    estado = get_agregador_series()
+    with estado['lock']:
+        agregado = estado['equipos'].get(equipo)
+    if agregado is None:
+        estado['cola'].put(equipo)
+        return pd.DataFrame(columns=['Atleta', 'Fecha', 'Volumen'])
+    diario = agregado['diario']
+    if 'Volumen' not in diario.columns:
+        return pd.DataFrame(columns=['Atleta', 'Fecha', 'Volumen'])
+    return diario.groupby(['Atleta', 'Fecha'], as_index=False)['Volumen'].sum()
+
+def version_carga_equipo(equipo):
+    """Byte del registro de series hasta el que llega el agregado del equipo (None si aún no existe)."""
+    estado = get_agregador_series()
+    with estado['lock']:
+        agregado = estado['equipos'].get(equipo)
+    return None if agregado is None else agregado['offset']
+
+def registrar_molestia_lesion(atleta, fecha, region, severidad):
+    """Abre una lesión 'Activa' desde el check-in de readiness si el atleta no tiene ya una abierta en esa región."""
+    equipo = equipo_sesion()
+    df_actual = load_lesiones_data(equipo)[0]
+    abiertas = (
+        (df_actual['Atleta'] == atleta) & (df_actual['Region'] == region) & (df_actual['Estado'].astype(object) != 'Alta')
+    )
+    if abiertas.any():
+        return None
+    nueva = pd.DataFrame([{
+        'Atleta': atleta, 'Region': region, 'Severidad': severidad, 'Inicio': pd.to_datetime(fecha),
+        'Estado': 'Activa', 'Notas': 'Reportada en el check-in de readiness',
+    }], columns=LESIONES_REQUIRED_COLUMNS)
+    return anexar_filas_dataset('lesiones', df_actual, nueva)
+
+def mapa_regiones(df_lesiones):
+    """Lesiones abiertas y totales por región corporal (todas las regiones, en orden de cabeza a pies)."""
+    abiertas = df_lesiones['Estado'].astype(object) != 'Alta'
+    conteo = pd.DataFrame({
+        'Abiertas': df_lesiones[abiertas].groupby(df_lesiones['Region'].astype(object))['Atleta'].size(),
+        'Total': df_lesiones.groupby(df_lesiones['Region'].astype(object))['Atleta'].size(),
+    })
+    return conteo.reindex(REGIONES_CORPORALES).fillna(0).astype(int)
+
+def _firmas_riesgo(atletas, df_readiness, df_carga, df_lesiones):
+    """Huella por atleta de los datos que usa el modelo: si no cambia, sus señales tampoco."""
+    indice = pd.Index(atletas, name='Atleta')
+    r = df_readiness.assign(Atleta=df_readiness['Atleta'].astype(object))
+    c = df_carga.assign(Atleta=df_carga['Atleta'].astype(object))
+    l = df_lesiones.assign(Atleta=df_lesiones['Atleta'].astype(object), Abierta=df_lesiones['Estado'].astype(object) != 'Alta')
+    resumen = pd.concat([
+        r.groupby('Atleta').agg(r_n=('Fecha', 'size'), r_f=('Fecha', 'max'), r_m=('Molestias', 'sum'), r_s=('Sueño', 'sum'), r_d=('Disposicion', 'sum')),
+        c.groupby('Atleta').agg(c_n=('Fecha', 'size'), c_f=('Fecha', 'max'), c_v=('Volumen', 'sum')),
+        l.groupby('Atleta').agg(l_n=('Region', 'size'), l_a=('Abierta', 'sum'), l_s=('Severidad', 'sum')),
+    ], axis=1).reindex(indice)
+    resumen = resumen.astype({c: 'datetime64[ns]' for c in ['r_f', 'c_f']}).astype({c: float for c in resumen.columns if c not in ('r_f', 'c_f')})
+    return pd.util.hash_pandas_object(resumen, index=True)
+
+def calcular_senales_riesgo(atletas, df_readiness, df_carga, df_lesiones, hoy):
+    """Señales de riesgo vectorizadas para los atletas indicados (una fila por atleta).
+
+    - Racha: check-ins consecutivos más recientes con molestias >= RIESGO_MOLESTIAS_ALTAS.
+    - Caída: SRD del último check-in frente a la media de los 28 días anteriores.
+    - Pico de carga: ACWR = volumen de 7 días / (volumen de 28 días / 4).
+    - Lesión: alguna lesión abierta (activa o en recuperación).
+    """
+    hoy = pd.Timestamp(hoy).normalize()
+    resultado = pd.DataFrame(index=pd.Index(atletas, name='Atleta'))
+
+    r = df_readiness[df_readiness['Atleta'].isin(atletas)].dropna(subset=['Atleta', 'Fecha'])
+    r = r.assign(
+        Atleta=r['Atleta'].astype(object), Fecha=pd.to_datetime(r['Fecha']).astype('datetime64[ns]'),
+        SRD=calcular_srd(r['Sueño'], r['Molestias'], r['Disposicion']),
+        Alta=pd.to_numeric(r['Molestias'], errors='coerce') >= RIESGO_MOLESTIAS_ALTAS,
+    ).sort_values(['Atleta', 'Fecha'], kind='stable', ignore_index=True)
+    # Racha: se reinicia cada vez que aparece un check-in sin molestias altas
+    tramo = (~r['Alta']).groupby(r['Atleta']).cumsum()
+    r['Racha'] = r['Alta'].astype(int).groupby([r['Atleta'], tramo]).cumsum()
+    r['Base'] = r.groupby('Atleta', sort=True).rolling(READINESS_VENTANA_BASE, on='Fecha', closed='left')['SRD'].mean().to_numpy()
+    ultimos = r.groupby('Atleta').tail(1).set_index('Atleta')
+    resultado = resultado.join(ultimos[['Fecha', 'SRD', 'Base', 'Racha']].rename(columns={'Fecha': 'Último check-in'}))
+    resultado['Racha'] = resultado['Racha'].fillna(0).astype(int)
+
+    c = df_carga[df_carga['Atleta'].isin(atletas)]
+    c = c[(c['Fecha'] > hoy - pd.Timedelta(days=28)) & (c['Fecha'] <= hoy)]
+    aguda = c[c['Fecha'] > hoy - pd.Timedelta(days=7)].groupby(c['Atleta'].astype(object))['Volumen'].sum()
+    cronica = c.groupby(c['Atleta'].astype(object))['Volumen'].sum() / 4
+    resultado['ACWR'] = (aguda.reindex(resultado.index).fillna(0) / cronica.reindex(resultado.index).where(lambda x: x > 0)).round(2)
+
+    l = df_lesiones[df_lesiones['Atleta'].isin(atletas) & (df_lesiones['Estado'].astype(object) != 'Alta')]
+    abiertas = l.groupby(l['Atleta'].astype(object)).agg(
+        Lesiones=('Region', 'size'), Severidad=('Severidad', 'max'),
+        Regiones=('Region', lambda x: ', '.join(sorted(x.astype(str).unique()))),
+    )
+    resultado = resultado.join(abiertas)
+    resultado['Lesiones'] = resultado['Lesiones'].fillna(0).astype(int)
+
+    vigente = (hoy - resultado['Último check-in']).dt.days <= RIESGO_VIGENCIA_DIAS
+    senales = pd.DataFrame({
+        f"Racha de molestias (≥{RIESGO_RACHA_MOLESTIAS})": vigente & (resultado['Racha'] >= RIESGO_RACHA_MOLESTIAS),
+        'Caída de readiness': vigente & ((resultado['Base'] - resultado['SRD']) >= RIESGO_CAIDA_SRD),
+        f"Pico de carga (ACWR > {RIESGO_ACWR_MAX:g})": resultado['ACWR'] > RIESGO_ACWR_MAX,
+        'Lesión abierta': resultado['Lesiones'] > 0,
+    }).fillna(False).astype(bool)
+
+    resultado['Señales'] = senales.sum(axis=1)
+    grave = resultado['Severidad'].fillna(0) >= 4
+    resultado['Riesgo'] = np.select(
+        [(resultado['Señales'] >= 2) | grave, resultado['Señales'] == 1], ['🔴 Alto', '🟡 Moderado'], default='🟢 Bajo'
+    )
+    nombres = np.array(senales.columns, dtype=object)
+    resultado['Motivos'] = [', '.join(nombres[fila]) for fila in senales.to_numpy()]
+    return resultado.round({'SRD': 2, 'Base': 2}).reset_index()
+
+@st.cache_resource
+def get_riesgo_store():
+    """Señales de riesgo por equipo con las versiones de sus datos y la huella de cada atleta, para recalcular solo lo que cambió."""
+    return {'lock': threading.Lock(), 'equipos': {}}
+
+@instrumentar('senales_riesgo_equipo')
+def senales_riesgo_equipo(equipo, df_atletas, df_readiness, df_lesiones):
+    """Señales de riesgo de todo el equipo, recalculadas solo cuando cambia alguno de sus datos.
+
+    Mientras no cambien las versiones de readiness, lesiones y el agregado de series (ni el día ni
+    la lista de atletas) se devuelve la tabla guardada sin tocar los datos. Si alguna cambia, las
+    huellas por atleta deciden a quién recalcular: un check-in nuevo, una serie registrada o una
+    lesión editada solo afectan a ese atleta; un cambio de día recalcula a todos (las ventanas de
+    7 y 28 días se desplazan).
+    """
+    hoy = pd.Timestamp(datetime.now().date())
+    atletas = (
+        df_atletas.loc[df_atletas['Rol'].astype(object).astype(str).str.strip() != 'Entrenador', 'Atleta']
+        .dropna().astype(str).drop_duplicates().tolist()
+    )
+    versiones = (
+        hoy, tuple(atletas),
+        version_archivo(ruta_equipo(READINESS_FILE, equipo)),
+        version_archivo(ruta_equipo(LESIONES_FILE, equipo)),
+        version_carga_equipo(equipo),
+    )
+
+    store = get_riesgo_store()
+    with store['lock']:
+        previo = store['equipos'].get(equipo)
+    if previo is not None and previo['versiones'] == versiones:
+        return previo['tabla'], 0
+
+    df_carga = carga_diaria_equipo(equipo)
+    firmas = _firmas_riesgo(atletas, df_readiness, df_carga, df_lesiones)
+    if previo is None or previo['hoy'] != hoy:
+        cambiados = atletas
+        tabla = None
+    else:
+        anteriores = previo['firmas'].reindex(firmas.index)
+        cambiados = firmas.index[anteriores.to_numpy() != firmas.to_numpy()].tolist()
+        tabla = previo['tabla'][previo['tabla']['Atleta'].isin(atletas) & ~previo['tabla']['Atleta'].isin(cambiados)]
+
+    if cambiados or tabla is None:
+        nuevas = calcular_senales_riesgo(cambiados, df_readiness, df_carga, df_lesiones, hoy)
+        tabla = nuevas if tabla is None else pd.concat([tabla, nuevas], ignore_index=True)
+        tabla = tabla.sort_values(['Señales', 'Severidad'], ascending=False, ignore_index=True)
+    with store['lock']:
+        store['equipos'][equipo] = {
+            'hoy': hoy, 'versiones': versiones, 'firmas': firmas, 'tabla': tabla,
+            'recalculados': len(cambiados), 'actualizado': datetime.now(),
+        }
+    return tabla, len(cambiados)
+
+# --- TABLAS PAGINADAS CON FILTRO EN SERVIDOR ---
+
+TAMANOS_PAGINA = [25, 50, 100, 250]
+
+def huella_tabla(df):
+    """Huella estructural (filas y columnas) que distingue en caché los DataFrames derivados del mismo archivo.
+
+    No recorre los valores: para una misma versión del archivo el contenido ya queda determinado,
+    así que basta con separar las vistas que añaden, quitan o filtran filas/columnas.
+    """
+    return (df.shape, tuple(map(str, df.columns)))
+
+@instrumentar('consultar_tabla')
+@st.cache_data(ttl=600, max_entries=500)
+def consultar_tabla(_df, dataset, version, huella, busqueda, columna_busqueda, columna_filtro, valores_filtro, columna_orden, descendente, pagina, tam_pagina):
+    """Filtra, ordena y pagina en el servidor; la caché se indexa por dataset, versión, huella del DataFrame y parámetros."""
+    registrar_cache_miss('consultar_tabla')
+    df = _df
+
+    if busqueda and columna_busqueda in df.columns:
+        df = df[df[columna_busqueda].astype(str).str.contains(busqueda, case=False, regex=False, na=False)]
+    if columna_filtro and valores_filtro and columna_filtro in df.columns:
+        df = df[df[columna_filtro].astype(str).isin(valores_filtro)]
+    if columna_orden and columna_orden in df.columns:
+        df = df.sort_values(columna_orden, ascending=not descendente, kind='stable', na_position='last')
+
+    total = len(df)
+    inicio = (pagina - 1) * tam_pagina
+    return df.iloc[inicio:inicio + tam_pagina], total
+
+def tabla_paginada(clave, df, dataset, ruta_origen, columna_busqueda='Atleta', columna_filtro=None, columnas_orden=None):
+    """Dibuja los controles de búsqueda/filtro/orden/página y devuelve solo la página visible del DataFrame."""
+    col_busq, col_filtro, col_orden, col_tam, col_pag = st.columns([2, 2, 2, 1, 1])
+
+    with col_busq:
+        busqueda = st.text_input("🔎 Buscar atleta:", key=f"{clave}_busqueda").strip()
+    with col_filtro:
+        valores_filtro = []
+        if columna_filtro and columna_filtro in df.columns:
+            opciones = sorted(df[columna_filtro].dropna().astype(str).unique().tolist())
+            valores_filtro = st.multiselect(f"Filtrar por {columna_filtro}:", options=opciones, key=f"{clave}_filtro")
+    with col_orden:
+        opciones_orden = ['(sin ordenar)'] + [c for c in (columnas_orden or df.columns.tolist()) if c in df.columns]
+        columna_orden = st.selectbox("Ordenar por:", options=opciones_orden, key=f"{clave}_orden")
+        descendente = st.toggle("Descendente", key=f"{clave}_desc")
+    with col_tam:
+        tam_pagina = st.selectbox("Filas:", options=TAMANOS_PAGINA, key=f"{clave}_tam")
+
+    parametros = (
+        f"{equipo_sesion()}/{dataset}", version_archivo(ruta_origen), huella_tabla(df), busqueda, columna_busqueda, columna_filtro,
+        tuple(valores_filtro), None if columna_orden == '(sin ordenar)' else columna_orden, descendente,
+    )
+    pagina = st.session_state.get(f"{clave}_pagina", 1)
+    df_pagina, total = consultar_tabla(df, *parametros, pagina, tam_pagina)
+    n_paginas = max(1, -(-total // tam_pagina))
+
+    # Si el filtro redujo el total, la página guardada puede quedar fuera de rango
+    if pagina > n_paginas:
+        pagina = n_paginas
+        st.session_state[f"{clave}_pagina"] = pagina
+        df_pagina, total = consultar_tabla(df, *parametros, pagina, tam_pagina)
+
+    with col_pag:
+        st.number_input("Página:", min_value=1, max_value=n_paginas, step=1, key=f"{clave}_pagina")
+
+    inicio = (pagina - 1) * tam_pagina
+    st.caption(f"Mostrando {min(inicio + 1, total)}–{min(inicio + tam_pagina, total)} de {total} filas (página {pagina} de {n_paginas}).")
+    return df_pagina
+
+# --- INGESTA DE SESIONES DE PULSÓMETRO/GPS (FIT/TCX/GPX/CSV) ---
+
+# Límites de zona como fracción de la FC Máx (mismos porcentajes que la pestaña de Acondicionamiento)
+ZONAS_FC_LIMITES = np.array([0.50, 0.60, 0.70, 0.80, 0.90])
+ZONAS_FC_NOMBRES = ["Bajo Zona 1", "Zona 1: Muy Ligera", "Zona 2: Ligera", "Zona 3: Aeróbica", "Zona 4: Umbral", "Zona 5: Máxima"]
+SESION_CHUNK_MUESTRAS = 20000   # Muestras por bloque (~5.5 h a 1 Hz caben en 1 bloque de 20k)
+SESION_MAX_GAP_S = 10.0         # Pausas más largas no suman tiempo en zona
+
+def _nombre_local(etiqueta):
+    """Quita el namespace XML de una etiqueta ('{ns}Trackpoint' -> 'Trackpoint')."""
+    return etiqueta.rsplit('}', 1)[-1]
+
+def _bloque_desde_listas(tiempos, fcs, lats, lons):
+    """Convierte las listas acumuladas de un bloque en arrays NumPy (tiempo en segundos epoch)."""
+    t = pd.to_datetime(pd.Series(tiempos), utc=True, errors='coerce').to_numpy(dtype='datetime64[ns]').astype('int64') / 1e9
+    return {
+        't': t,
+        'fc': np.array(fcs, dtype=float),
+        'lat': np.array(lats, dtype=float),
+        'lon': np.array(lons, dtype=float),
+    }
+
+def _bloques_xml(flujo, etiqueta_punto):
+    """Lee puntos de TCX ('Trackpoint') o GPX ('trkpt') en streaming con iterparse, por bloques."""
+    import xml.etree.ElementTree as ET
+
+    tiempos, fcs, lats, lons = [], [], [], []
+    for _, elem in ET.iterparse(flujo, events=('end',)):
+        if _nombre_local(elem.tag) != etiqueta_punto:
+            continue
+        t = fc = lat = lon = None
+        lat = elem.get('lat')
+        lon = elem.get('lon')
+        for hijo in elem.iter():
+            nombre = _nombre_local(hijo.tag)
+            if nombre == 'Time' or nombre == 'time':
+                t = hijo.text
+            elif nombre == 'Value' or nombre == 'hr':
+                fc = hijo.text
+            elif nombre == 'LatitudeDegrees':
+                lat = hijo.text
+            elif nombre == 'LongitudeDegrees':
+                lon = hijo.text
+        elem.clear()
+
+        tiempos.append(t)
+        fcs.append(fc if fc is not None else np.nan)
+        lats.append(lat if lat is not None else np.nan)
+        lons.append(lon if lon is not None else np.nan)
+        if len(tiempos) >= SESION_CHUNK_MUESTRAS:
+            yield _bloque_desde_listas(tiempos, fcs, lats, lons)
+            tiempos, fcs, lats, lons = [], [], [], []
+    if tiempos:
+        yield _bloque_desde_listas(tiempos, fcs, lats, lons)
+
+def _bloques_csv(flujo):
+    """Lee un CSV por bloques; detecta columnas de FC, tiempo y GPS por nombre (1 Hz si no hay tiempo)."""
+    posicion = 0.0
+    primera_linea = flujo.readline().decode('utf-8', errors='ignore')
+    flujo.seek(0)
+    separador = ';' if primera_linea.count(';') > primera_linea.count(',') else ','
+    for df in pd.read_csv(flujo, chunksize=SESION_CHUNK_MUESTRAS, sep=separador):
+        columnas = {c.lower().strip(): c for c in df.columns}
+        col_fc = next((columnas[c] for c in ['hr', 'heart_rate', 'heartrate', 'fc', 'bpm', 'frecuencia', 'frecuencia_cardiaca'] if c in columnas), None)
+        col_t = next((columnas[c] for c in ['time', 'timestamp', 'tiempo', 'fecha', 'seconds', 'segundos', 'secs'] if c in columnas), None)
+        col_lat = next((columnas[c] for c in ['lat', 'latitude', 'latitud'] if c in columnas), None)
+        col_lon = next((columnas[c] for c in ['lon', 'lng', 'longitude', 'longitud'] if c in columnas), None)
+        if col_fc is None:
+            raise ValueError("El CSV no tiene una columna de frecuencia cardíaca (hr, heart_rate, fc, bpm...).")
+
+        n = len(df)
+        if col_t is None:
+            t = posicion + np.arange(n, dtype=float)
+        elif pd.api.types.is_numeric_dtype(df[col_t]):
+            t = df[col_t].to_numpy(dtype=float)
+        else:
+            t = pd.to_datetime(df[col_t], utc=True, errors='coerce').to_numpy(dtype='datetime64[ns]').astype('int64') / 1e9
+        posicion += n
+
+        yield {
+            't': t,
+            'fc': pd.to_numeric(df[col_fc], errors='coerce').to_numpy(dtype=float),
+            'lat': pd.to_numeric(df[col_lat], errors='coerce').to_numpy(dtype=float) if col_lat else np.full(n, np.nan),
+            'lon': pd.to_numeric(df[col_lon], errors='coerce').to_numpy(dtype=float) if col_lon else np.full(n, np.nan),
+        }
+
+def _bloques_fit(flujo):
+    """Lee registros 'record' de un archivo FIT (requiere el paquete opcional 'fitparse')."""
+    if fitparse is None:
+        raise ValueError("Para leer archivos .fit instala el paquete opcional 'fitparse' (pip install fitparse).")
+
+    semicirculos = 180.0 / 2 ** 31
+    tiempos, fcs, lats, lons = [], [], [], []
+    for mensaje in fitparse.FitFile(flujo).get_messages('record'):
+        valores = mensaje.get_values()
+        tiempos.append(valores.get('timestamp'))
+        fcs.append(valores.get('heart_rate', np.nan))
+        lat, lon = valores.get('position_lat'), valores.get('position_long')
+        lats.append(lat * semicirculos if lat is not None else np.nan)
+        lons.append(lon * semicirculos if lon is not None else np.nan)
+        if len(tiempos) >= SESION_CHUNK_MUESTRAS:
+            yield _bloque_desde_listas(tiempos, fcs, lats, lons)
+            tiempos, fcs, lats, lons = [], [], [], []
+    if tiempos:
+        yield _bloque_desde_listas(tiempos, fcs, lats, lons)
+
+def bloques_sesion(nombre_archivo, contenido):
+    """Elige el lector en streaming según la extensión del archivo."""
+    extension = os.path.splitext(nombre_archivo)[1].lower()
+    flujo = io.BytesIO(contenido)
+    if extension == '.tcx':
+        return _bloques_xml(flujo, 'Trackpoint')
+    if extension == '.gpx':
+        return _bloques_xml(flujo, 'trkpt')
+    if extension == '.fit':
+        return _bloques_fit(flujo)
+    if extension == '.csv':
+        return _bloques_csv(flujo)
+    raise ValueError(f"Formato no soportado: {extension}")
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros entre pares de coordenadas (vectorizado)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * np.arcsin(np.sqrt(a))
+
+@instrumentar('analizar_sesion_fc')
+@st.cache_data(max_entries=100)
+def analizar_sesion_fc(hash_archivo, nombre_archivo, _contenido, limites_zona, fc_max_ref, fc_reposo, sexo):
+    """Procesa la sesión por bloques: tiempo por zona, TRIMP de Banister, FC máx real y distancia.
+
+    'limites_zona' son los 5 límites inferiores (ppm) de las zonas personalizadas del atleta.
+
+    Solo se guardan acumuladores entre bloques (último tiempo/posición), nunca la serie completa.
+    La caché se indexa por el hash del archivo y los parámetros del atleta.
+    """
+    registrar_cache_miss('analizar_sesion_fc')
+    k_trimp = 1.92 if sexo == 'Hombre' else 1.67
+
+    segundos_zona = np.zeros(len(ZONAS_FC_NOMBRES))
+    trimp = suma_fc = tiempo_total = distancia = 0.0
+    fc_max_real = 0.0
+    muestras = 0
+    t_previo = lat_previa = lon_previa = np.nan
+    fc_previa = np.nan
+
+    for bloque in bloques_sesion(nombre_archivo, _contenido):
+        t, fc = bloque['t'], bloque['fc']
+        fc = np.where((fc >= 30) & (fc <= 240), fc, np.nan)
+
+        # Intervalo de cada muestra respecto a la anterior (enlazando con el bloque previo)
+        dt = np.diff(np.concatenate(([t_previo], t)))
+        dt = np.where(np.isfinite(dt) & (dt > 0) & (dt <= SESION_MAX_GAP_S), dt, 0.0)
+        fc_intervalo = np.concatenate(([fc_previa], fc[:-1])) if len(fc) else fc
+        valido = np.isfinite(fc_intervalo) & (dt > 0)
+
+        if fc_max_ref:
+            limites = np.asarray(limites_zona if limites_zona else ZONAS_FC_LIMITES * fc_max_ref)
+            zona = np.searchsorted(limites, fc_intervalo[valido], side='right')
+            segundos_zona += np.bincount(zona, weights=dt[valido], minlength=len(ZONAS_FC_NOMBRES))[:len(ZONAS_FC_NOMBRES)]
+
+            reserva = np.clip((fc_intervalo[valido] - fc_reposo) / max(fc_max_ref - fc_reposo, 1), 0, None)
+            trimp += np.sum(dt[valido] / 60 * reserva * 0.64 * np.exp(k_trimp * reserva))
+
+        tiempo_total += dt[valido].sum()
+        suma_fc += np.sum(fc_intervalo[valido] * dt[valido])
+        if np.isfinite(fc).any():
+            # FC máx real: máximo de la media móvil de 5 muestras para ignorar picos aislados
+            fc_suave = pd.Series(fc).rolling(5, min_periods=3).mean().to_numpy()
+            if np.isfinite(fc_suave).any():
+                fc_max_real = max(fc_max_real, float(np.nanmax(fc_suave)))
+        muestras += len(fc)
+
+        lat, lon = bloque['lat'], bloque['lon']
+        if np.isfinite(lat).any():
+            lat_ext = np.concatenate(([lat_previa], lat))
+            lon_ext = np.concatenate(([lon_previa], lon))
+            tramos = _haversine_m(lat_ext[:-1], lon_ext[:-1], lat_ext[1:], lon_ext[1:])
+            distancia += np.nansum(tramos)
+            ultimas = np.flatnonzero(np.isfinite(lat))
+            lat_previa, lon_previa = lat[ultimas[-1]], lon[ultimas[-1]]
+
+        if len(t):
+            t_previo = t[-1]
+            fc_previa = fc[-1]
+
+    return {
+        'muestras': muestras,
+        'duracion_s': tiempo_total,
+        'fc_media': suma_fc / tiempo_total if tiempo_total > 0 else np.nan,
+        'fc_max_real': fc_max_real if fc_max_real > 0 else np.nan,
+        'trimp': trimp if fc_max_ref else np.nan,
+        'distancia_km': distancia / 1000,
+        'minutos_zona': pd.Series(segundos_zona / 60, index=ZONAS_FC_NOMBRES).round(1),
+    }
+
 # --- NUEVAS FUNCIONES PARA EL RESALTADO ---
 
 def get_days_until(date_obj):
@@ -534,963 +3991,2169 @@ def highlight_imminent_events(df):
     
     return styles
 
-# --- FUNCIÓN CLAVE PARA LA FC MAX (TANAKA) Y TMB (MIFFLIN) ---
-def calculate_tmb_mifflin(peso_kg, altura_cm, edad_anos, sexo):
-    """Calcula la Tasa Metabólica Basal (TMB) usando la fórmula de Mifflin-St Jeor."""
-    if peso_kg <= 0 or altura_cm <= 0 or edad_anos <= 0:
-        return 0
+def dias_hasta(fechas, hoy=None):
+    """Versión vectorizada de get_days_until para una columna de fechas (999 si falta la fecha)."""
+    hoy = pd.Timestamp(hoy or datetime.now().date())
+    dias = (pd.to_datetime(fechas, errors='coerce') - hoy).dt.days
+    return dias.fillna(999).astype(int)
+
+# --- TAREAS PROGRAMADAS: AGREGADOS NOCTURNOS, VISTAS MATERIALIZADAS E INSTANTÁNEAS ---
+
+# Archivos que entran en la instantánea diaria de cada equipo
+ARCHIVOS_INSTANTANEA = [
+    EXCEL_FILE, CALENDAR_FILE, PRUEBAS_FILE, PERFILES_FILE, RANKING_FILE, READINESS_FILE, VAM_FILE,
+    PESAJES_FILE, PLANTILLAS_FILE, SERIES_LOG_FILE, VBT_LOG_FILE, AUDIT_LOG_FILE, POLITICA_FILE, ASISTENCIA_LOG_FILE, LESIONES_FILE,
+]
+# Datasets append-only cuyo XLSX se compacta (solo filas totalmente vacías)
+DATASETS_COMPACTABLES = {'readiness': READINESS_FILE, 'vam': VAM_FILE, 'pesajes': PESAJES_FILE}
+
+@st.cache_resource
+def get_tareas_programadas():
+    """Estado compartido del planificador: vistas materializadas por equipo, historial de ejecuciones y un hilo que lanza las tareas a su hora."""
+    estado = {'lock': threading.Lock(), 'cola': queue.Queue(), 'vistas': {}, 'ejecuciones': {}}
+    hilo = threading.Thread(target=_bucle_tareas, args=(estado,), daemon=True, name='tareas-programadas')
+    hilo.start()
+    return estado
+
+def _tareas_pendientes(estado, ahora):
+    """Tareas cuya hora de hoy ya pasó y que aún no se ejecutaron hoy."""
+    pendientes = []
+    for tarea, hora in TAREAS_HORARIO.items():
+        ultima = estado['ejecuciones'].get(tarea, {}).get('Última ejecución')
+        if ahora.time() >= hora and (ultima is None or ultima.date() < ahora.date()):
+            pendientes.append(tarea)
+    return pendientes
+
+def _bucle_tareas(estado):
+    """Revisa el horario cada TAREAS_INTERVALO_S segundos; las peticiones manuales llegan por la cola."""
+    # Recuperación tras un reinicio: las tareas de hoy cuya hora ya pasó se ejecutan una vez al arrancar
+    # (todas son idempotentes: la instantánea del día se sobrescribe y la compactación no repite trabajo)
+    for tarea in _tareas_pendientes(estado, datetime.now()):
+        ejecutar_tarea(estado, tarea)
+    while True:
+        try:
+            tareas = [estado['cola'].get(timeout=TAREAS_INTERVALO_S)]
+        except queue.Empty:
+            tareas = _tareas_pendientes(estado, datetime.now())
+        for tarea in tareas:
+            ejecutar_tarea(estado, tarea)
+
+def ejecutar_tarea(estado, tarea):
+    """Ejecuta una tarea para todos los equipos habilitados y guarda el resultado en el historial."""
+    inicio = time_mod.perf_counter()
+    resultados = []
+    try:
+        equipos = load_equipos_data()
+        for equipo in equipos.loc[equipos['Habilitado'], 'Equipo']:
+            with medir_tiempo(f"tarea.{tarea}"):
+                resultados.append(f"{equipo}: {TAREAS[tarea](equipo)}")
+        resultado = ' | '.join(resultados) or 'Sin equipos habilitados'
+    except Exception as e:
+        resultado = f"Error: {e}"
+        logger.exception("Error en la tarea programada '%s'", tarea)
+    with estado['lock']:
+        estado['ejecuciones'][tarea] = {
+            'Última ejecución': datetime.now(),
+            'Duración (s)': round(time_mod.perf_counter() - inicio, 2),
+            'Resultado': resultado,
+        }
 
-    if sexo == 'Hombre':
-        tmb = (10 * peso_kg) + (6.25 * altura_cm) - (5 * edad_anos) + 5
-    else: # Mujer
-        tmb = (10 * peso_kg) + (6.25 * altura_cm) - (5 * edad_anos) - 161
-    return round(tmb)
+def _tarea_agregados(equipo):
+    """Procesa las series y repeticiones VBT nuevas y precalcula el índice de readiness del equipo."""
+    _agregar_series_nuevas(get_agregador_series(), equipo)
+    actualizar_perfiles_vbt(equipo)
+    df_readiness_equipo = dataset_compartido('readiness', equipo)[0]
+    indice_readiness(df_readiness_equipo, equipo, version_archivo(ruta_equipo(READINESS_FILE, equipo)))
+    return 'agregados al día'
+
+def compactar_dataset(dataset, equipo):
+    """Reescribe el XLSX append-only sin filas totalmente vacías; devuelve las filas eliminadas.
+
+    Las filas idénticas se conservan (dos pesajes iguales son registros legítimos). La lectura y la
+    reescritura se hacen con el lock del archivo para no perder un guardado concurrente, y las
+    filas eliminadas quedan en la bitácora de auditoría.
+    """
+    archivo = DATASETS_COMPACTABLES[dataset]
+    ruta = ruta_equipo(archivo, equipo)
+    with bloqueo_archivo(ruta):
+        if not os.path.exists(ruta):
+            return 0
+        df = leer_excel(ruta)
+        vacias = df.isna().all(axis=1)
+        eliminadas = int(vacias.sum())
+        if eliminadas:
+            escribir_excel(df[~vacias], ruta)
+            registrar_mutacion(dataset, df[vacias], df.iloc[0:0], None, equipo=equipo, actor='compactación nocturna')
+            publicar_cambio(dataset, equipo)
+    return eliminadas
+
+def _tarea_instantanea(equipo):
+    """Guarda un ZIP con los archivos de datos del equipo, poda las instantáneas antiguas y compacta los datasets append-only."""
+    carpeta = os.path.join(carpeta_equipo(equipo), SNAPSHOTS_DIR)
+    os.makedirs(carpeta, exist_ok=True)
+    ruta_zip = os.path.join(carpeta, f"{datetime.now().strftime('%Y%m%d')}.zip")
+    with zipfile.ZipFile(ruta_zip, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for archivo in ARCHIVOS_INSTANTANEA:
+            ruta = ruta_equipo(archivo, equipo)
+            if os.path.exists(ruta):
+                zf.write(ruta, arcname=archivo)
+
+    antiguas = sorted(f for f in os.listdir(carpeta) if f.endswith('.zip'))[:-SNAPSHOTS_RETENCION]
+    for nombre in antiguas:
+        os.remove(os.path.join(carpeta, nombre))
+
+    eliminadas = sum(compactar_dataset(dataset, equipo) for dataset in DATASETS_COMPACTABLES)
+    return f"{os.path.basename(ruta_zip)}, {eliminadas} filas compactadas"
+
+def materializar_vistas(estado, equipo):
+    """Calcula el ranking y los próximos eventos del equipo para el día de hoy y los guarda en el estado compartido."""
+    df_cal = load_calendar_data(equipo)
+    eventos = df_cal[df_cal['Habilitado'] == True].copy()
+    eventos['Days_Until'] = dias_hasta(eventos['Fecha'])
+    ranking = load_ranking_data(equipo)[0]
+
+    vista = {
+        'fecha': datetime.now().date(),
+        'version_calendario': version_archivo(ruta_equipo(CALENDAR_FILE, equipo)),
+        'version_ranking': version_archivo(ruta_equipo(RANKING_FILE, equipo)),
+        'eventos': eventos,
+        'inminentes': eventos[eventos['Days_Until'].between(0, EVENTOS_DIAS_AVISO)].sort_values('Days_Until'),
+        'ranking': ranking,
+        'posiciones': ranking.drop_duplicates('Atleta').set_index('Atleta') if not ranking.empty else ranking,
+    }
+    with estado['lock']:
+        estado['vistas'][equipo] = vista
+    return vista
+
+def _tarea_vistas(equipo):
+    """Materializa las vistas del equipo antes de la primera sesión del día."""
+    vista = materializar_vistas(get_tareas_programadas(), equipo)
+    return f"{len(vista['ranking'])} en ranking, {len(vista['inminentes'])} eventos inminentes"
+
+def _tarea_precalentar(equipo):
+    """Llena la caché de los loaders y de los cálculos por equipo que usa la primera carga de la mañana."""
+    datasets = {dataset: df for dataset, (df, _) in cargar_datasets(equipo, list(LOADERS_DATASET)).items()}
+    load_politica_autorregulacion(equipo)
+    calcular_zonas_equipo(datasets['perfiles'], equipo, version_archivo(ruta_equipo(PERFILES_FILE, equipo)))
+    ultimas_pruebas_vam(datasets['vam'], equipo, version_archivo(ruta_equipo(VAM_FILE, equipo)))
+    tendencia_peso(datasets['pesajes'], equipo, version_archivo(ruta_equipo(PESAJES_FILE, equipo)))
+    indice_competencias(datasets['calendario'], equipo, version_archivo(ruta_equipo(CALENDAR_FILE, equipo)))
+    _tarea_agregados(equipo)
+    _tarea_vistas(equipo)
+    return 'caché lista'
+
+TAREAS = {
+    'agregados': _tarea_agregados,
+    'instantanea': _tarea_instantanea,
+    'vistas': _tarea_vistas,
+    'precalentar': _tarea_precalentar,
+}
 
-# --- FUNCIÓN CLAVE PARA EL RANKING AUTOMATIZADO ---
-def calculate_and_sort_ranking(df):
-    """Calcula los puntos y ordena el ranking por jerarquía de medallas (Oros > Platas > Bronces)."""
-    
-    for col in ['Oros', 'Platas', 'Bronces']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-        
-    df['Puntos'] = (df['Oros'] * 10) + (df['Platas'] * 3) + (df['Bronces'] * 1)
-    
-    df_sorted = df.sort_values(
-        by=['Oros', 'Platas', 'Bronces', 'Puntos'], 
-        ascending=[False, False, False, False]
-    ).copy()
-    
-    df_sorted['Posicion'] = np.arange(1, len(df_sorted) + 1)
-    
-    return df_sorted
-# -------------------------------------------
+def vista_materializada(equipo):
+    """Vista del equipo: la materializada si sigue vigente (mismo día y archivos sin cambios) o una recién calculada."""
+    estado = get_tareas_programadas()
+    with estado['lock']:
+        vista = estado['vistas'].get(equipo)
+    vigente = (
+        vista is not None
+        and vista['fecha'] == datetime.now().date()
+        and vista['version_calendario'] == version_archivo(ruta_equipo(CALENDAR_FILE, equipo))
+        and vista['version_ranking'] == version_archivo(ruta_equipo(RANKING_FILE, equipo))
+    )
+    if vigente:
+        return vista
+    with medir_tiempo('vistas.materializar'):
+        return materializar_vistas(estado, equipo)
+
+def resumen_tareas():
+    """Tabla con la próxima hora y la última ejecución de cada tarea programada."""
+    estado = get_tareas_programadas()
+    with estado['lock']:
+        ejecuciones = {tarea: dict(datos) for tarea, datos in estado['ejecuciones'].items()}
+    filas = [
+        {'Tarea': tarea, 'Hora': hora.strftime('%H:%M'), **ejecuciones.get(tarea, {'Última ejecución': None, 'Duración (s)': None, 'Resultado': 'Pendiente'})}
+        for tarea, hora in TAREAS_HORARIO.items()
+    ]
+    return pd.DataFrame(filas, columns=['Tarea', 'Hora', 'Última ejecución', 'Duración (s)', 'Resultado'])
 
 
 # --- 5. INTERFAZ PRINCIPAL DE STREAMLIT ---
 
-st.set_page_config(layout="wide", page_title="Gestión de Rendimiento Atleta")
-
-# Muestra mensajes de estado críticos (CREACIÓN o ERROR)
-if initial_status and ('creado' in initial_status.lower() or 'error' in initial_status.lower() or 'adver' in initial_status.lower()):
-    st.toast(initial_status, icon="📝")
-if tests_status and ('creado' in tests_status.lower() or 'error' in tests_status.lower() or 'adver' in tests_status.lower()):
-    st.toast(tests_status, icon="🛠️")
-if perfil_status and ('creado' in perfil_status.lower() or 'error' in perfil_status.lower() or 'adver' in perfil_status.lower()):
-    st.toast(perfil_status, icon="👤")
-if ranking_status and ('creado' in ranking_status.lower() or 'error' in ranking_status.lower() or 'adver' in ranking_status.lower()):
-    st.toast(ranking_status, icon="🏆")
-if readiness_status and ('creado' in readiness_status.lower() or 'error' in readiness_status.lower() or 'adver' in readiness_status.lower()):
-    st.toast(readiness_status, icon="🧘")
-
-
-# Inicializar el estado de la sesión
-if 'logged_in' not in st.session_state:
-    st.session_state['logged_in'] = False
-
-# ----------------------------------------------------------------------
-# --- PANTALLA DE ACCESO/BIENVENIDA ---
-# ----------------------------------------------------------------------
-if not st.session_state['logged_in']:
-    
-    logo_col, spacer_col = st.columns([1, 10])
-    with logo_col:
-        st.image(LOGO_PATH, width=120) 
-    
-    st.markdown("---") 
+# Todo el cuerpo de la interfaz va en try/finally: st.stop() y st.rerun() también cierran la medición
+try:
+    st.set_page_config(layout="wide", page_title="Gestión de Rendimiento Atleta")
 
-    col1, col2, col3 = st.columns([1, 3, 1]) 
-    
-    with col2: 
-        
-        st.markdown(
-            f"<h1 style='text-align: center; color: #FFA500;'>¡Bienvenido al Gestor de Rendimiento!</h1>", 
-            unsafe_allow_html=True
-        )
-        
-        st.markdown(
-            f"<p style='text-align: center; font-size: 1.2em; color: white;'>Tu plataforma para gestionar marcas personales, calcular cargas y organizar tu calendario deportivo.</p>", 
-            unsafe_allow_html=True
-        )
-        
-        st.info("Por favor, inicia sesión para acceder a la aplicación.")
-        login_form()
-        
-    st.stop()
-    
-# ----------------------------------------------------------------------
-# --- CONTENIDO DE LA APLICACIÓN (POST-LOGIN) ---
-# ----------------------------------------------------------------------
-
-st.title("💪 RM & Rendimiento Manager")
-logout() 
-
-if st.session_state['logged_in']:
-    st.sidebar.image(LOGO_PATH, width=100)
-    st.sidebar.markdown("---")
-
-rol_actual = st.session_state['rol']
-atleta_actual = st.session_state['atleta_nombre']
-
-# Definición de pestañas
-if rol_actual == 'Entrenador':
-    tab1, tab2, CALENDAR_TAB, PERFIL_TAB, ACOND_TAB, GESTION_PESO_TAB, RECUPERACION_TAB, RANKING_TAB = st.tabs([
-        "📊 Vista Entrenador (Datos)", 
-        "🧮 Calculadora de Carga", 
-        "📅 Calendario", 
-        "👤 Perfil", 
-        "🏃 Acondicionamiento", 
-        "⚖️ Gestión de Peso",
-        "🌡️ Recuperación",
-        "🏆 Ranking"
-    ])
-else:
-    tab2, CALENDAR_TAB, PERFIL_TAB, ACOND_TAB, GESTION_PESO_TAB, RECUPERACION_TAB, RANKING_TAB = st.tabs([
-        "🧮 Calculadora de Carga", 
-        "📅 Calendario", 
-        "👤 Perfil", 
-        "🏃 Acondicionamiento", 
-        "⚖️ Gestión de Peso",
-        "🌡️ Recuperación",
-        "🏆 Ranking"
-    ])
+    # Arranca (una sola vez por proceso) el planificador de tareas nocturnas
+    get_tareas_programadas()
 
-# ----------------------------------------------------------------------------------
-## NOTIFICACIÓN GLOBAL DE EVENTOS INMINENTES
-# ----------------------------------------------------------------------------------
+    # Muestra mensajes de estado críticos (CREACIÓN o ERROR)
+    if initial_status and ('creado' in initial_status.lower() or 'error' in initial_status.lower() or 'adver' in initial_status.lower()):
+        st.toast(initial_status, icon="📝")
+    if tests_status and ('creado' in tests_status.lower() or 'error' in tests_status.lower() or 'adver' in tests_status.lower()):
+        st.toast(tests_status, icon="🛠️")
+    if perfil_status and ('creado' in perfil_status.lower() or 'error' in perfil_status.lower() or 'adver' in perfil_status.lower()):
+        st.toast(perfil_status, icon="👤")
+    if ranking_status and ('creado' in ranking_status.lower() or 'error' in ranking_status.lower() or 'adver' in ranking_status.lower()):
+        st.toast(ranking_status, icon="🏆")
+    if readiness_status and ('creado' in readiness_status.lower() or 'error' in readiness_status.lower() or 'adver' in readiness_status.lower()):
+        st.toast(readiness_status, icon="🧘")
 
-df_imminent = df_calendario.copy()
-df_imminent['Days_Until'] = df_imminent['Fecha'].apply(get_days_until)
-df_imminent = df_imminent[(df_imminent['Days_Until'] >= 0) & (df_imminent['Days_Until'] <= 5)]
 
-if not df_imminent.empty:
-    imminent_event = df_imminent.iloc[0]
-    days = imminent_event['Days_Until']
-    event_name = imminent_event['Evento']
-    
-    st.sidebar.warning(
-        f"🚨 **¡Atención!** El evento **'{event_name}'** es en solo **{days} días**. ¡Revisa el calendario!"
-    )
-    st.toast(f"¡Evento Inminente! '{event_name}' en {days} días. ¡A revisarlo! ⏰", icon="⏰")
+    # Inicializar el estado de la sesión
+    if 'logged_in' not in st.session_state:
+        st.session_state['logged_in'] = False
 
-# ----------------------------------------------------------------------------------
-## PESTA 1: VISTA ENTRENADOR (Solo visible para Entrenador)
-# ----------------------------------------------------------------------------------
-if rol_actual == 'Entrenador':
-    with tab1:
-        st.header("Datos de Atletas y Marcas RM")
-        st.subheader("Control Total (Vista del Entrenador)")
-        
-        # Botones de recarga
-        col_recarga_atletas, col_recarga_pruebas = st.columns(2)
-        with col_recarga_atletas:
-            if st.button("Recargar Datos Atletas/Perfiles/Ranking", help="Recarga todos los archivos de datos dinámicos."):
-                load_data.clear()
-                load_perfil_data.clear()
-                load_ranking_data.clear()
-                st.rerun() 
-        with col_recarga_pruebas:
-            if st.button("Recargar Calendario/Pruebas", help="Recarga 'calendario_data.xlsx' y 'pruebas_activas.xlsx'."):
-                load_calendar_data.clear()
-                load_tests_data.clear()
-                st.rerun()
+    # ----------------------------------------------------------------------
+    # --- PANTALLA DE ACCESO/BIENVENIDA ---
+    # ----------------------------------------------------------------------
+    if not st.session_state['logged_in']:
 
-        st.markdown("---")
-        st.subheader("1. Gestión de Atletas y Marcas RM (Edición Directa)")
-        st.warning("⚠️ **ATENCIÓN**: Para añadir **nuevas pruebas RM**, debes agregar la columna al archivo **atletas_data.xlsx** manualmente, subirlo a GitHub y luego hacer clic en 'Recargar Datos Atletas...'.")
+        logo_col, spacer_col = st.columns([1, 10])
+        with logo_col:
+            st.image(LOGO_PATH, width=120) 
 
-        df_editor_main = df_atletas.copy()
-        
-        # 1. Widget de edición para datos principales de atletas
-        df_edited_main = st.data_editor(
-            df_editor_main, 
-            num_rows="dynamic",
-            column_config={
-                "ID": st.column_config.NumberColumn("ID", disabled=True), 
-                "Atleta": st.column_config.TextColumn("Atleta", help="Nombre único del atleta y Usuario de Login", required=True),
-                "Contraseña": st.column_config.TextColumn("Contraseña", required=True),
-                "Rol": st.column_config.SelectboxColumn("Rol", options=['Atleta', 'Entrenador']),
-                "Sentadilla_RM": st.column_config.NumberColumn("Sentadilla_RM (kg)", format="%.1f"),
-                "PressBanca_RM": st.column_config.NumberColumn("PressBanca_RM (kg)", format="%.1f"),
-                "PesoCorporal": st.column_config.NumberColumn("PesoCorporal (kg)", format="%.1f"),
-                "Última_Fecha": st.column_config.DateColumn("Última_Fecha"),
-            },
-            use_container_width=True,
-            key="main_data_editor"
-        )
-        
-        # 2. Botón de guardado
-        if st.button("💾 Guardar Cambios en Datos de Atletas y Aplicar", type="primary", key="save_main_data_btn"):
-            if 'ID' in df_edited_main.columns:
-                max_id = df_edited_main['ID'].dropna().max()
-                if pd.isna(max_id): max_id = 0
-                
-                for index, row in df_edited_main.iterrows():
-                    if pd.isna(row['ID']):
-                        max_id += 1
-                        df_edited_main.loc[index, 'ID'] = max_id
-                        
-            df_edited_cleaned_main = df_edited_main.dropna(subset=['Atleta', 'Contraseña'], how='any')
-
-            if save_main_data(df_edited_cleaned_main):
-                st.success("✅ Datos de Atletas actualizados y guardados con éxito. Recargando aplicación...")
-                st.rerun()
-            else:
-                st.error("❌ No se pudieron guardar los datos de atletas.")
+        st.markdown("---") 
 
-        st.markdown("---")
-        st.subheader("2. Gestión de Pruebas (Modularidad de la Calculadora)")
-        st.caption(f"**Edita la tabla directamente para añadir/quitar pruebas y marcar 'Visible' con el chulito. Puedes borrar filas haciendo clic en el número de fila.**")
-        
-        # --- TABLA EDITABLE DE PRUEBAS ---
-        
-        # 1. Widget de edición
-        df_edited = st.data_editor(
-            df_pruebas_full,
-            num_rows="dynamic",
-            column_config={
-                "Visible": st.column_config.CheckboxColumn(
-                    "Visible",
-                    help="Marca para mostrar la prueba en la calculadora.",
-                    default=False,
-                ),
-                "ColumnaRM": st.column_config.Column("ColumnaRM", help="Debe coincidir EXACTAMENTE con el nombre de columna en Datos de Atletas (Ej: Biceps_RM)"), 
-                "NombrePrueba": st.column_config.Column("NombrePrueba"),
-            },
-            use_container_width=True,
-            key="tests_data_editor"
-        )
+        col1, col2, col3 = st.columns([1, 3, 1]) 
+
+        with col2: 
 
-        # 2. Botón de guardado
-        if st.button("💾 Guardar Cambios en Pruebas Activas y Aplicar", type="secondary", key="save_tests_data_btn"):
-            df_edited_cleaned = df_edited.dropna(subset=['NombrePrueba', 'ColumnaRM'], how='all')
+            st.markdown(
+                f"<h1 style='text-align: center; color: #FFA500;'>¡Bienvenido al Gestor de Rendimiento!</h1>", 
+                unsafe_allow_html=True
+            )
+
+            st.markdown(
+                f"<p style='text-align: center; font-size: 1.2em; color: white;'>Tu plataforma para gestionar marcas personales, calcular cargas y organizar tu calendario deportivo.</p>", 
+                unsafe_allow_html=True
+            )
+
+            st.info("Por favor, inicia sesión para acceder a la aplicación.")
+            login_form()
+
+        st.stop()
 
-            if save_tests_data(df_edited_cleaned):
-                st.success("✅ Pruebas actualizadas y guardadas con éxito. Recargando aplicación...")
-                st.rerun()
+    # ----------------------------------------------------------------------
+    # --- CONTENIDO DE LA APLICACIÓN (POST-LOGIN) ---
+    # ----------------------------------------------------------------------
+
+    st.title("💪 RM & Rendimiento Manager")
+    logout() 
+
+    if st.session_state['logged_in']:
+        st.sidebar.image(LOGO_PATH, width=100)
+        st.sidebar.markdown("---")
+
+    rol_actual = st.session_state['rol']
+    atleta_actual = st.session_state['atleta_nombre']
+
+    # ----------------------------------------------------------------------------------
+    ## MODO KIOSKO DE ASISTENCIA (Solo Entrenador): pantalla única de check-in por QR
+    # ----------------------------------------------------------------------------------
+    # El kiosko es una sesión restringida: una vez iniciado solo se sale con la contraseña del entrenador
+    if rol_actual == 'Entrenador' and not st.session_state.get('kiosko_activo'):
+        if st.sidebar.button("🖥️ Iniciar modo kiosko de asistencia", key='iniciar_kiosko_btn'):
+            st.session_state['kiosko_activo'] = True
+            st.session_state.pop('kiosko_ultimo', None)
+            st.rerun()
+
+    if st.session_state.get('kiosko_activo'):
+        st.header("✅ Check-in de Asistencia")
+        st.caption("Escanea el código QR de tu credencial (el lector escribe el código y pulsa Enter).")
+
+        sesion_kiosko = st.selectbox("Sesión:", sesiones_del_dia(df_calendario_full), key='kiosko_sesion')
+        with st.form('kiosko_form', clear_on_submit=True):
+            lectura_kiosko = st.text_input("Código QR:", key='kiosko_lectura')
+            enviado_kiosko = st.form_submit_button("✅ Registrar", type="primary")
+
+        if enviado_kiosko and lectura_kiosko:
+            with medir_tiempo('asistencia.check_in'):
+                st.session_state['kiosko_ultimo'] = registrar_asistencia(equipo_actual, df_atletas, lectura_kiosko, sesion_kiosko)
+
+        if 'kiosko_ultimo' in st.session_state:
+            resultado_kiosko, atleta_kiosko = st.session_state['kiosko_ultimo']
+            if resultado_kiosko == 'ok':
+                st.success(f"## ¡Bienvenido/a, {atleta_kiosko}! 💪")
+            elif resultado_kiosko == 'repetida':
+                st.info(f"## {atleta_kiosko}, ya estabas registrado/a en esta sesión. 👍")
+            elif resultado_kiosko == 'desconocido':
+                st.error("## No se encontró ningún atleta con ese ID.")
             else:
-                st.error("❌ No se pudieron guardar los cambios.")
-    
-# ----------------------------------------------------------------------------------
-## PESTAÑA 2: CALCULADORA DE CARGA (Visible para todos)
-# ----------------------------------------------------------------------------------
-calc_tab = tab2 
+                st.error("## Código QR no válido para este equipo.")
+
+        st.metric(f"Asistentes de hoy en '{sesion_kiosko}'", asistentes_registrados(equipo_actual, sesion_kiosko))
+
+        with st.sidebar.expander("🔒 Salir del modo kiosko"):
+            with st.form('salir_kiosko_form', clear_on_submit=True):
+                clave_salida = st.text_input("Contraseña del entrenador:", type="password", key='kiosko_clave_salida')
+                if st.form_submit_button("Salir"):
+                    valido_salida, rol_salida, _ = check_login(atleta_actual, clave_salida, equipo_actual)
+                    if valido_salida and str(rol_salida).strip() == 'Entrenador':
+                        st.session_state['kiosko_activo'] = False
+                        st.session_state.pop('kiosko_ultimo', None)
+                        st.rerun()
+                    else:
+                        st.error("Contraseña incorrecta.")
 
-with calc_tab:
-    st.header("🧮 Calculadora de Carga")
-    
-    if atleta_actual not in df_atletas['Atleta'].values:
-        st.error(f"El atleta '{atleta_actual}' no se encuentra en la base de datos. Por favor, contacta al entrenador o cierra sesión.")
         st.stop()
-        
-    datos_usuario = df_atletas[df_atletas['Atleta'] == atleta_actual].iloc[0]
-    
-    st.write(f"**Hola, {atleta_actual}. Selecciona un ejercicio para cargar tu RM registrado.**")
 
-    # --- ENTRADA DE DATOS RM Y BARRA ---
-    col_ejercicio, col_barra = st.columns([2, 1])
+    # Definición de pestañas
+    if rol_actual == 'Entrenador':
+        tab1, tab2, CALENDAR_TAB, PERFIL_TAB, ACOND_TAB, GESTION_PESO_TAB, RECUPERACION_TAB, RANKING_TAB, RENDIMIENTO_TAB, CONSULTAS_TAB = st.tabs([
+            "📊 Vista Entrenador (Datos)", 
+            "🧮 Calculadora de Carga", 
+            "📅 Calendario", 
+            "👤 Perfil", 
+            "🏃 Acondicionamiento", 
+            "⚖️ Gestión de Peso",
+            "🌡️ Recuperación",
+            "🏆 Ranking",
+            "⏱️ Rendimiento",
+            "🔎 Consultas SQL"
+        ])
+    else:
+        tab2, CALENDAR_TAB, PERFIL_TAB, ACOND_TAB, GESTION_PESO_TAB, RECUPERACION_TAB, RANKING_TAB = st.tabs([
+            "🧮 Calculadora de Carga", 
+            "📅 Calendario", 
+            "👤 Perfil", 
+            "🏃 Acondicionamiento", 
+            "⚖️ Gestión de Peso",
+            "🌡️ Recuperación",
+            "🏆 Ranking"
+        ])
+
+    # ----------------------------------------------------------------------------------
+    ## NOTIFICACIÓN GLOBAL DE EVENTOS INMINENTES
+    # ----------------------------------------------------------------------------------
+
+    vista_equipo = vista_materializada(equipo_actual)
+    df_imminent = vista_equipo['inminentes']
+
+    if not df_imminent.empty:
+        imminent_event = df_imminent.iloc[0]
+        days = imminent_event['Days_Until']
+        event_name = imminent_event['Evento']
+
+        st.sidebar.warning(
+            f"🚨 **¡Atención!** El evento **'{event_name}'** es en solo **{days} días**. ¡Revisa el calendario!"
+        )
+        st.toast(f"¡Evento Inminente! '{event_name}' en {days} días. ¡A revisarlo! ⏰", icon="⏰")
 
-    with col_ejercicio:
-        ejercicio_options = df_pruebas['NombrePrueba'].tolist() 
-        
-        if not ejercicio_options:
-            st.warning("No hay pruebas visibles. El Entrenador debe configurar el archivo 'pruebas_activas.xlsx'.")
-            rm_value = st.number_input("RM actual (en kg):", min_value=0.0, value=0.0, step=5.0)
-        else:
-            ejercicio_default = st.selectbox(
-                "Selecciona el Ejercicio:",
-                options=ejercicio_options, 
-                key='ejercicio_calc'
+    # ----------------------------------------------------------------------------------
+    ## PESTA 1: VISTA ENTRENADOR (Solo visible para Entrenador)
+    # ----------------------------------------------------------------------------------
+    if rol_actual == 'Entrenador':
+        with tab1, medir_tiempo('tab.vista_entrenador'):
+            st.header("Datos de Atletas y Marcas RM")
+            st.subheader("Control Total (Vista del Entrenador)")
+
+            st.caption(f"🔄 Los cambios en los archivos de datos (desde la app o editados a mano) se detectan en ~{BUS_INTERVALO_S:.0f} s; las sesiones del equipo que muestran ese dataset se recargan como mucho cada {BUS_RECARGA_MIN_S:.0f} s (o al interactuar).")
+
+            # Solo los entrenadores del equipo por defecto administran los clubes alojados
+            if equipo_actual == EQUIPO_POR_DEFECTO:
+                with st.expander("🏟️ Equipos alojados en esta instancia"):
+                    st.dataframe(load_equipos_data(), use_container_width=True, hide_index=True)
+                    with st.form("nuevo_equipo_form", clear_on_submit=True):
+                        nombre_equipo = st.text_input("Nombre del nuevo equipo")
+                        col_eq_usuario, col_eq_clave = st.columns(2)
+                        entrenador_equipo = col_eq_usuario.text_input("Usuario del entrenador")
+                        clave_equipo = col_eq_clave.text_input("Contraseña del entrenador", type="password")
+                        if st.form_submit_button("➕ Crear Equipo"):
+                            if crear_equipo(nombre_equipo, entrenador_equipo, clave_equipo):
+                                st.success(f"✅ Equipo '{nombre_equipo}' creado en **{carpeta_equipo(nombre_equipo)}**. El entrenador '{entrenador_equipo.strip()}' ya puede iniciar sesión y dar de alta a sus atletas.")
+                            else:
+                                st.error("❌ Faltan el nombre o las credenciales del entrenador, o el equipo ya existe (nombres que solo difieren en espacios o símbolos comparten carpeta).")
+
+            # Informe de calidad: se calcula una vez por versión de cada archivo
+            df_calidad = informe_calidad(equipo_actual)
+            n_errores = int((df_calidad['Severidad'] == 'Error').sum())
+            n_avisos = int((df_calidad['Severidad'] == 'Aviso').sum())
+            with st.expander(f"🩺 Calidad de Datos: {n_errores} errores · {n_avisos} avisos", expanded=n_errores > 0):
+                st.caption(
+                    "Reglas declarativas por dataset (tipo, rango, valores permitidos, ID/Atleta únicos) y anomalías: atípicos por "
+                    f"z robusto > {CALIDAD_Z_ATIPICO:g} y saltos por atleta contra su historial. 'Fila' es la fila del archivo Excel."
+                )
+                if df_calidad.empty:
+                    st.success("✅ No se encontraron incidencias en los datos del equipo.")
+                else:
+                    col_cal1, col_cal2 = st.columns(2)
+                    with col_cal1:
+                        datasets_calidad = st.multiselect("Dataset:", sorted(df_calidad['Dataset'].unique()), key='calidad_datasets')
+                    with col_cal2:
+                        severidades_calidad = st.multiselect("Severidad:", ['Error', 'Aviso'], key='calidad_severidades')
+                    df_calidad_vista = df_calidad[
+                        df_calidad['Dataset'].isin(datasets_calidad or df_calidad['Dataset'].unique())
+                        & df_calidad['Severidad'].isin(severidades_calidad or ['Error', 'Aviso'])
+                    ].assign(Fila=lambda d: pd.to_numeric(d['Fila'], errors='coerce') + 2).sort_values(['Severidad', 'Dataset'], ascending=[False, True])
+                    st.dataframe(
+                        df_calidad_vista, use_container_width=True, hide_index=True,
+                        column_config={"Fila": st.column_config.NumberColumn("Fila", format="%d")}
+                    )
+                    st.download_button(
+                        "⬇️ Descargar informe (CSV)", data=df_calidad_vista.to_csv(index=False).encode('utf-8'),
+                        file_name=f"calidad_datos_{equipo_actual}_{datetime.now():%Y%m%d}.csv", mime='text/csv', key='calidad_descarga_btn'
+                    )
+
+            st.markdown("---")
+            st.subheader("1. Gestión de Atletas y Marcas RM (Edición Directa)")
+            st.warning("⚠️ **ATENCIÓN**: Para añadir **nuevas pruebas RM**, debes agregar la columna al archivo **atletas_data.xlsx** manualmente, subirlo a GitHub y la aplicación lo recargará automáticamente.")
+
+            df_editor_main = tabla_paginada(
+                'tabla_atletas', df_atletas, 'atletas', ruta_equipo(EXCEL_FILE, equipo_actual),
+                columna_filtro='Rol', columnas_orden=['ID', 'Atleta', 'Rol', 'Sentadilla_RM', 'PressBanca_RM', 'PesoCorporal', 'Última_Fecha']
             )
-            
-            rm_inicial = 0.0
-            columna_rm = None
-            columna_rm_series = df_pruebas[df_pruebas['NombrePrueba'] == ejercicio_default]['ColumnaRM']
-            if not columna_rm_series.empty:
-                columna_rm = columna_rm_series.iloc[0]
-            
-            if columna_rm and columna_rm != 'N/A' and columna_rm in datos_usuario and pd.notna(datos_usuario.get(columna_rm)):
-                rm_inicial = float(datos_usuario[columna_rm]) 
-            
-            rm_value = st.number_input(
-                f"RM actual para **{ejercicio_default}** (en kg):",
+
+            # 1. Widget de edición para datos principales de atletas
+            with medir_tiempo('editor.main_data_editor'):
+                df_edited_main = st.data_editor(
+                    a_objeto(df_editor_main),
+                    num_rows="dynamic",
+                    column_config={
+                        "ID": st.column_config.NumberColumn("ID", disabled=True), 
+                        "Atleta": st.column_config.TextColumn("Atleta", help="Nombre único del atleta y Usuario de Login", required=True),
+                        "Contraseña": st.column_config.TextColumn("Contraseña", required=True),
+                        "Rol": st.column_config.SelectboxColumn("Rol", options=['Atleta', 'Entrenador']),
+                        "Sentadilla_RM": st.column_config.NumberColumn("Sentadilla_RM (kg)", format="%.1f"),
+                        "PressBanca_RM": st.column_config.NumberColumn("PressBanca_RM (kg)", format="%.1f"),
+                        "PesoCorporal": st.column_config.NumberColumn("PesoCorporal (kg)", format="%.1f"),
+                        "Última_Fecha": st.column_config.DateColumn("Última_Fecha"),
+                    },
+                    use_container_width=True,
+                    key="main_data_editor"
+                )
+
+            # 2. Botón de guardado
+            if st.button("💾 Guardar Cambios en Datos de Atletas y Aplicar", type="primary", key="save_main_data_btn"):
+                resultado = guardar_cambios_editor('atletas', df_atletas, df_editor_main, df_edited_main, 'main_data_editor')
+
+                if resultado is None:
+                    st.info("No hay cambios para guardar.")
+                elif resultado:
+                    st.success("✅ Datos de Atletas actualizados y guardados con éxito. Recargando aplicación...")
+                    st.rerun()
+                else:
+                    st.error("❌ No se pudieron guardar los datos de atletas.")
+
+            st.markdown("---")
+            st.subheader("2. Gestión de Pruebas (Modularidad de la Calculadora)")
+            st.caption(f"**Edita la tabla directamente para añadir/quitar pruebas y marcar 'Visible' con el chulito. Puedes borrar filas haciendo clic en el número de fila.**")
+
+            # --- TABLA EDITABLE DE PRUEBAS ---
+
+            # 1. Widget de edición
+            with medir_tiempo('editor.tests_data_editor'):
+                df_edited = st.data_editor(
+                    df_pruebas_full,
+                    num_rows="dynamic",
+                    column_config={
+                        "Visible": st.column_config.CheckboxColumn(
+                            "Visible",
+                            help="Marca para mostrar la prueba en la calculadora.",
+                            default=False,
+                        ),
+                        "ColumnaRM": st.column_config.Column("ColumnaRM", help="Debe coincidir EXACTAMENTE con el nombre de columna en Datos de Atletas (Ej: Biceps_RM)"), 
+                        "NombrePrueba": st.column_config.Column("NombrePrueba"),
+                    },
+                    use_container_width=True,
+                    key="tests_data_editor"
+                )
+
+            # 2. Botón de guardado
+            if st.button("💾 Guardar Cambios en Pruebas Activas y Aplicar", type="secondary", key="save_tests_data_btn"):
+                resultado = guardar_cambios_editor('pruebas', df_pruebas_full, df_pruebas_full, df_edited, 'tests_data_editor')
+
+                if resultado is None:
+                    st.info("No hay cambios para guardar.")
+                elif resultado:
+                    st.success("✅ Pruebas actualizadas y guardadas con éxito. Recargando aplicación...")
+                    st.rerun()
+                else:
+                    st.error("❌ No se pudieron guardar los cambios.")
+
+            st.markdown("---")
+            st.subheader("3. Historial de Cambios (Auditoría)")
+            st.caption(f"Cada guardado queda registrado en **{ruta_equipo(AUDIT_LOG_FILE, equipo_actual)}** con autor, fecha y cambios por fila.")
+
+            dataset_audit = st.selectbox(
+                "Dataset:",
+                options=['atletas', 'calendario', 'pruebas', 'ranking', 'perfiles', 'readiness', 'vam', 'pesajes', 'plantillas', 'lesiones'],
+                key='audit_dataset_select'
+            )
+            entradas_audit = leer_auditoria(dataset_audit)
+
+            if not entradas_audit:
+                st.info("No hay cambios registrados para este dataset.")
+            else:
+                df_audit = pd.DataFrame([
+                    {
+                        'Fecha': e['ts'],
+                        'Autor': e['actor'],
+                        'Altas': sum(c['op'] == 'alta' for c in e['cambios']),
+                        'Bajas': sum(c['op'] == 'baja' for c in e['cambios']),
+                        'Cambios': sum(c['op'] == 'cambio' for c in e['cambios']),
+                        'Filas': ', '.join(str(c['clave']) for c in e['cambios'][:5]) + ('…' if len(e['cambios']) > 5 else ''),
+                    }
+                    for e in reversed(entradas_audit[-200:])
+                ])
+                st.dataframe(df_audit, use_container_width=True, hide_index=True)
+
+                with st.expander("Ver detalle de un guardado"):
+                    fecha_detalle = st.selectbox("Guardado:", options=df_audit['Fecha'].tolist(), key='audit_detalle_select')
+                    entrada_detalle = next(e for e in reversed(entradas_audit) if e['ts'] == fecha_detalle)
+                    st.json(entrada_detalle['cambios'], expanded=False)
+
+                if dataset_audit not in ('readiness', 'vam', 'pesajes'):
+                    st.markdown("**Restaurar una versión anterior**")
+                    with st.form("audit_preview_form"):
+                        col_fecha_rest, col_hora_rest = st.columns(2)
+                        with col_fecha_rest:
+                            fecha_rest = st.date_input("Fecha:", value=datetime.now().date(), key='audit_fecha_rest')
+                        with col_hora_rest:
+                            hora_rest = st.time_input("Hora:", value=time(0, 0), key='audit_hora_rest')
+                        generar_vista = st.form_submit_button("🔍 Generar vista previa")
+
+                    # La reconstrucción (que vuelca la bitácora) solo se ejecuta al pulsar el botón; el resultado
+                    # queda en la sesión para que "Restaurar" use exactamente la versión previsualizada.
+                    if generar_vista:
+                        momento_rest = datetime.combine(fecha_rest, hora_rest)
+                        st.session_state['audit_vista_previa'] = {
+                            'dataset': dataset_audit,
+                            'momento': momento_rest,
+                            'df': reconstruir_dataset(
+                                dataset_audit, get_dataset_actual(dataset_audit), datetime.now(), momento_rest
+                            ),
+                        }
+
+                    vista_previa = st.session_state.get('audit_vista_previa')
+                    if vista_previa and vista_previa['dataset'] == dataset_audit:
+                        st.caption(f"Vista previa de **{dataset_audit}** al {vista_previa['momento'].strftime('%Y-%m-%d %H:%M')}:")
+                        st.dataframe(vista_previa['df'], use_container_width=True)
+
+                        if st.button("⏪ Restaurar esta versión", key="audit_restore_btn"):
+                            if restaurar_dataset(dataset_audit, vista_previa['df']):
+                                st.session_state.pop('audit_vista_previa', None)
+                                st.success("✅ Versión restaurada y registrada en la bitácora. Recargando aplicación...")
+                                st.rerun()
+                            else:
+                                st.error("❌ No se pudo restaurar la versión.")
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 2: CALCULADORA DE CARGA (Visible para todos)
+    # ----------------------------------------------------------------------------------
+    calc_tab = tab2 
+
+    with calc_tab, medir_tiempo('tab.calculadora'):
+        st.header("🧮 Calculadora de Carga")
+
+        if atleta_actual not in df_atletas['Atleta'].values:
+            st.error(f"El atleta '{atleta_actual}' no se encuentra en la base de datos. Por favor, contacta al entrenador o cierra sesión.")
+            st.stop()
+
+        datos_usuario = df_atletas[df_atletas['Atleta'] == atleta_actual].iloc[0]
+
+        st.write(f"**Hola, {atleta_actual}. Selecciona un ejercicio para cargar tu RM registrado.**")
+
+        # Readiness del día: consulta directa al índice precalculado (último check-in + línea base)
+        version_readiness = version_archivo(ruta_equipo(READINESS_FILE, equipo_actual))
+        df_readiness_idx, readiness_por_atleta = indice_readiness(df_readiness, equipo_actual, version_readiness)
+        politica_autorreg = load_politica_autorregulacion(equipo_actual)
+        lectura_readiness = readiness_por_atleta.get(atleta_actual)
+        ajuste_readiness, rir_extra_readiness = 0.0, 0
+        if lectura_readiness is not None:
+            ajuste_arr, rir_arr, estado_arr = aplicar_autorregulacion([lectura_readiness['SRD']], [lectura_readiness['Base']], politica_autorreg)
+            ajuste_readiness, rir_extra_readiness = float(ajuste_arr[0]), int(rir_arr[0])
+            base_txt = f" · base {lectura_readiness['Base']:.1f}" if pd.notna(lectura_readiness['Base']) else ""
+            st.caption(
+                f"Readiness ({lectura_readiness['Fecha'].strftime('%Y-%m-%d')}): **SRD {lectura_readiness['SRD']:.1f}**{base_txt} → "
+                f"{estado_arr[0]} · ajuste de carga {ajuste_readiness:+.1f}%" + (f", +{rir_extra_readiness} RIR" if rir_extra_readiness else "")
+            )
+
+        # --- ENTRADA DE DATOS RM Y BARRA ---
+        col_ejercicio, col_barra = st.columns([2, 1])
+
+        with col_ejercicio:
+            ejercicio_options = df_pruebas['NombrePrueba'].tolist() 
+
+            if not ejercicio_options:
+                st.warning("No hay pruebas visibles. El Entrenador debe configurar el archivo 'pruebas_activas.xlsx'.")
+                rm_value = st.number_input("RM actual (en kg):", min_value=0.0, value=0.0, step=5.0)
+            else:
+                ejercicio_default = st.selectbox(
+                    "Selecciona el Ejercicio:",
+                    options=ejercicio_options, 
+                    key='ejercicio_calc'
+                )
+
+                rm_inicial = 0.0
+                columna_rm = None
+                columna_rm_series = df_pruebas[df_pruebas['NombrePrueba'] == ejercicio_default]['ColumnaRM']
+                if not columna_rm_series.empty:
+                    columna_rm = columna_rm_series.iloc[0]
+
+                if columna_rm and columna_rm != 'N/A' and columna_rm in datos_usuario and pd.notna(datos_usuario.get(columna_rm)):
+                    rm_inicial = float(datos_usuario[columna_rm]) 
+
+                rm_value = st.number_input(
+                    f"RM actual para **{ejercicio_default}** (en kg):",
+                    min_value=0.0,
+                    value=rm_inicial,
+                    step=5.0
+                )
+
+        with col_barra:
+            st.markdown(" ", unsafe_allow_html=True)
+            peso_barra = st.number_input(
+                "Peso de la Barra (kg):",
                 min_value=0.0,
-                value=rm_inicial,
-                step=5.0
+                value=20.0,
+                step=2.5,
+                key='peso_barra_input'
             )
 
-    with col_barra:
-        st.markdown(" ", unsafe_allow_html=True)
-        peso_barra = st.number_input(
-            "Peso de la Barra (kg):",
-            min_value=0.0,
-            value=20.0,
-            step=2.5,
-            key='peso_barra_input'
-        )
+        st.markdown("---")
 
-    st.markdown("---")
-    
-    # --- MÓDULO 1: CÁLCULO DE CARGA DINÁMICA (%) ---
-    st.subheader("1. Carga por Porcentaje (%) de RM (Slider Dinámico)")
-
-    col_perc, col_metric = st.columns([2, 1])
-
-    with col_perc:
-        porcentaje_input = st.slider(
-            "Selecciona el Porcentaje (%) de tu RM:",
-            min_value=0,
-            max_value=100,
-            value=75,
-            step=1,
-            key='slider_perc'
-        )
-        peso_calculado_perc = calcular_porcentaje_rm(rm_value, porcentaje_input)
+        # --- MÓDULO 1: CÁLCULO DE CARGA DINÁMICA (%) ---
+        st.subheader("1. Carga por Porcentaje (%) de RM (Slider Dinámico)")
 
-    with col_metric:
-        st.metric(f"Peso Sugerido", f"**{peso_calculado_perc} kg**")
-        st.caption(f"Al {porcentaje_input}%")
-    
-    # --- MÓDULO 2: CÁLCULO DE CARGA POR RIR Y REPETICIONES ---
-    st.markdown("---")
-    st.subheader("2. Estimador de Carga por RIR y Repeticiones")
-    st.caption("Ingresa tu objetivo de repeticiones y esfuerzo (RIR) para obtener el peso ideal.")
+        col_perc, col_metric = st.columns([2, 1])
 
-    col_reps, col_rir, col_target = st.columns(3)
-    
-    with col_reps:
-        reps_target = st.number_input("Repeticiones Objetivo (Reps):", min_value=1, max_value=20, value=5, step=1)
-        
-    with col_rir:
-        rir_target = st.selectbox("Esfuerzo Deseado (RIR):", options=[4, 3, 2, 1, 0], index=2, key='rir_target_select')
-    
-    peso_calculado_rir, perc_sugerido = calcular_carga_por_rir(rm_value, rir_target)
+        with col_perc:
+            porcentaje_input = st.slider(
+                "Selecciona el Porcentaje (%) de tu RM:",
+                min_value=0,
+                max_value=100,
+                value=75,
+                step=1,
+                key='slider_perc'
+            )
+            peso_calculado_perc = calcular_porcentaje_rm(rm_value, porcentaje_input)
 
-    with col_target:
-        st.markdown(" ", unsafe_allow_html=True) 
-        st.metric("Peso Ideal", f"**{peso_calculado_rir} kg**")
-        if peso_calculado_rir > 0:
-             st.caption(f"Equivale aprox. al {perc_sugerido:.1f}% de RM")
+        with col_metric:
+            st.metric(f"Peso Sugerido", f"**{peso_calculado_perc} kg**")
+            st.caption(f"Al {porcentaje_input}%")
+            if ajuste_readiness:
+                peso_ajustado_perc = calcular_porcentaje_rm(rm_value, min(porcentaje_input * (1 + ajuste_readiness / 100), 100))
+                st.metric("Ajustado por Readiness", f"{peso_ajustado_perc} kg", delta=f"{ajuste_readiness:+.1f}%")
 
-    # --- Conversión de Placas ---
-    st.markdown("---")
-    st.subheader("Conversión de Placas")
-    
-    peso_conversion = peso_calculado_rir if peso_calculado_rir > 0 else peso_calculado_perc
+        # --- MÓDULO 2: CÁLCULO DE CARGA POR RIR Y REPETICIONES ---
+        st.markdown("---")
+        st.subheader("2. Estimador de Carga por RIR y Repeticiones")
+        st.caption("Ingresa tu objetivo de repeticiones y esfuerzo (RIR) para obtener el peso ideal.")
 
-    col_conversion, col_placas = st.columns([1, 1])
-    
-    with col_conversion:
-        st.metric("Peso a Conversión", f"**{peso_conversion} kg**")
-        st.caption("Usamos el Peso Ideal del Estimador RIR para la conversión.")
+        col_reps, col_rir, col_target = st.columns(3)
 
-    peso_total_cargado, placas_por_lado = descomponer_placas(peso_conversion, peso_barra)
-    
-    with col_placas:
-        if isinstance(peso_total_cargado, str):
-            st.warning("Peso Requerido debe ser mayor que el Peso de la Barra.")
+        with col_reps:
+            reps_target = st.number_input("Repeticiones Objetivo (Reps):", min_value=1, max_value=20, value=5, step=1)
+
+        with col_rir:
+            rir_target = st.selectbox("Esfuerzo Deseado (RIR):", options=[4, 3, 2, 1, 0], index=2, key='rir_target_select')
+
+        peso_calculado_rir, perc_sugerido = calcular_carga_por_rir(rm_value, rir_target)
+        if ajuste_readiness or rir_extra_readiness:
+            rir_ajustado = min(rir_target + rir_extra_readiness, max(RIR_TO_PERCENT))
+            peso_rir_base, _ = calcular_carga_por_rir(rm_value, rir_ajustado)
+            peso_calculado_rir = round(peso_rir_base * (1 + ajuste_readiness / 100) * 2) / 2
+            perc_sugerido = peso_calculado_rir / rm_value * 100 if rm_value > 0 else 0
+
+        with col_target:
+            st.markdown(" ", unsafe_allow_html=True) 
+            st.metric("Peso Ideal", f"**{peso_calculado_rir} kg**")
+            if peso_calculado_rir > 0:
+                 st.caption(f"Equivale aprox. al {perc_sugerido:.1f}% de RM" + (" (ajustado por readiness)" if ajuste_readiness or rir_extra_readiness else ""))
+
+        # --- Conversión de Placas ---
+        st.markdown("---")
+        st.subheader("Conversión de Placas")
+
+        peso_conversion = peso_calculado_rir if peso_calculado_rir > 0 else peso_calculado_perc
+
+        col_conversion, col_placas = st.columns([1, 1])
+
+        with col_conversion:
+            st.metric("Peso a Conversión", f"**{peso_conversion} kg**")
+            st.caption("Usamos el Peso Ideal del Estimador RIR para la conversión.")
+
+        peso_total_cargado, placas_por_lado = descomponer_placas(peso_conversion, peso_barra)
+
+        with col_placas:
+            if isinstance(peso_total_cargado, str):
+                st.warning("Peso Requerido debe ser mayor que el Peso de la Barra.")
+            else:
+                st.markdown(f"**Carga por Lado ({peso_barra} kg de barra):**")
+                placas_str = ""
+                if placas_por_lado:
+                    for placa, cantidad in placas_por_lado.items():
+                        placas_str += f"- **{placa} kg**: {cantidad} placa(s) ➡️ Total: {placa * cantidad} kg/lado\n"
+                    st.info(placas_str)
+                else:
+                    st.success("No se requieren placas adicionales (Solo la barra).")
+
+        st.markdown("---")
+
+        if rol_actual == 'Entrenador':
+            with st.expander("👥 Cargas Ajustadas por Readiness (Vista Entrenador)"):
+                col_ej_a, col_pct_a = st.columns(2)
+                ejercicio_autorreg = col_ej_a.selectbox("Ejercicio:", ejercicio_options or ['-'], key='autorreg_ejercicio')
+                pct_autorreg = col_pct_a.slider("% RM prescrito:", min_value=30, max_value=100, value=80, step=1, key='autorreg_pct')
+                columna_autorreg = dict(zip(df_pruebas['NombrePrueba'], df_pruebas['ColumnaRM'])).get(ejercicio_autorreg)
+                df_cargas_ajustadas = cargas_ajustadas_equipo(df_atletas, columna_autorreg, pct_autorreg, df_readiness_idx, politica_autorreg)
+                st.dataframe(df_cargas_ajustadas, use_container_width=True, hide_index=True)
+
+                st.markdown("**Política de autorregulación**")
+                with st.form('form_politica_autorreg'):
+                    col_p1, col_p2, col_p3 = st.columns(3)
+                    nueva_politica = {
+                        'umbral_optimo': col_p1.number_input("SRD óptimo ≥", 1.0, 5.0, float(politica_autorreg['umbral_optimo']), 0.1),
+                        'umbral_bajo': col_p1.number_input("SRD bajo <", 1.0, 5.0, float(politica_autorreg['umbral_bajo']), 0.1),
+                        'ajuste_adecuado_pct': col_p2.number_input("Ajuste adecuado (%)", -30.0, 10.0, float(politica_autorreg['ajuste_adecuado_pct']), 0.5),
+                        'ajuste_bajo_pct': col_p2.number_input("Ajuste bajo (%)", -30.0, 10.0, float(politica_autorreg['ajuste_bajo_pct']), 0.5),
+                        'rir_extra_bajo': int(col_p2.number_input("RIR extra (bajo)", 0, 3, int(politica_autorreg['rir_extra_bajo']), 1)),
+                        'caida_base': col_p3.number_input("Caída vs base ≥", 0.0, 4.0, float(politica_autorreg['caida_base']), 0.25),
+                        'ajuste_caida_pct': col_p3.number_input("Ajuste por caída (%)", -30.0, 10.0, float(politica_autorreg['ajuste_caida_pct']), 0.5),
+                    }
+                    if st.form_submit_button("Guardar política"):
+                        if save_politica_autorregulacion(nueva_politica):
+                            st.success("✅ Política guardada.")
+                            st.rerun()
+
+        # --- MÓDULO 3: PROGRAMA DE ENTRENAMIENTO (PERIODIZACIÓN) ---
+        st.subheader("3. Programa de Entrenamiento (Periodización)")
+
+        plantillas_disponibles = df_plantillas['Plantilla'].dropna().unique().tolist()
+        if not plantillas_disponibles:
+            st.info("No hay plantillas de programa. El Entrenador puede crearlas en 'Programas del Equipo'.")
         else:
-            st.markdown(f"**Carga por Lado ({peso_barra} kg de barra):**")
-            placas_str = ""
-            if placas_por_lado:
-                for placa, cantidad in placas_por_lado.items():
-                    placas_str += f"- **{placa} kg**: {cantidad} placa(s) ➡️ Total: {placa * cantidad} kg/lado\n"
-                st.info(placas_str)
+            plantilla_sel = st.selectbox("Plantilla:", plantillas_disponibles, key='programa_plantilla')
+            mapa_rm = dict(zip(df_pruebas['NombrePrueba'], df_pruebas['ColumnaRM']))
+            version_plantillas = version_archivo(ruta_equipo(PLANTILLAS_FILE, equipo_actual))
+            df_programas, atletas_regenerados = programas_equipo(
+                equipo_actual, plantilla_sel, df_plantillas, version_plantillas, df_atletas, mapa_rm, peso_barra
+            )
+
+            plan_atleta = df_programas[df_programas['Atleta'] == atleta_actual]
+            if plan_atleta.empty:
+                st.info("No tienes RM registrados para los ejercicios de esta plantilla.")
             else:
-                st.success("No se requieren placas adicionales (Solo la barra).")
-    
-    st.markdown("---")
+                semana_sel = st.selectbox("Semana:", sorted(plan_atleta['Semana'].dropna().unique().tolist()), key='programa_semana')
+                plan_semana = plan_atleta[plan_atleta['Semana'] == semana_sel]
+                st.caption(f"Bloque: **{', '.join(plan_semana['Bloque'].dropna().astype(str).unique())}** · Barra de {peso_barra} kg")
+                st.dataframe(
+                    plan_semana[['Dia', 'Ejercicio', 'Series', 'Reps', 'Tipo_Intensidad', 'Intensidad', '% RM', 'Carga (kg)', 'Placas por lado']],
+                    use_container_width=True, hide_index=True
+                )
 
-    # --- GUÍA VBT Y RPE/RIR PARA COMBATE ---
+            if rol_actual == 'Entrenador':
+                with st.expander("👥 Programas del Equipo (Vista Entrenador)"):
+                    st.caption(f"{df_programas['Atleta'].nunique()} atletas con plan · regenerados en esta carga: {len(atletas_regenerados)}.")
+                    st.dataframe(df_programas, use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "Descargar programas (CSV)",
+                        data=df_programas.to_csv(index=False).encode('utf-8'),
+                        file_name=f"programa_{plantilla_sel}.csv",
+                        mime='text/csv',
+                        key='descargar_programas',
+                    )
+
+        if rol_actual == 'Entrenador':
+            with st.expander("📝 Editar Plantillas de Programa"):
+                st.caption("Una fila por ejercicio y sesión: Tipo_Intensidad '%RM' (Intensidad = % del RM) o 'RIR' (Intensidad = repeticiones en reserva).")
+                with medir_tiempo('editor.plantillas_editor'):
+                    df_plantillas_editadas = st.data_editor(
+                        a_objeto(df_plantillas),
+                        key='plantillas_editor',
+                        num_rows='dynamic',
+                        column_config={
+                            'Tipo_Intensidad': st.column_config.SelectboxColumn("Tipo_Intensidad", options=TIPOS_INTENSIDAD),
+                            'Ejercicio': st.column_config.SelectboxColumn("Ejercicio", options=df_pruebas_full['NombrePrueba'].dropna().unique().tolist()),
+                        },
+                        use_container_width=True,
+                    )
+                if st.button("Guardar Plantillas", key='guardar_plantillas'):
+                    resultado_plantillas = guardar_cambios_editor('plantillas', df_plantillas, df_plantillas, df_plantillas_editadas, 'plantillas_editor')
+                    if resultado_plantillas is None:
+                        st.info("No hay cambios para guardar.")
+                    elif resultado_plantillas:
+                        st.success("✅ Plantillas guardadas.")
+                        st.rerun()
 
-    col_rpe, col_vbt = st.columns(2)
+        st.markdown("---")
 
-    with col_rpe:
-        st.subheader("Guía de Intensidad (RPE / RIR) 🥊")
-        st.caption("Usa el RIR/RPE para el Estimador de Carga.")
-        rpe_guide = pd.DataFrame({
-            'RIR': [4, 3, 2, 1, 0],
-            'RPE': [6, 7, 8, 9, 10],
-            'Esfuerzo': ['Calentamiento / Técnica (Fácil)', 'Medio (Buena Velocidad)', 'Cerca del fallo (Lento)', 'Máximo posible (Muy Lento)', 'Fallo (Sin repeticiones extra)'],
-            'Carga Sugerida': ['65% - 75%', '70% - 80%', '80% - 87%', '87% - 95%', '90% +']
-        })
-        st.table(rpe_guide.set_index('RIR'))
+        # --- MÓDULO 4: REGISTRO DE SERIES Y e1RM ---
+        st.subheader("4. Registro de Series y RM Estimada (e1RM)")
+        st.caption("Registra cada serie efectiva: el e1RM (Epley/Brzycki ajustado por RIR) se recalcula en segundo plano.")
+
+        if ejercicio_options:
+            with st.form('form_registro_serie', clear_on_submit=False):
+                col_ej_s, col_carga_s, col_reps_s, col_rir_s = st.columns(4)
+                ejercicio_serie = col_ej_s.selectbox("Ejercicio:", ejercicio_options, index=ejercicio_options.index(ejercicio_default))
+                carga_serie = col_carga_s.number_input("Carga (kg):", min_value=0.0, value=float(peso_conversion), step=2.5)
+                reps_serie = col_reps_s.number_input("Reps:", min_value=1, max_value=30, value=int(reps_target), step=1)
+                rir_serie = col_rir_s.selectbox("RIR:", options=[0, 1, 2, 3, 4, 5], index=min(int(rir_target), 5))
+                if st.form_submit_button("Registrar serie"):
+                    if carga_serie <= 0:
+                        st.warning("Indica una carga mayor que 0 kg.")
+                    elif registrar_serie(atleta_actual, ejercicio_serie, carga_serie, reps_serie, rir_serie):
+                        st.success(f"✅ Serie registrada: {carga_serie} kg x {reps_serie} @ RIR {rir_serie} (e1RM ≈ {float(calcular_e1rm(carga_serie, reps_serie, rir_serie)):.1f} kg).")
+
+        df_e1rm = e1rm_equipo(equipo_actual)
+        e1rm_atleta = df_e1rm[df_e1rm['Atleta'] == atleta_actual]
+        if not e1rm_atleta.empty:
+            st.dataframe(
+                e1rm_atleta[['Ejercicio', 'e1RM', 'Fecha']].rename(columns={'Fecha': 'Mejor sesión'}),
+                use_container_width=True, hide_index=True
+            )
 
-    with col_vbt:
-        st.subheader("Guía de Velocidad (VBT) ⚡")
-        st.caption("Maximiza la potencia en zonas de velocidad alta.")
-        
-        vbt_guide = pd.DataFrame({
-            '% de 1RM Típico': ['90% - 95%', '80% - 85%', '60% - 70%', '40% - 50%'],
-            'Intención': ['Fuerza Máxima', 'Fuerza-Velocidad', 'Velocidad-Fuerza', 'Técnica/Velocidad'],
-            'Velocidad Objetivo (m/s)': ['0.30 - 0.45', '0.50 - 0.70', '0.75 - 1.00', '1.00 - 1.30']
-        })
-        st.table(vbt_guide.set_index('% de 1RM Típico'))
-        
-# ----------------------------------------------------------------------------------
-## PESTAÑA 3: CALENDARIO (Visible para todos)
-# ----------------------------------------------------------------------------------
-with CALENDAR_TAB:
-    st.header("📅 Calendario de Pruebas y Actividades")
-    st.caption(f"Archivo de origen: **{CALENDAR_FILE}**")
-    
-    if rol_actual == 'Entrenador':
-        st.subheader("Gestión de Cronograma (Vista Entrenador)")
-        st.caption("⚠️ **Edita, añade o elimina filas directamente en la tabla. El 'chulito' en 'Habilitado' controla la visibilidad para los atletas.**")
-        
-        df_calendar_edit = df_calendario_full.copy()
-        
-        df_edited_calendar = st.data_editor(
-            df_calendar_edit,
-            num_rows="dynamic",
-            column_config={
-                "Fecha": st.column_config.DateColumn(
-                    "Fecha", 
-                    format="YYYY-MM-DD", 
-                    required=True
-                ),
-                "Evento": st.column_config.TextColumn("Evento", required=True),
-                "Habilitado": st.column_config.CheckboxColumn(
-                    "Habilitado",
-                    help="Marcar para que los atletas puedan ver el evento.",
-                    default=True,
+        if rol_actual == 'Entrenador':
+            with st.expander("👥 Propuestas de Actualización de RM (Vista Entrenador)"):
+                mapa_rm_series = dict(zip(df_pruebas_full['NombrePrueba'], df_pruebas_full['ColumnaRM']))
+                df_propuestas = propuestas_rm(df_e1rm, df_atletas, mapa_rm_series)
+                st.caption(f"Mejor e1RM de los últimos {E1RM_VENTANA_DIAS} días; se propone subir la RM si la supera en ≥ {E1RM_UMBRAL_PROPUESTA * 100:.1f}%.")
+                if df_propuestas.empty:
+                    st.info("No hay propuestas de actualización de RM.")
+                else:
+                    st.dataframe(df_propuestas, use_container_width=True, hide_index=True)
+                    if st.button("Aplicar propuestas de RM", key='aplicar_propuestas_rm'):
+                        filas_atleta = pd.Series(df_atletas.index, index=df_atletas['Atleta']).groupby(level=0).first()
+                        cambios_rm = defaultdict(dict)
+                        for fila in df_propuestas.itertuples(index=False):
+                            if fila.Atleta in filas_atleta.index:
+                                cambios_rm[filas_atleta[fila.Atleta]][fila.ColumnaRM] = fila.Propuesta
+                        if cambios_rm and actualizar_celdas('atletas', df_atletas, dict(cambios_rm)):
+                            st.success(f"✅ RM actualizadas para {len(cambios_rm)} atleta(s).")
+                            st.rerun()
+
+        st.markdown("---")
+
+        # --- MÓDULO 5: PERFIL CARGA-VELOCIDAD (VBT) ---
+        st.subheader("5. Perfil Carga-Velocidad (VBT)")
+        st.caption("Importa el CSV de tu encoder (carga y velocidad media por repetición) para estimar tu 1RM del día y la carga para una velocidad objetivo.")
+
+        archivo_vbt = st.file_uploader("CSV de repeticiones:", type=['csv'], key='vbt_upload')
+        if archivo_vbt is not None:
+            contenido_vbt = archivo_vbt.getvalue()
+            hash_vbt = hashlib.sha256(contenido_vbt).hexdigest()
+            if st.session_state.get('vbt_ultimo_importado') == hash_vbt:
+                st.caption("Este archivo ya se importó.")
+            elif st.button("Importar repeticiones", key='importar_vbt'):
+                try:
+                    df_reps_vbt = leer_csv_vbt(
+                        contenido_vbt, atleta_actual, ejercicio_default if ejercicio_options else None,
+                        solo_atleta_defecto=rol_actual != 'Entrenador'
+                    )
+                except Exception as e:
+                    st.error(f"No se pudo leer el CSV: {e}")
+                    df_reps_vbt = None
+                if df_reps_vbt is not None and not df_reps_vbt.empty and importar_repeticiones_vbt(df_reps_vbt):
+                    st.session_state['vbt_ultimo_importado'] = hash_vbt
+                    st.success(f"✅ {len(df_reps_vbt)} repeticiones importadas.")
+                elif df_reps_vbt is not None and df_reps_vbt.empty:
+                    st.warning("El CSV no tiene repeticiones válidas a tu nombre.")
+
+        estado_vbt = perfiles_vbt(equipo_actual)
+        df_perfiles_vbt = estado_vbt['perfiles']
+        clave_vbt = (atleta_actual, ejercicio_default) if ejercicio_options else None
+        if df_perfiles_vbt is not None and clave_vbt in df_perfiles_vbt.index and pd.notna(df_perfiles_vbt.loc[clave_vbt, 'Pendiente']):
+            perfil_vbt = df_perfiles_vbt.loc[clave_vbt]
+            diario_vbt = estado_vbt['diario'].loc[clave_vbt]
+            col_v1, col_v2, col_v3 = st.columns(3)
+            col_v1.metric("1RM Estimada (perfil)", f"{perfil_vbt['1RM Estimada']:.1f} kg", help=f"Velocidad mínima (MVT): {perfil_vbt['MVT']} m/s")
+            col_v2.metric("1RM del Día", f"{diario_vbt['1RM del Día'].iloc[-1]:.1f} kg", help=diario_vbt.index[-1].strftime('%Y-%m-%d'))
+            col_v3.metric("Ajuste (R²)", f"{perfil_vbt['R2']:.2f}" if pd.notna(perfil_vbt['R2']) else "N/D", help=f"{int(perfil_vbt['Reps'])} repeticiones")
+
+            velocidad_objetivo = st.slider("Velocidad objetivo (m/s):", min_value=0.15, max_value=1.50, value=0.75, step=0.05, key='vbt_velocidad_objetivo')
+            carga_vbt = float(carga_para_velocidad(perfil_vbt['Pendiente'], perfil_vbt['Intercepto'], velocidad_objetivo))
+            peso_vbt, placas_vbt = descomponer_placas(carga_vbt, peso_barra)
+            st.metric(f"Carga para {velocidad_objetivo:.2f} m/s", f"**{carga_vbt} kg**")
+            if placas_vbt:
+                st.caption("Por lado: " + " + ".join(f"{cantidad}×{placa:g}" for placa, cantidad in placas_vbt.items()))
+            st.line_chart(diario_vbt['1RM del Día'], use_container_width=True)
+        else:
+            st.info("Aún no hay un perfil carga-velocidad para este ejercicio (se necesitan al menos 2 cargas distintas).")
+
+        if rol_actual == 'Entrenador' and df_perfiles_vbt is not None:
+            with st.expander("👥 Perfiles Carga-Velocidad del Equipo (Vista Entrenador)"):
+                st.dataframe(df_perfiles_vbt.reset_index(), use_container_width=True, hide_index=True)
+
+        st.markdown("---")
+
+        # --- GUÍA VBT Y RPE/RIR PARA COMBATE ---
+
+        col_rpe, col_vbt = st.columns(2)
+
+        with col_rpe:
+            st.subheader("Guía de Intensidad (RPE / RIR) 🥊")
+            st.caption("Usa el RIR/RPE para el Estimador de Carga.")
+            rpe_guide = pd.DataFrame({
+                'RIR': [4, 3, 2, 1, 0],
+                'RPE': [6, 7, 8, 9, 10],
+                'Esfuerzo': ['Calentamiento / Técnica (Fácil)', 'Medio (Buena Velocidad)', 'Cerca del fallo (Lento)', 'Máximo posible (Muy Lento)', 'Fallo (Sin repeticiones extra)'],
+                'Carga Sugerida': ['65% - 75%', '70% - 80%', '80% - 87%', '87% - 95%', '90% +']
+            })
+            st.table(rpe_guide.set_index('RIR'))
+
+        with col_vbt:
+            st.subheader("Guía de Velocidad (VBT) ⚡")
+            st.caption("Maximiza la potencia en zonas de velocidad alta.")
+
+            vbt_guide = pd.DataFrame({
+                '% de 1RM Típico': ['90% - 95%', '80% - 85%', '60% - 70%', '40% - 50%'],
+                'Intención': ['Fuerza Máxima', 'Fuerza-Velocidad', 'Velocidad-Fuerza', 'Técnica/Velocidad'],
+                'Velocidad Objetivo (m/s)': ['0.30 - 0.45', '0.50 - 0.70', '0.75 - 1.00', '1.00 - 1.30']
+            })
+            st.table(vbt_guide.set_index('% de 1RM Típico'))
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 3: CALENDARIO (Visible para todos)
+    # ----------------------------------------------------------------------------------
+    with CALENDAR_TAB, medir_tiempo('tab.calendario'):
+        st.header("📅 Calendario de Pruebas y Actividades")
+        st.caption(f"Archivo de origen: **{ruta_equipo(CALENDAR_FILE, equipo_actual)}**")
+
+        if rol_actual == 'Entrenador':
+            st.subheader("Gestión de Cronograma (Vista Entrenador)")
+            st.caption("⚠️ **Edita, añade o elimina filas directamente en la tabla. El 'chulito' en 'Habilitado' controla la visibilidad para los atletas.**")
+
+            df_calendar_edit = df_calendario_full
+
+            with medir_tiempo('editor.calendar_data_editor'):
+                df_edited_calendar = st.data_editor(
+                    df_calendar_edit,
+                    num_rows="dynamic",
+                    column_config={
+                        "Fecha": st.column_config.DateColumn(
+                            "Fecha", 
+                            format="YYYY-MM-DD", 
+                            required=True
+                        ),
+                        "Evento": st.column_config.TextColumn("Evento", required=True),
+                        "Habilitado": st.column_config.CheckboxColumn(
+                            "Habilitado",
+                            help="Marcar para que los atletas puedan ver el evento.",
+                            default=True,
+                        )
+                    },
+                    use_container_width=True,
+                    key="calendar_data_editor"
                 )
-            },
-            use_container_width=True,
-            key="calendar_data_editor"
-        )
-        
-        if st.button("💾 Guardar Cambios en Calendario y Aplicar", type="primary", key="save_calendar_data_btn"):
-            df_edited_cleaned = df_edited_calendar.dropna(subset=['Evento', 'Fecha'], how='any')
 
-            if save_calendar_data(df_edited_cleaned):
-                st.success("✅ Calendario actualizado y guardado con éxito. Recargando aplicación...")
-                st.rerun()
+            if st.button("💾 Guardar Cambios en Calendario y Aplicar", type="primary", key="save_calendar_data_btn"):
+                resultado = guardar_cambios_editor('calendario', df_calendario_full, df_calendar_edit, df_edited_calendar, 'calendar_data_editor')
+
+                if resultado is None:
+                    st.info("No hay cambios para guardar.")
+                elif resultado:
+                    st.success("✅ Calendario actualizado y guardado con éxito. Recargando aplicación...")
+                    st.rerun()
+                else:
+                    st.error("❌ No se pudieron guardar los cambios en el calendario.")
+
+            st.markdown("---")
+            st.subheader(f"Vista del Atleta")
+            eventos_mostrar = df_calendario
+
+        else:
+            st.subheader(f"Próximos Eventos Habilitados para {atleta_actual}")
+            eventos_mostrar = df_calendario
+
+        # --- LÓGICA DE RESALTADO ---
+        if not eventos_mostrar.empty:
+            eventos_mostrar = eventos_mostrar.assign(Days_Until=vista_equipo['eventos']['Days_Until'])
+
+            st.dataframe(
+                eventos_mostrar.style.apply(highlight_imminent_events, axis=None), 
+                use_container_width=True
+            )
+
+        else:
+            st.info("No hay eventos habilitados para mostrar.")
+
+        # --- ASISTENCIA (solo entrenador): tasas materializadas, check-in manual y credenciales QR ---
+        if rol_actual == 'Entrenador':
+            st.markdown("---")
+            st.subheader("✅ Asistencia a Sesiones")
+            st.caption(f"Registro append-only en **{ruta_equipo(ASISTENCIA_LOG_FILE, equipo_actual)}**. Inicia el **Modo kiosko** desde la barra lateral para el check-in por QR (para salir se pide tu contraseña).")
+
+            asistencia_equipo = vista_asistencia(equipo_actual, df_atletas)
+            col_as1, col_as2, col_as3 = st.columns(3)
+            col_as1.metric("Sesiones registradas", asistencia_equipo['n_sesiones'])
+            col_as2.metric("Asistencia media por sesión", f"{asistencia_equipo['sesiones']['Tasa (%)'].mean():.1f}%" if asistencia_equipo['n_sesiones'] else "N/D")
+            col_as3.metric("Atletas sin asistencias", int((asistencia_equipo['atletas']['Asistencias'] == 0).sum()))
+
+            col_tabla_atletas, col_tabla_sesiones = st.columns(2)
+            with col_tabla_atletas:
+                st.markdown("**Por atleta**")
+                st.dataframe(
+                    asistencia_equipo['atletas'], use_container_width=True, hide_index=True,
+                    column_config={"Tasa (%)": st.column_config.ProgressColumn("Tasa (%)", format="%.1f%%", min_value=0, max_value=100)}
+                )
+            with col_tabla_sesiones:
+                st.markdown("**Por sesión**")
+                st.dataframe(
+                    asistencia_equipo['sesiones'], use_container_width=True, hide_index=True,
+                    column_config={"Tasa (%)": st.column_config.ProgressColumn("Tasa (%)", format="%.1f%%", min_value=0, max_value=100)}
+                )
+            st.caption(f"Actualizado: {asistencia_equipo['actualizado']:%H:%M:%S} (se recalcula tras cada lote de check-ins).")
+
+            col_manual, col_credenciales = st.columns(2)
+            with col_manual:
+                with st.form('asistencia_manual_form', clear_on_submit=True):
+                    st.markdown("**Check-in manual**")
+                    atletas_manual = st.multiselect("Atletas:", df_atletas['Atleta'].dropna().astype(str).tolist(), key='asistencia_manual_atletas')
+                    sesion_manual = st.selectbox("Sesión:", sesiones_del_dia(df_calendario_full), key='asistencia_manual_sesion')
+                    if st.form_submit_button("✅ Registrar asistencia"):
+                        ids_manual = df_atletas.loc[df_atletas['Atleta'].isin(atletas_manual), 'ID']
+                        resultados_manual = [registrar_asistencia(equipo_actual, df_atletas, i, sesion_manual, permitir_id=True)[0] for i in ids_manual]
+                        flush_asistencia()
+                        st.success(f"✅ {resultados_manual.count('ok')} registradas, {resultados_manual.count('repetida')} ya estaban.")
+            with col_credenciales:
+                st.markdown("**Credenciales QR**")
+                st.caption("Cada QR contiene el ID del atleta firmado con la clave de esta instancia.")
+                st.download_button(
+                    "⬇️ Descargar credenciales (ZIP)", data=credenciales_qr_zip(df_atletas, equipo_actual, version_archivo(ruta_equipo(EXCEL_FILE, equipo_actual))),
+                    file_name=f"credenciales_qr_{equipo_actual}.zip", mime='application/zip', key='credenciales_qr_btn'
+                )
+                if qrcode is None:
+                    st.caption("Instala `qrcode` para incluir las imágenes PNG; sin ella el ZIP trae solo los tokens en CSV.")
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 4: PERFIL (Visible para todos)
+    # ----------------------------------------------------------------------------------
+    with PERFIL_TAB, medir_tiempo('tab.perfil'):
+        st.header(f"👤 Perfil y Datos de Contacto de {atleta_actual}")
+        st.caption(f"Archivos de origen: Atletas y Perfiles")
+
+        datos_perfil = df_perfiles[df_perfiles['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_perfiles['Atleta'].values else None
+        datos_rm = df_atletas[df_atletas['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_atletas['Atleta'].values else None
+
+        if datos_perfil is None:
+            st.warning("No se encontró información de perfil (Altura, Edad, Sexo, etc.). Edita la hoja de Perfiles.")
+            datos_perfil = pd.Series({'Edad': np.nan, 'Altura_cm': np.nan, 'Sexo': 'Hombre'})
+
+        # --- MÓDULO 1: INFORMACIÓN PERSONAL ---
+        st.subheader("Información Personal")
+
+        col_personal_1, col_personal_2 = st.columns(2)
+
+        for i, (key, value) in enumerate(datos_perfil.drop(labels=['Atleta', 'Sexo'], errors='ignore').items()):
+            if key.lower() == 'fecha_nacimiento' and pd.notna(value):
+                value_display = value.strftime('%Y-%m-%d') if isinstance(value, pd.Timestamp) else str(value)
             else:
-                st.error("❌ No se pudieron guardar los cambios en el calendario.")
-        
+                value_display = str(value) if pd.notna(value) else 'N/D'
+
+            with col_personal_1 if i % 2 == 0 else col_personal_2:
+                st.metric(label=key.replace('_', ' ').title(), value=value_display)
+
+        if datos_rm is not None and pd.notna(datos_rm.get('ID')):
+            with st.expander("📲 Mi código QR de asistencia"):
+                token_atleta = token_asistencia(equipo_actual, datos_rm['ID'])
+                png_atleta = imagen_qr(token_atleta)
+                if png_atleta is not None:
+                    st.image(png_atleta, width=220)
+                st.code(token_atleta, language=None)
+                st.caption("Muéstralo en el kiosko al llegar a la sesión.")
+
         st.markdown("---")
-        st.subheader(f"Vista del Atleta")
-        eventos_mostrar = df_calendario.copy()
-        
-    else:
-        st.subheader(f"Próximos Eventos Habilitados para {atleta_actual}")
-        eventos_mostrar = df_calendario.copy()
-    
-    # --- LÓGICA DE RESALTADO ---
-    if not eventos_mostrar.empty:
-        eventos_mostrar['Days_Until'] = eventos_mostrar['Fecha'].apply(get_days_until)
-        
-        st.dataframe(
-            eventos_mostrar.style.apply(highlight_imminent_events, axis=None), 
-            use_container_width=True
-        )
-        
-    else:
-        st.info("No hay eventos habilitados para mostrar.")
+        st.subheader("Diagnóstico de Fuerza Relativa y Composición Corporal")
+
+        # Extracción de valores seguros para cálculos
+        peso_kg = float(datos_rm.get('PesoCorporal', 0)) if datos_rm is not None and pd.notna(datos_rm.get('PesoCorporal')) else 0
+        sentadilla_rm = float(datos_rm.get('Sentadilla_RM', 0)) if datos_rm is not None and pd.notna(datos_rm.get('Sentadilla_RM')) else 0
+        pressbanca_rm = float(datos_rm.get('PressBanca_RM', 0)) if datos_rm is not None and pd.notna(datos_rm.get('PressBanca_RM')) else 0
+        altura_cm = float(datos_perfil.get('Altura_cm', 0)) if pd.notna(datos_perfil.get('Altura_cm')) else 0
+
+        # Cálculo de IMC
+        if peso_kg > 0 and altura_cm > 0:
+            altura_m = altura_cm / 100
+            imc = peso_kg / (altura_m ** 2)
+            imc_display = f"{imc:.1f}"
+        else:
+            imc = 0
+            imc_display = "N/D"
 
-# ----------------------------------------------------------------------------------
-## PESTAÑA 4: PERFIL (Visible para todos)
-# ----------------------------------------------------------------------------------
-with PERFIL_TAB:
-    st.header(f"👤 Perfil y Datos de Contacto de {atleta_actual}")
-    st.caption(f"Archivos de origen: Atletas y Perfiles")
+        # Cálculo de Fuerza Relativa
+        rel_squat = round(sentadilla_rm / peso_kg, 2) if peso_kg > 0 and sentadilla_rm > 0 else 0
+        rel_bench = round(pressbanca_rm / peso_kg, 2) if peso_kg > 0 and pressbanca_rm > 0 else 0
+        ratio_sq_bp = round(sentadilla_rm / pressbanca_rm, 2) if pressbanca_rm > 0 and sentadilla_rm > 0 else 0
 
-    datos_perfil = df_perfiles[df_perfiles['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_perfiles['Atleta'].values else None
-    datos_rm = df_atletas[df_atletas['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_atletas['Atleta'].values else None
-    
-    if datos_perfil is None:
-        st.warning("No se encontró información de perfil (Altura, Edad, Sexo, etc.). Edita la hoja de Perfiles.")
-        datos_perfil = pd.Series({'Edad': np.nan, 'Altura_cm': np.nan, 'Sexo': 'Hombre'})
-    
-    # --- MÓDULO 1: INFORMACIÓN PERSONAL ---
-    st.subheader("Información Personal")
-    
-    col_personal_1, col_personal_2 = st.columns(2)
-    
-    for i, (key, value) in enumerate(datos_perfil.drop(labels=['Atleta', 'Sexo'], errors='ignore').items()):
-        if key.lower() == 'fecha_nacimiento' and pd.notna(value):
-            value_display = value.strftime('%Y-%m-%d') if isinstance(value, pd.Timestamp) else str(value)
+        col_metric_1, col_metric_2, col_metric_3 = st.columns(3)
+
+        col_metric_1.metric("IMC (Índice de Masa Corporal)", imc_display, help="Peso (kg) / Altura (m)²")
+        col_metric_2.metric("Fuerza Relativa (Squat)", f"{rel_squat:.2f}x BW", help="RM de Sentadilla / Peso Corporal. Ideal > 1.5x.")
+        col_metric_3.metric("Ratio Squat:Bench", f"{ratio_sq_bp:.2f}:1", help="Relación Sentadilla a Press Banca. Ideal ~1.5:1 para balance.")
+
+        st.markdown("---")
+        st.subheader("Análisis de Desequilibrio")
+
+        if ratio_sq_bp > 0:
+            if ratio_sq_bp > 2.2:
+                st.warning("⚠️ **Desequilibrio Notable:** El Press Banca es muy bajo en relación con la Sentadilla. Priorizar el empuje del tren superior.")
+            elif ratio_sq_bp < 1.3:
+                 st.warning("⚠️ **Desequilibrio Notable:** La Sentadilla es muy baja en relación con el Press Banca. Priorizar la cadena posterior y el core.")
+            else:
+                st.success("✅ **Balance Óptimo:** Ratio Squat:Bench dentro del rango ideal (1.3:1 a 2.2:1).")
         else:
-            value_display = str(value) if pd.notna(value) else 'N/D'
-            
-        with col_personal_1 if i % 2 == 0 else col_personal_2:
-            st.metric(label=key.replace('_', ' ').title(), value=value_display)
-            
-    st.markdown("---")
-    st.subheader("Diagnóstico de Fuerza Relativa y Composición Corporal")
-    
-    # Extracción de valores seguros para cálculos
-    peso_kg = float(datos_rm.get('PesoCorporal', 0)) if datos_rm is not None and pd.notna(datos_rm.get('PesoCorporal')) else 0
-    sentadilla_rm = float(datos_rm.get('Sentadilla_RM', 0)) if datos_rm is not None and pd.notna(datos_rm.get('Sentadilla_RM')) else 0
-    pressbanca_rm = float(datos_rm.get('PressBanca_RM', 0)) if datos_rm is not None and pd.notna(datos_rm.get('PressBanca_RM')) else 0
-    altura_cm = float(datos_perfil.get('Altura_cm', 0)) if pd.notna(datos_perfil.get('Altura_cm')) else 0
-    
-    # Cálculo de IMC
-    if peso_kg > 0 and altura_cm > 0:
-        altura_m = altura_cm / 100
-        imc = peso_kg / (altura_m ** 2)
-        imc_display = f"{imc:.1f}"
-    else:
-        imc = 0
-        imc_display = "N/D"
+             st.info("Falta el registro de RM de Sentadilla o Press Banca para calcular el balance.")
 
-    # Cálculo de Fuerza Relativa
-    rel_squat = round(sentadilla_rm / peso_kg, 2) if peso_kg > 0 and sentadilla_rm > 0 else 0
-    rel_bench = round(pressbanca_rm / peso_kg, 2) if peso_kg > 0 and pressbanca_rm > 0 else 0
-    ratio_sq_bp = round(sentadilla_rm / pressbanca_rm, 2) if pressbanca_rm > 0 and sentadilla_rm > 0 else 0
 
-    col_metric_1, col_metric_2, col_metric_3 = st.columns(3)
-    
-    col_metric_1.metric("IMC (Índice de Masa Corporal)", imc_display, help="Peso (kg) / Altura (m)²")
-    col_metric_2.metric("Fuerza Relativa (Squat)", f"{rel_squat:.2f}x BW", help="RM de Sentadilla / Peso Corporal. Ideal > 1.5x.")
-    col_metric_3.metric("Ratio Squat:Bench", f"{ratio_sq_bp:.2f}:1", help="Relación Sentadilla a Press Banca. Ideal ~1.5:1 para balance.")
+        if rol_actual == 'Entrenador':
+            st.markdown("---")
+            st.subheader("Gestión de Perfiles (Vista Entrenador)")
+            st.caption("Asegúrate de que la columna 'Atleta' en el Excel coincida exactamente con el nombre de usuario.")
+            df_perfiles_pagina = tabla_paginada('tabla_perfiles', df_perfiles, 'perfiles', ruta_equipo(PERFILES_FILE, equipo_actual), columna_filtro='Categoria')
+            st.dataframe(df_perfiles_pagina, use_container_width=True)
 
-    st.markdown("---")
-    st.subheader("Análisis de Desequilibrio")
-    
-    if ratio_sq_bp > 0:
-        if ratio_sq_bp > 2.2:
-            st.warning("⚠️ **Desequilibrio Notable:** El Press Banca es muy bajo en relación con la Sentadilla. Priorizar el empuje del tren superior.")
-        elif ratio_sq_bp < 1.3:
-             st.warning("⚠️ **Desequilibrio Notable:** La Sentadilla es muy baja en relación con el Press Banca. Priorizar la cadena posterior y el core.")
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 5: ACONDICIONAMIENTO (CONTENIDO ANTES DE RANKING)
+    # ----------------------------------------------------------------------------------
+    with ACOND_TAB, medir_tiempo('tab.acondicionamiento'):
+        st.header("🏃 Calculadora de Desempeño y Acondicionamiento")
+
+        datos_perfil = df_perfiles[df_perfiles['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_perfiles['Atleta'].values else None
+        version_perfiles = version_archivo(ruta_equipo(PERFILES_FILE, equipo_actual))
+        df_zonas_equipo, df_zonas_largo = calcular_zonas_equipo(df_perfiles, equipo_actual, version_perfiles)
+
+        st.subheader("1. Frecuencia Cardíaca Máxima (FC Máx) y Zonas")
+
+        fc_max_ref = None
+        limites_zona_atleta = None
+        if datos_perfil is not None:
+            posicion_perfil = int(np.flatnonzero((df_perfiles['Atleta'] == atleta_actual).to_numpy())[0])
+            etiqueta_perfil = df_perfiles.index[posicion_perfil]
+            zonas_atleta = df_zonas_equipo.iloc[posicion_perfil]
+            edad = pd.to_numeric(datos_perfil.get('Edad', 25), errors='coerce', downcast='integer')
+
+            col_edad, col_fc, col_rep = st.columns(3)
+            col_edad.metric("Edad Registrada (Aprox.)", f"{int(edad) if not pd.isna(edad) else 'N/D'} años")
+            if pd.notna(zonas_atleta['FC_Max']):
+                fc_max_ref = int(zonas_atleta['FC_Max'])
+                limites_zona_atleta = tuple(float(zonas_atleta[f'Z{z} Mín']) for z in range(1, 6))
+                fuente_fc = "Medida" if zonas_atleta['Fuente FC Máx'] == 'Medida' else "Fórmula de Tanaka"
+                col_fc.metric("FC Máx de Referencia", f"{fc_max_ref} ppm", help=fuente_fc)
+                col_fc.caption(fuente_fc)
+            else:
+                col_fc.metric("FC Máx de Referencia", "N/D")
+            col_rep.metric("FC en Reposo", f"{int(zonas_atleta['FC_Reposo'])} ppm")
+            col_rep.caption(f"Modelo: {zonas_atleta['Modelo']}")
+
+            with st.expander("⚙️ Personalizar mis zonas (FC Máx medida, FC en reposo, modelo)"):
+                fc_medida_actual = pd.to_numeric(datos_perfil.get('FC_Max_Medida'), errors='coerce')
+                modelo_actual = datos_perfil.get('Modelo_Zonas')
+                with st.form('form_zonas_personales'):
+                    col_m, col_r, col_mod = st.columns(3)
+                    fc_medida_input = col_m.number_input("FC Máx medida (0 = usar Tanaka):", min_value=0, max_value=240, value=int(fc_medida_actual) if pd.notna(fc_medida_actual) else 0, step=1)
+                    fc_reposo_input = col_r.number_input("FC en reposo (ppm):", min_value=30, max_value=120, value=int(zonas_atleta['FC_Reposo']), step=1)
+                    modelo_input = col_mod.selectbox("Modelo de zonas:", MODELOS_ZONAS, index=MODELOS_ZONAS.index(modelo_actual) if modelo_actual in MODELOS_ZONAS else 0)
+                    if st.form_submit_button("Guardar mis zonas"):
+                        campos_zonas = {
+                            'FC_Max_Medida': fc_medida_input if fc_medida_input > 0 else np.nan,
+                            'FC_Reposo': fc_reposo_input,
+                            'Modelo_Zonas': modelo_input,
+                        }
+                        if actualizar_campos_fila('perfiles', df_perfiles, etiqueta_perfil, campos_zonas):
+                            st.success("✅ Zonas actualizadas.")
+                            st.rerun()
+
+            if fc_max_ref:
+                st.markdown("---")
+                st.subheader("Visualización de Zonas de Entrenamiento")
+
+                df_zonas = df_zonas_largo.iloc[posicion_perfil * 5:(posicion_perfil + 1) * 5].droplevel('Atleta')
+                st.bar_chart(df_zonas, use_container_width=True)
+
+                st.markdown("<br>", unsafe_allow_html=True)
+                st.subheader("Rangos Exactos de Entrenamiento (ppm)")
+                referencia_pct = "FCR" if zonas_atleta['Modelo'] == MODELOS_ZONAS[1] else "FC Máx"
+
+                columnas_z = st.columns(3)
+                for z in range(5):
+                    pct_min, pct_max = int(ZONAS_PORCENTAJES[z] * 100), int(ZONAS_PORCENTAJES[z + 1] * 100)
+                    columnas_z[z // 2].metric(f"Zona {z + 1} ({pct_min}%-{pct_max}% {referencia_pct})", f"{int(zonas_atleta[f'Z{z + 1} Mín'])} - {int(zonas_atleta[f'Z{z + 1} Máx'])} ppm")
+            else:
+                st.info("No se puede calcular la FC Máx. Registra tu 'Edad' o una FC Máx medida en tu perfil.")
         else:
-            st.success("✅ **Balance Óptimo:** Ratio Squat:Bench dentro del rango ideal (1.3:1 a 2.2:1).")
-    else:
-         st.info("Falta el registro de RM de Sentadilla o Press Banca para calcular el balance.")
+            st.info("No se puede calcular la FC Máx. Asegúrate de que la columna 'Edad' esté registrada en tu perfil.")
+
+        if rol_actual == 'Entrenador':
+            with st.expander("👥 Zonas del Equipo (Vista Entrenador)"):
+                st.caption("Edita FC Máx medida, FC en reposo y modelo de cada atleta; las zonas de todo el equipo se recalculan una sola vez al guardar.")
+                columnas_zonas_editor = ['Atleta'] + PERFIL_ZONAS_COLUMNAS
+                df_zonas_editor = df_perfiles[columnas_zonas_editor]
+                df_zonas_editado = st.data_editor(
+                    a_objeto(df_zonas_editor),
+                    key='zonas_equipo_editor',
+                    num_rows='fixed',
+                    disabled=['Atleta'],
+                    column_config={
+                        'FC_Max_Medida': st.column_config.NumberColumn("FC Máx medida", min_value=0, max_value=240, step=1),
+                        'FC_Reposo': st.column_config.NumberColumn("FC Reposo", min_value=30, max_value=120, step=1),
+                        'Modelo_Zonas': st.column_config.SelectboxColumn("Modelo", options=MODELOS_ZONAS),
+                    },
+                    use_container_width=True,
+                )
+                if st.button("Guardar Zonas del Equipo", key='guardar_zonas_equipo'):
+                    resultado_zonas = guardar_cambios_editor('perfiles', df_perfiles, df_zonas_editor, df_zonas_editado, 'zonas_equipo_editor')
+                    if resultado_zonas is None:
+                        st.info("No hay cambios para guardar.")
+                    elif resultado_zonas:
+                        st.success("✅ Zonas del equipo actualizadas.")
+                        st.rerun()
+
+                st.dataframe(df_zonas_equipo, use_container_width=True, hide_index=True)
+                st.download_button(
+                    "Descargar zonas del equipo (CSV)",
+                    data=df_zonas_equipo.to_csv(index=False).encode('utf-8'),
+                    file_name=f"zonas_fc_{equipo_actual}.csv",
+                    mime='text/csv',
+                    key='descargar_zonas_equipo',
+                )
+
+        st.markdown("---")
 
+        # --- MÓDULO 2: ANÁLISIS DE SESIÓN (PULSÓMETRO / GPS) ---
+        st.subheader("2. Análisis de Sesión (Pulsómetro / GPS)")
+        # Los .fit solo se aceptan si está instalado el paquete opcional 'fitparse'
+        formatos_sesion = (['fit'] if fitparse is not None else []) + ['tcx', 'gpx', 'csv']
+        st.caption(f"Sube el archivo de tu sesión ({', '.join('.' + f for f in formatos_sesion)} con columna de FC) para ver el tiempo real en cada zona.")
+
+        archivo_sesion = st.file_uploader("Archivo de sesión:", type=formatos_sesion, key='acond_sesion_upload')
+
+        if archivo_sesion is not None:
+            contenido_sesion = archivo_sesion.getvalue()
+            hash_sesion = hashlib.sha256(contenido_sesion).hexdigest()
+            fc_reposo_sesion = int(zonas_atleta['FC_Reposo']) if datos_perfil is not None else FC_REPOSO_POR_DEFECTO
+            sexo_sesion = datos_perfil.get('Sexo', 'Hombre') if datos_perfil is not None else 'Hombre'
+
+            try:
+                resultado_sesion = analizar_sesion_fc(hash_sesion, archivo_sesion.name, contenido_sesion, limites_zona_atleta, fc_max_ref, fc_reposo_sesion, sexo_sesion)
+            except Exception as e:
+                st.error(f"No se pudo procesar el archivo: {e}")
+                resultado_sesion = None
+
+            if resultado_sesion is not None and resultado_sesion['muestras'] > 0:
+                col_dur, col_fcm, col_trimp, col_dist = st.columns(4)
+                col_dur.metric("Duración", f"{int(resultado_sesion['duracion_s'] // 60)} min")
+                col_fcm.metric("FC Media", f"{resultado_sesion['fc_media']:.0f} ppm" if pd.notna(resultado_sesion['fc_media']) else "N/D")
+                col_trimp.metric("TRIMP (Banister)", f"{resultado_sesion['trimp']:.0f}" if pd.notna(resultado_sesion['trimp']) else "N/D")
+                col_dist.metric("Distancia GPS", f"{resultado_sesion['distancia_km']:.2f} km" if resultado_sesion['distancia_km'] > 0 else "N/D")
+
+                fc_real = resultado_sesion['fc_max_real']
+                if pd.notna(fc_real) and fc_max_ref:
+                    st.metric("FC Máx Real vs Referencia", f"{fc_real:.0f} ppm", delta=f"{fc_real - fc_max_ref:+.0f} ppm vs {fc_max_ref}")
+                    if fc_real > fc_max_ref:
+                        st.info("Tu FC máxima medida supera la de referencia: puedes usarla para tus zonas.")
+                        if st.button("Usar como mi FC Máx", key='usar_fc_max_sesion'):
+                            if actualizar_campos_fila('perfiles', df_perfiles, etiqueta_perfil, {'FC_Max_Medida': round(float(fc_real))}):
+                                st.success("✅ FC Máx medida guardada en tu perfil.")
+                                st.rerun()
+
+                if fc_max_ref:
+                    st.bar_chart(resultado_sesion['minutos_zona'].rename('Minutos'), use_container_width=True)
+                else:
+                    st.warning("Registra tu 'Edad' en el perfil para repartir la sesión por zonas y calcular el TRIMP.")
+            elif resultado_sesion is not None:
+                st.warning("El archivo no contiene muestras de frecuencia cardíaca.")
 
-    if rol_actual == 'Entrenador':
         st.markdown("---")
-        st.subheader("Gestión de Perfiles (Vista Entrenador)")
-        st.caption("Asegúrate de que la columna 'Atleta' en el Excel coincida exactamente con el nombre de usuario.")
-        st.dataframe(df_perfiles, use_container_width=True)
 
+        # --- MÓDULO 3: ESTIMACIÓN VAM Y RITMOS ---
+        st.subheader("3. Estimador de Ritmo de Carrera (VAM)")
 
-# ----------------------------------------------------------------------------------
-## PESTAÑA 5: ACONDICIONAMIENTO (CONTENIDO ANTES DE RANKING)
-# ----------------------------------------------------------------------------------
-with ACOND_TAB:
-    st.header("🏃 Calculadora de Desempeño y Acondicionamiento")
-    
-    datos_perfil = df_perfiles[df_perfiles['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_perfiles['Atleta'].values else None
-    
-    if datos_perfil is not None:
-        datos_perfil = datos_perfil.iloc[0] if isinstance(datos_perfil, pd.DataFrame) else datos_perfil
-        edad = pd.to_numeric(datos_perfil.get('Edad', 25), errors='coerce', downcast='integer')
-        
-        # Fórmula FC Máx: Tanaka (208 - 0.7 * edad)
-        fc_max_estimada = round(208 - (0.7 * edad)) if not pd.isna(edad) and edad > 0 else "N/D"
+        col_tipo, col_fecha_vam = st.columns(2)
+        tipo_prueba = col_tipo.selectbox("Tipo de prueba:", list(TIPOS_PRUEBA_VAM), key='acond_tipo_vam')
+        fecha_prueba = col_fecha_vam.date_input("Fecha de la prueba:", value=datetime.now().date(), key='acond_fecha_vam')
 
-        st.subheader("1. Frecuencia Cardíaca Máxima (FC Máx) y Zonas")
-        
-        col_edad, col_fc = st.columns([1, 1])
-        with col_edad:
-            st.metric("Edad Registrada (Aprox.)", f"{int(edad) if not pd.isna(edad) else 'N/D'} años")
-            
-        with col_fc:
-            st.metric("FC Máx Estimada", f"**{fc_max_estimada} ppm** (Fórmula de Tanaka)")
+        col_dist, col_min, col_sec = st.columns(3)
+
+        with col_dist:
+            test_dist = st.number_input("Distancia Total de la Prueba (metros):", min_value=100, value=2000, step=100, key='acond_dist')
+
+        with col_min:
+            test_minutes = st.number_input("Tiempo de Prueba: Minutos:", min_value=0, value=7, step=1, key='acond_min')
+
+        with col_sec:
+            test_seconds = st.number_input("Tiempo de Prueba: Segundos:", min_value=0, max_value=59, value=30, step=5, key='acond_sec')
+
+        total_seconds = (test_minutes * 60) + test_seconds
+
+        if total_seconds > 0 and test_dist > 0:
+            v_kmh = calcular_vam_kmh(tipo_prueba, test_dist, total_seconds)
+
+            st.markdown("<br>", unsafe_allow_html=True)
+            col_vam, col_guardar_vam = st.columns([2, 1])
+            col_vam.metric("VAM Estimada", f"**{v_kmh:.2f} km/h**")
+            if col_guardar_vam.button("💾 Guardar resultado", key='guardar_vam'):
+                if save_vam_result(atleta_actual, fecha_prueba, tipo_prueba, test_dist, total_seconds):
+                    st.success("✅ Resultado de la prueba guardado.")
+                    st.rerun()
 
-        if not pd.isna(fc_max_estimada) and isinstance(fc_max_estimada, int):
             st.markdown("---")
-            st.subheader("Visualización de Zonas de Entrenamiento")
-            
-            # --- LÓGICA DEL GRÁFICO (NUEVO) ---
-            
-            fc_max_int = int(fc_max_estimada)
-            
-            zonas_data = {
-                "Zona": ["Zona 1: Muy Ligera", "Zona 2: Ligera", "Zona 3: Aeróbica", "Zona 4: Umbral", "Zona 5: Máxima"],
-                "Mínimo (ppm)": [
-                    round(fc_max_int * 0.50),
-                    round(fc_max_int * 0.60),
-                    round(fc_max_int * 0.70),
-                    round(fc_max_int * 0.80),
-                    round(fc_max_int * 0.90),
-                ],
-                "Máximo (ppm)": [
-                    round(fc_max_int * 0.60),
-                    round(fc_max_int * 0.70),
-                    round(fc_max_int * 0.80),
-                    round(fc_max_int * 0.90),
-                    fc_max_int
-                ]
-            }
-            df_zonas = pd.DataFrame(zonas_data)
-            df_zonas.set_index('Zona', inplace=True)
-            
-            st.bar_chart(df_zonas, use_container_width=True)
+            st.subheader("Ritmos de Carrera para Acondicionamiento:")
+
+            porcentajes_vam = st.multiselect(
+                "% VAM:", options=list(range(120, 59, -5)), default=[100, 95, 90, 85, 80], key='acond_pct_vam'
+            ) or [100]
+            porcentajes_vam = sorted(porcentajes_vam, reverse=True)
+
+            with medir_tiempo('ritmos.vectorizados'):
+                ritmos = pd.DataFrame({
+                    '% VAM': porcentajes_vam,
+                    'Velocidad (km/h)': np.round(v_kmh * np.array(porcentajes_vam) / 100, 2),
+                    'Ritmo (min/km)': tabla_ritmos([v_kmh], porcentajes_vam)[0],
+                })
+
+            st.dataframe(ritmos.set_index('% VAM'), use_container_width=True)
+
+            st.subheader("Predicción de Tiempos (Riegel)")
+            tiempos_previstos = predecir_tiempos_riegel([test_dist], [total_seconds], list(DISTANCIAS_PREDICCION_M.values()))[0]
+            st.dataframe(pd.DataFrame({
+                'Distancia': list(DISTANCIAS_PREDICCION_M),
+                'Tiempo previsto': formatear_tiempo(tiempos_previstos),
+                'Ritmo (min/km)': formatear_tiempo(tiempos_previstos / (np.array(list(DISTANCIAS_PREDICCION_M.values())) / 1000)),
+            }).set_index('Distancia'), use_container_width=True)
+        else:
+            st.info("Ingresa los datos de la prueba para calcular el VAM.")
+
+        historial_vam = df_vam[df_vam['Atleta'] == atleta_actual]
+        if not historial_vam.empty:
+            with st.expander("📈 Mi historial de pruebas de VAM"):
+                st.line_chart(historial_vam.set_index('Fecha')['VAM_kmh'], use_container_width=True)
+                st.dataframe(historial_vam.sort_values('Fecha', ascending=False), use_container_width=True, hide_index=True)
+
+        if rol_actual == 'Entrenador':
+            with st.expander("👥 Ritmos del Equipo y Hoja de Series (Vista Entrenador)"):
+                version_vam = version_archivo(ruta_equipo(VAM_FILE, equipo_actual))
+                df_ultimas_vam = ultimas_pruebas_vam(df_vam, equipo_actual, version_vam)
+
+                if df_ultimas_vam.empty:
+                    st.info("Aún no hay resultados de pruebas de VAM guardados.")
+                else:
+                    st.caption("Se usa la última prueba guardada de cada atleta.")
+                    porcentajes_equipo = sorted(st.multiselect(
+                        "% VAM para la tabla del equipo:", options=list(range(120, 59, -5)), default=[110, 100, 90, 80, 70], key='equipo_pct_vam'
+                    ) or [100], reverse=True)
+                    df_ritmos_equipo = pd.DataFrame(
+                        tabla_ritmos(df_ultimas_vam['VAM_kmh'], porcentajes_equipo),
+                        index=df_ultimas_vam.index,
+                        columns=[f"{p}% VAM" for p in porcentajes_equipo],
+                    )
+                    df_ritmos_equipo.insert(0, 'VAM (km/h)', df_ultimas_vam['VAM_kmh'].round(2))
+                    st.dataframe(df_ritmos_equipo, use_container_width=True)
+
+                    tiempos_equipo = predecir_tiempos_riegel(df_ultimas_vam['Distancia_m'], df_ultimas_vam['Tiempo_s'], list(DISTANCIAS_PREDICCION_M.values()))
+                    st.markdown("**Predicciones de carrera (Riegel)**")
+                    st.dataframe(pd.DataFrame(formatear_tiempo(tiempos_equipo), index=df_ultimas_vam.index, columns=list(DISTANCIAS_PREDICCION_M)), use_container_width=True)
+
+                    st.markdown("**Hoja de series para todo el grupo**")
+                    col_pct_s, col_dist_s, col_reps_s, col_rec_s = st.columns(4)
+                    pct_series = col_pct_s.number_input("% VAM:", min_value=50, max_value=130, value=100, step=5, key='series_pct')
+                    dist_series = col_dist_s.number_input("Distancia (m):", min_value=50, max_value=5000, value=400, step=50, key='series_dist')
+                    reps_series = col_reps_s.number_input("Repeticiones:", min_value=1, max_value=50, value=10, step=1, key='series_reps')
+                    rec_series = col_rec_s.number_input("Recuperación (s):", min_value=0, max_value=600, value=60, step=15, key='series_rec')
+
+                    df_series = hoja_intervalos_equipo(df_ultimas_vam, equipo_actual, version_vam, pct_series, dist_series, reps_series, rec_series)
+                    st.dataframe(df_series, use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "Descargar hoja de series (CSV)",
+                        data=df_series.to_csv(index=False).encode('utf-8'),
+                        file_name=f"series_{int(dist_series)}m_{int(pct_series)}vam.csv",
+                        mime='text/csv',
+                        key='descargar_series',
+                    )
+
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 6: GESTIÓN DE PESO (NUEVA PESTAÑA)
+    # ----------------------------------------------------------------------------------
+
+    with GESTION_PESO_TAB, medir_tiempo('tab.gestion_peso'):
+        st.header("⚖️ Gestión de Peso y Nutrición")
+
+        datos_perfil = df_perfiles[df_perfiles['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_perfiles['Atleta'].values else None
+        datos_rm = df_atletas[df_atletas['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_atletas['Atleta'].values else None
+
+        peso_kg = datos_rm.get('PesoCorporal', 0) if datos_rm is not None else 0
+        altura_cm = datos_perfil.get('Altura_cm', 0) if datos_perfil is not None else 0
+        edad_anos = pd.to_numeric(datos_perfil.get('Edad', 0), errors='coerce', downcast='integer') if datos_perfil is not None else 0
+        sexo = datos_perfil.get('Sexo', 'Hombre') if datos_perfil is not None else 'Hombre'
+
+        version_pesajes = version_archivo(ruta_equipo(PESAJES_FILE, equipo_actual))
+        df_peso_diario, df_resumen_peso = tendencia_peso(df_pesajes, equipo_actual, version_pesajes)
+        resumen_atleta = df_resumen_peso.loc[atleta_actual] if atleta_actual in df_resumen_peso.index else None
+        if resumen_atleta is not None:
+            peso_kg = resumen_atleta['Tendencia']
+
+        st.subheader("Registro Diario de Peso")
+        with st.form('form_pesaje', clear_on_submit=True):
+            col_fecha_p, col_peso_p, col_btn_p = st.columns([1, 1, 1])
+            fecha_pesaje = col_fecha_p.date_input("Fecha:", value=datetime.now().date())
+            peso_pesaje = col_peso_p.number_input("Peso (kg):", min_value=20.0, max_value=250.0, value=float(peso_kg) if pd.notna(peso_kg) and peso_kg > 0 else 70.0, step=0.1)
+            col_btn_p.markdown("<br>", unsafe_allow_html=True)
+            if col_btn_p.form_submit_button("Registrar pesaje"):
+                if save_pesaje(atleta_actual, fecha_pesaje, peso_pesaje):
+                    st.success("✅ Pesaje registrado.")
+                    st.rerun()
+
+        if resumen_atleta is not None:
+            col_ult, col_tend, col_ritmo = st.columns(3)
+            col_ult.metric("Último Pesaje", f"{resumen_atleta['Último peso']:.1f} kg", help=resumen_atleta['Último pesaje'].strftime('%Y-%m-%d'))
+            col_tend.metric("Peso de Tendencia", f"{resumen_atleta['Tendencia']:.1f} kg")
+            col_ritmo.metric("Ritmo Semanal", f"{resumen_atleta['Ritmo_kg_sem']:+.2f} kg/sem" if pd.notna(resumen_atleta['Ritmo_kg_sem']) else "N/D")
+            serie_peso = df_peso_diario[df_peso_diario['Atleta'] == atleta_actual].set_index('Fecha')[['Peso_kg', 'Tendencia']]
+            st.line_chart(serie_peso.rename(columns={'Peso_kg': 'Pesaje', 'Tendencia': 'Tendencia'}), use_container_width=True)
+        else:
+            st.caption("Registra tus pesajes diarios para ver tu peso de tendencia y tu ritmo semanal.")
+
+        st.markdown("---")
+
+        st.subheader("1. Cálculo de Tasa Metabólica Basal (TMB)")
+
+        col_peso, col_alt, col_edad_sexo = st.columns(3)
+
+        with col_peso:
+            peso_input = st.number_input(
+                "Peso Corporal (kg):", 
+                min_value=0.0, 
+                value=float(peso_kg) if pd.notna(peso_kg) and peso_kg > 0 else 70.0, 
+                step=0.5,
+                key='gestion_peso_input' 
+            )
+        with col_alt:
+            altura_input = st.number_input(
+                "Altura (cm):", 
+                min_value=0.0, 
+                value=float(altura_cm) if pd.notna(altura_cm) and altura_cm > 0 else 175.0, 
+                step=1.0,
+                key='gestion_altura_input' 
+            )
+        with col_edad_sexo:
+            edad_input = st.number_input(
+                "Edad (años):", 
+                min_value=1, 
+                value=int(edad_anos) if pd.notna(edad_anos) and edad_anos > 0 else 25, 
+                step=1,
+                key='gestion_edad_input' 
+            )
+            sexo_input = st.selectbox("Sexo:", options=['Hombre', 'Mujer'], index=0 if sexo == 'Hombre' else 1, key='gestion_sexo_input')
+
+
+        if peso_input > 0 and altura_input > 0 and edad_input > 0:
+            tmb_calc = calculate_tmb_mifflin(peso_input, altura_input, edad_input, sexo_input)
 
             st.markdown("<br>", unsafe_allow_html=True)
-            st.subheader("Rangos Exactos de Entrenamiento (ppm)")
-            
-            col_z1, col_z2, col_z3 = st.columns(3)
-            
-            col_z1.metric("Zona 1 (50%-60%)", f"{df_zonas.loc['Zona 1: Muy Ligera']['Mínimo (ppm)']} - {df_zonas.loc['Zona 1: Muy Ligera']['Máximo (ppm)']} ppm")
-            col_z1.metric("Zona 2 (60%-70%)", f"{df_zonas.loc['Zona 2: Ligera']['Mínimo (ppm)']} - {df_zonas.loc['Zona 2: Ligera']['Máximo (ppm)']} ppm")
-            col_z2.metric("Zona 3 (70%-80%)", f"{df_zonas.loc['Zona 3: Aeróbica']['Mínimo (ppm)']} - {df_zonas.loc['Zona 3: Aeróbica']['Máximo (ppm)']} ppm")
-            col_z2.metric("Zona 4 (80%-90%)", f"{df_zonas.loc['Zona 4: Umbral']['Mínimo (ppm)']} - {df_zonas.loc['Zona 4: Umbral']['Máximo (ppm)']} ppm")
-            col_z3.metric("Zona 5 (90%-100%)", f"{df_zonas.loc['Zona 5: Máxima']['Mínimo (ppm)']} - {df_zonas.loc['Zona 5: Máxima']['Máximo (ppm)']} ppm")
+            st.metric(
+                "Tasa Metabólica Basal (TMB)", 
+                f"**{tmb_calc} kcal/día** (Fórmula de Mifflin-St Jeor)"
+            )
 
-        # --- Fin de la lógica del gráfico ---
-    else:
-        st.info("No se puede calcular la FC Máx. Asegúrate de que la columna 'Edad' esté registrada en tu perfil.")
+            st.markdown("---")
+            st.subheader("2. Gasto Calórico Total y Objetivos")
 
-    st.markdown("---")
-    
-    # --- MÓDULO 3: ESTIMACIÓN VAM Y RITMOS ---
-    st.subheader("3. Estimador de Ritmo de Carrera (VAM)")
-    
-    col_dist, col_min, col_sec = st.columns(3)
+            col_act, col_obj = st.columns(2)
 
-    with col_dist:
-        test_dist = st.number_input("Distancia Total de la Prueba (metros):", min_value=100, value=2000, step=100, key='acond_dist')
-    
-    with col_min:
-        test_minutes = st.number_input("Tiempo de Prueba: Minutos:", min_value=0, value=7, step=1, key='acond_min')
-        
-    with col_sec:
-        test_seconds = st.number_input("Tiempo de Prueba: Segundos:", min_value=0, max_value=59, value=30, step=5, key='acond_sec')
+            act_factors = FACTORES_ACTIVIDAD
 
-    total_seconds = (test_minutes * 60) + test_seconds
-    
-    if total_seconds > 0 and test_dist > 0:
-        v_ms = test_dist / total_seconds
-        v_kmh = v_ms * 3.6
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-        st.metric("VAM Estimada", f"**{v_kmh:.2f} km/h**")
-        
-        st.markdown("---")
-        st.subheader("Ritmos de Carrera para Acondicionamiento:")
-        
-        ritmos = pd.DataFrame({
-            '% VAM': [100, 95, 90, 85, 80],
-            'Velocidad (km/h)': [v_kmh, v_kmh * 0.95, v_kmh * 0.90, v_kmh * 0.85, v_kmh * 0.80]
-        })
-        
-        def kmh_to_min_km(kmh):
-            if kmh == 0: return "N/D"
-            min_per_km = 60 / kmh
-            minutes = int(min_per_km)
-            seconds = int((min_per_km - minutes) * 60)
-            return f"{minutes}:{seconds:02d}"
-
-        ritmos['Ritmo (min/km)'] = ritmos['Velocidad (km/h)'].apply(kmh_to_min_km)
-        ritmos['Velocidad (km/h)'] = ritmos['Velocidad (km/h)'].round(2)
-        
-        st.dataframe(ritmos.set_index('% VAM'), use_container_width=True)
-    else:
-        st.info("Ingresa los datos de la prueba para calcular el VAM.")
+            with col_act:
+                factor_label = st.selectbox(
+                    "Nivel de Actividad:",
+                    options=list(act_factors.keys()),
+                    key='gestion_act_input'
+                )
+                factor_actividad = act_factors[factor_label] 
 
+            obj_factors = OBJETIVOS_PESO
 
-# ----------------------------------------------------------------------------------
-## PESTAÑA 6: GESTIÓN DE PESO (NUEVA PESTAÑA)
-# ----------------------------------------------------------------------------------
+            with col_obj:
+                objetivo_label = st.selectbox(
+                    "Objetivo de Peso:",
+                    options=list(obj_factors.keys()),
+                    key='gestion_obj_input'
+                )
+                objetivo_calorico = obj_factors[objetivo_label]
 
-with GESTION_PESO_TAB:
-    st.header("⚖️ Gestión de Peso y Nutrición")
-    
-    datos_perfil = df_perfiles[df_perfiles['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_perfiles['Atleta'].values else None
-    datos_rm = df_atletas[df_atletas['Atleta'] == atleta_actual].iloc[0] if atleta_actual in df_atletas['Atleta'].values else None
+            get_calc = round(tmb_calc * factor_actividad) 
+            calorias_objetivo = get_calc + objetivo_calorico
 
-    peso_kg = datos_rm.get('PesoCorporal', 0) if datos_rm is not None else 0
-    altura_cm = datos_perfil.get('Altura_cm', 0) if datos_perfil is not None else 0
-    edad_anos = pd.to_numeric(datos_perfil.get('Edad', 0), errors='coerce', downcast='integer') if datos_perfil is not None else 0
-    sexo = datos_perfil.get('Sexo', 'Hombre') if datos_perfil is not None else 'Hombre'
+            st.metric(
+                "Gasto Energético Total (GET)",
+                f"{get_calc} kcal/día"
+            )
+            st.metric(
+                "Objetivo Calórico Diario",
+                f"**{calorias_objetivo} kcal/día**"
+            )
 
+            ritmo_esperado = ritmo_objetivo_kg_sem(objetivo_label)
+            if resumen_atleta is not None and pd.notna(resumen_atleta['Ritmo_kg_sem']):
+                desvio_ritmo = resumen_atleta['Ritmo_kg_sem'] - ritmo_esperado
+                st.metric(
+                    "Ritmo Real vs Objetivo",
+                    f"{resumen_atleta['Ritmo_kg_sem']:+.2f} kg/sem",
+                    delta=f"{desvio_ritmo:+.2f} kg/sem vs {ritmo_esperado:+.2f} esperado",
+                    delta_color='off'
+                )
+                if abs(desvio_ritmo) > 0.25:
+                    st.warning("Tu ritmo de cambio de peso se aleja del objetivo: revisa la ingesta o el nivel de actividad.")
 
-    st.subheader("1. Cálculo de Tasa Metabólica Basal (TMB)")
-    
-    col_peso, col_alt, col_edad_sexo = st.columns(3)
-    
-    with col_peso:
-        peso_input = st.number_input(
-            "Peso Corporal (kg):", 
-            min_value=0.0, 
-            value=float(peso_kg) if pd.notna(peso_kg) and peso_kg > 0 else 70.0, 
-            step=0.5,
-            key='gestion_peso_input' 
-        )
-    with col_alt:
-        altura_input = st.number_input(
-            "Altura (cm):", 
-            min_value=0.0, 
-            value=float(altura_cm) if pd.notna(altura_cm) and altura_cm > 0 else 175.0, 
-            step=1.0,
-            key='gestion_altura_input' 
-        )
-    with col_edad_sexo:
-        edad_input = st.number_input(
-            "Edad (años):", 
-            min_value=1, 
-            value=int(edad_anos) if pd.notna(edad_anos) and edad_anos > 0 else 25, 
-            step=1,
-            key='gestion_edad_input' 
-        )
-        sexo_input = st.selectbox("Sexo:", options=['Hombre', 'Mujer'], index=0 if sexo == 'Hombre' else 1, key='gestion_sexo_input')
-        
-    
-    if peso_input > 0 and altura_input > 0 and edad_input > 0:
-        tmb_calc = calculate_tmb_mifflin(peso_input, altura_input, edad_input, sexo_input)
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-        st.metric(
-            "Tasa Metabólica Basal (TMB)", 
-            f"**{tmb_calc} kcal/día** (Fórmula de Mifflin-St Jeor)"
+            st.markdown("---")
+            st.subheader("3. Hidratación Sugerida 💧")
+
+            agua_litros = round(peso_input * 0.035, 1) 
+
+            st.metric(
+                "Agua Sugerida",
+                f"**{agua_litros} Litros/día** (35 ml por kg de peso)"
+            )
+
+            st.caption("Ajustar este valor al alza en días de entrenamiento intenso o calor.")
+
+        else:
+            st.warning("Ingresa tu Peso, Altura y Edad en tu Perfil para calcular tus métricas nutricionales.")
+
+        # --- Plan de corte de peso hacia la próxima competición ---
+        version_peso_equipo = (
+            version_pesajes,
+            version_archivo(ruta_equipo(PERFILES_FILE, equipo_actual)),
+            version_archivo(ruta_equipo(EXCEL_FILE, equipo_actual)),
         )
+        version_calendario = version_archivo(ruta_equipo(CALENDAR_FILE, equipo_actual))
+        indice_comp = indice_competencias(df_calendario_full, equipo_actual, version_calendario)
+        hoy_peso = datetime.now().date()
+        # El plan de corte necesita al menos un día: se busca la próxima competición a partir de mañana
+        fecha_prox_comp, evento_prox_comp = proxima_competencia(indice_comp, hoy_peso + timedelta(days=1))
+
+        division_atleta = datos_perfil.get('Division') if datos_perfil is not None else None
+        if pd.notna(division_atleta) and division_atleta:
+            st.markdown("---")
+            st.subheader("4. Plan de Corte de Peso (División)")
+            if fecha_prox_comp is not None:
+                st.caption(f"Próxima competición: **{evento_prox_comp}** ({fecha_prox_comp.strftime('%Y-%m-%d')}).")
+            fecha_corte = st.date_input(
+                "Fecha del pesaje oficial:",
+                value=fecha_prox_comp or hoy_peso + timedelta(days=28),
+                min_value=hoy_peso + timedelta(days=1),
+                key='corte_fecha_atleta'
+            )
+            factor_plan = FACTORES_ACTIVIDAD.get(st.session_state.get('gestion_act_input'), FACTORES_ACTIVIDAD["Moderado (ejercicio 3-5 días/sem)"])
+            df_tmb_plan = calcular_tmb_equipo(df_perfiles, df_atletas, df_resumen_peso, equipo_actual, version_peso_equipo, factor_plan)
+            df_plan_corte, df_tray_corte = planificar_cortes_peso(df_tmb_plan, equipo_actual, (version_peso_equipo, factor_plan), hoy_peso, fecha_corte)
+            plan_atleta = df_plan_corte[df_plan_corte['Atleta'] == atleta_actual]
 
+            if plan_atleta.empty:
+                st.info("Registra tu peso y tu División (p. ej. '60 kg') en el perfil para generar el plan.")
+            else:
+                plan_atleta = plan_atleta.iloc[0]
+                col_lim, col_exc, col_rit, col_kcal = st.columns(4)
+                col_lim.metric("Límite División", f"{plan_atleta['Límite (kg)']:.1f} kg")
+                col_exc.metric("Exceso Actual", f"{plan_atleta['Exceso (kg)']:.1f} kg")
+                col_rit.metric("Ritmo Necesario", f"{plan_atleta['Ritmo (kg/sem)']:.2f} kg/sem", delta=f"{plan_atleta['Ritmo (% peso/sem)']:.2f}% del peso", delta_color='off')
+                col_kcal.metric("Kcal Objetivo", f"{plan_atleta['Kcal Objetivo']:.0f} kcal/día" if pd.notna(plan_atleta['Kcal Objetivo']) else "N/D")
+                estado_corte = plan_atleta['Estado']
+                if 'No seguro' in estado_corte or 'TMB' in estado_corte:
+                    st.error(f"{estado_corte}: el ritmo de corte supera el {CORTE_MAX_PCT_SEM}% del peso por semana o exige comer por debajo de la TMB. Considera subir de división o adelantar la preparación.")
+                elif 'Agresivo' in estado_corte:
+                    st.warning(f"{estado_corte}: ritmo entre {CORTE_SEGURO_PCT_SEM}% y {CORTE_MAX_PCT_SEM}% del peso por semana.")
+                else:
+                    st.success(estado_corte)
+                st.line_chart(df_tray_corte[df_tray_corte['Atleta'] == atleta_actual].set_index('Fecha')['Peso Plan (kg)'], use_container_width=True)
+
+        if rol_actual == 'Entrenador':
+            st.markdown("---")
+            with st.expander("👥 Peso y Nutrición del Equipo (Vista Entrenador)"):
+                factor_equipo_label = st.selectbox("Nivel de actividad del grupo:", list(FACTORES_ACTIVIDAD), index=2, key='equipo_factor_actividad')
+                df_tmb_equipo = calcular_tmb_equipo(
+                    df_perfiles, df_atletas, df_resumen_peso, equipo_actual, version_peso_equipo,
+                    FACTORES_ACTIVIDAD[factor_equipo_label]
+                )
+                st.caption("Peso de tendencia (o 'PesoCorporal' si no hay pesajes). 'Margen División' > 0 indica kilos por encima del límite de la división.")
+                st.dataframe(df_tmb_equipo, use_container_width=True, hide_index=True)
+
+                st.markdown("**Planificador de Corte de Peso**")
+                if fecha_prox_comp is not None:
+                    st.caption(f"Próxima competición en el calendario: **{evento_prox_comp}** ({fecha_prox_comp.strftime('%Y-%m-%d')}).")
+                else:
+                    st.caption("No hay competiciones próximas en el calendario (eventos con 'Torneo', 'Campeonato', 'Copa'...). Elige la fecha manualmente.")
+                fecha_corte_equipo = st.date_input(
+                    "Fecha del pesaje oficial:",
+                    value=fecha_prox_comp or hoy_peso + timedelta(days=28),
+                    min_value=hoy_peso + timedelta(days=1),
+                    key='corte_fecha_equipo'
+                )
+                df_plan_equipo, _ = planificar_cortes_peso(
+                    df_tmb_equipo, equipo_actual, (version_peso_equipo, FACTORES_ACTIVIDAD[factor_equipo_label]), hoy_peso, fecha_corte_equipo
+                )
+                no_seguros = int(df_plan_equipo['Estado'].str.contains('No seguro|TMB').sum())
+                if no_seguros:
+                    st.error(f"{no_seguros} atleta(s) con un corte no seguro para esa fecha.")
+                st.dataframe(df_plan_equipo, use_container_width=True, hide_index=True)
+
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 7: RECUPERACIÓN (DIAGNÓSTICO DE SESIÓN)
+    # ----------------------------------------------------------------------------------
+
+    with RECUPERACION_TAB, medir_tiempo('tab.recuperacion'):
+        st.header("🌡️ Protocolos de Recuperación y Movilidad")
+        st.caption("Herramientas de diagnóstico y guía para optimizar tu estado físico.")
         st.markdown("---")
-        st.subheader("2. Gasto Calórico Total y Objetivos")
-        
-        col_act, col_obj = st.columns(2)
-        
-        act_factors = {
-            "Sedentario (poco o ningún ejercicio)": 1.2,
-            "Ligero (ejercicio 1-3 días/sem)": 1.375,
-            "Moderado (ejercicio 3-5 días/sem)": 1.55,
-            "Alto (ejercicio 6-7 días/sem)": 1.725,
-            "Muy Alto (entrenamientos 2 veces/día)": 1.9
-        }
-        
-        with col_act:
-            factor_label = st.selectbox(
-                "Nivel de Actividad:",
-                options=list(act_factors.keys()),
-                key='gestion_act_input'
-            )
-            factor_actividad = act_factors[factor_label] 
 
-        obj_factors = {
-            "Mantenimiento": 0,
-            "Definición (Bajar peso)": -500,
-            "Volumen (Subir peso)": 500
-        }
-        
-        with col_obj:
-            objetivo_label = st.selectbox(
-                "Objetivo de Peso:",
-                options=list(obj_factors.keys()),
-                key='gestion_obj_input'
+        # --- MÓDULO 1: DIAGNÓSTICO DE ESTADO SRD (EN VIVO) ---
+        st.subheader("1. Diagnóstico de Recuperación de Sesión (SRD)")
+
+        st.caption("Mueve los deslizadores para obtener una recomendación de intensidad instantánea.")
+
+        col_sleep, col_pain, col_ready = st.columns(3)
+
+        with col_sleep:
+            sueno = st.slider("1. Calidad del Sueño:", min_value=1, max_value=5, value=4, help="1=Pésimo, 5=Excelente", key='session_sueno')
+
+        with col_pain:
+            molestias = st.slider("2. Nivel de Molestias/Dolor:", min_value=1, max_value=5, value=2, help="1=Ninguna, 5=Severa", key='session_molestias')
+            zona_molestia = st.selectbox(
+                "Zona de la molestia:", ['Ninguna'] + REGIONES_CORPORALES, key='session_zona_molestia',
+                help="Si indicas una zona, se abre una lesión en tu registro (si no tienes ya una abierta en esa zona)."
             )
-            objetivo_calorico = obj_factors[objetivo_label]
-            
-        get_calc = round(tmb_calc * factor_actividad) 
-        calorias_objetivo = get_calc + objetivo_calorico
 
-        st.metric(
-            "Gasto Energético Total (GET)",
-            f"{get_calc} kcal/día"
-        )
-        st.metric(
-            "Objetivo Calórico Diario",
-            f"**{calorias_objetivo} kcal/día**"
-        )
+        with col_ready:
+            disposicion = st.slider("3. Disposición para Entrenar:", min_value=1, max_value=5, value=4, help="1=Baja, 5=Alta", key='session_disposicion')
+
+        # Cálculo de la Puntuación Media
+        score = (sueno + (5 - molestias) + disposicion) / 3 
+
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        if score >= 4.0:
+            st.success(f"🟢 **SCORE SRD: {score:.1f}** (Óptimo)")
+            st.markdown("**Recomendación:** Estás en estado óptimo. Sigue tu programación con intensidad.", unsafe_allow_html=True)
+        elif score >= 3.0:
+            st.warning(f"🟡 **SCORE SRD: {score:.1f}** (Adecuado)")
+            st.markdown("**Recomendación:** Estado adecuado. Procede, pero respeta estrictamente los RIR/RPE y reduce el volumen si sientes fatiga.", unsafe_allow_html=True)
+        else:
+            st.error(f"🔴 **SCORE SRD: {score:.1f}** (Bajo)")
+            st.markdown("**Recomendación:** **ALERTA DE FATIGA.** Considera reducir la carga (ej., trabajar con 5% menos de peso) y el volumen.", unsafe_allow_html=True)
+
+        if st.button("💾 Guardar check-in de hoy", key='guardar_checkin_readiness'):
+            _, guardado_checkin = save_readiness_data(atleta_actual, datetime.now().date(), sueno, molestias, disposicion)
+            if guardado_checkin:
+                st.success("✅ Check-in guardado: la Calculadora ajustará tus cargas sugeridas.")
+                if zona_molestia != 'Ninguna' and registrar_molestia_lesion(atleta_actual, datetime.now().date(), zona_molestia, molestias):
+                    st.info(f"🩹 Molestia en **{zona_molestia}** añadida a tu registro de lesiones.")
 
         st.markdown("---")
-        st.subheader("3. Hidratación Sugerida 💧")
-        
-        agua_litros = round(peso_input * 0.035, 1) 
-        
-        st.metric(
-            "Agua Sugerida",
-            f"**{agua_litros} Litros/día** (35 ml por kg de peso)"
-        )
-        
-        st.caption("Ajustar este valor al alza en días de entrenamiento intenso o calor.")
-        
-    else:
-        st.warning("Ingresa tu Peso, Altura y Edad en tu Perfil para calcular tus métricas nutricionales.")
 
+        # --- MÓDULO 2: LESIONES Y MOLESTIAS ---
+        st.subheader("2. Lesiones y Molestias")
 
-# ----------------------------------------------------------------------------------
-## PESTAÑA 7: RECUPERACIÓN (DIAGNÓSTICO DE SESIÓN)
-# ----------------------------------------------------------------------------------
+        if rol_actual == 'Entrenador':
+            st.caption(
+                f"Señales por atleta: racha de ≥{RIESGO_RACHA_MOLESTIAS} check-ins con molestias ≥{RIESGO_MOLESTIAS_ALTAS}, caída del SRD ≥{RIESGO_CAIDA_SRD:g} "
+                f"frente a su base de 28 días, ACWR del volumen > {RIESGO_ACWR_MAX:g} y lesiones abiertas. Solo se recalculan cuando cambian los datos, y entonces solo los atletas afectados."
+            )
+            df_riesgo, recalculados_riesgo = senales_riesgo_equipo(equipo_actual, df_atletas, df_readiness, df_lesiones)
+            col_r_alto, col_r_mod, col_r_recalc = st.columns(3)
+            col_r_alto.metric("🔴 Riesgo alto", int((df_riesgo['Riesgo'] == '🔴 Alto').sum()))
+            col_r_mod.metric("🟡 Riesgo moderado", int((df_riesgo['Riesgo'] == '🟡 Moderado').sum()))
+            col_r_recalc.metric("Atletas recalculados", f"{recalculados_riesgo} / {len(df_riesgo)}")
+
+            solo_alertas = st.toggle("Mostrar solo atletas con señales", value=True, key='riesgo_solo_alertas')
+            st.dataframe(
+                df_riesgo[df_riesgo['Señales'] > 0] if solo_alertas else df_riesgo,
+                use_container_width=True, hide_index=True,
+                column_config={"Último check-in": st.column_config.DateColumn("Último check-in", format="YYYY-MM-DD")}
+            )
 
-with RECUPERACION_TAB:
-    st.header("🌡️ Protocolos de Recuperación y Movilidad")
-    st.caption("Herramientas de diagnóstico y guía para optimizar tu estado físico.")
-    st.markdown("---")
+            col_mapa, col_registro = st.columns([1, 2])
+            with col_mapa:
+                st.markdown("**Mapa por región corporal**")
+                st.bar_chart(mapa_regiones(df_lesiones)[['Abiertas']], horizontal=True, use_container_width=True)
+            with col_registro:
+                st.markdown("**Registro de lesiones**")
+                df_lesiones_editor = a_objeto(df_lesiones)
+                df_lesiones_editado = st.data_editor(
+                    df_lesiones_editor,
+                    num_rows="dynamic", hide_index=True, use_container_width=True, key='lesiones_editor',
+                    column_config={
+                        "Atleta": st.column_config.SelectboxColumn("Atleta", options=df_atletas['Atleta'].dropna().astype(str).tolist(), required=True),
+                        "Region": st.column_config.SelectboxColumn("Región", options=REGIONES_CORPORALES, required=True),
+                        "Severidad": st.column_config.NumberColumn("Severidad", min_value=1, max_value=5, step=1, help="1=Leve, 5=Severa"),
+                        "Inicio": st.column_config.DateColumn("Inicio", format="YYYY-MM-DD", required=True),
+                        "Estado": st.column_config.SelectboxColumn("Estado", options=ESTADOS_LESION, default='Activa'),
+                    }
+                )
+                if st.button("💾 Guardar Registro de Lesiones", key='guardar_lesiones_btn'):
+                    resultado_lesiones = guardar_cambios_editor('lesiones', df_lesiones, df_lesiones_editor, df_lesiones_editado, 'lesiones_editor')
+                    if resultado_lesiones is None:
+                        st.info("No hay cambios para guardar.")
+                    elif resultado_lesiones:
+                        st.success("✅ Registro de lesiones actualizado.")
+                        st.rerun()
+                    else:
+                        st.error("❌ No se pudo guardar el registro de lesiones.")
+        else:
+            mis_lesiones = df_lesiones[df_lesiones['Atleta'] == atleta_actual]
+            if mis_lesiones.empty:
+                st.info("No tienes lesiones ni molestias registradas.")
+            else:
+                st.dataframe(
+                    mis_lesiones.drop(columns=['Atleta']), use_container_width=True, hide_index=True,
+                    column_config={"Inicio": st.column_config.DateColumn("Inicio", format="YYYY-MM-DD")}
+                )
 
-    # --- MÓDULO 1: DIAGNÓSTICO DE ESTADO SRD (EN VIVO) ---
-    st.subheader("1. Diagnóstico de Recuperación de Sesión (SRD)")
-    
-    st.caption("Mueve los deslizadores para obtener una recomendación de intensidad instantánea.")
+            with st.form('nueva_lesion_form', clear_on_submit=True):
+                st.markdown("**Reportar una lesión o molestia**")
+                col_l1, col_l2, col_l3 = st.columns(3)
+                region_nueva = col_l1.selectbox("Región:", REGIONES_CORPORALES, key='lesion_region')
+                severidad_nueva = col_l2.slider("Severidad:", 1, 5, 2, help="1=Leve, 5=Severa", key='lesion_severidad')
+                inicio_nuevo = col_l3.date_input("Inicio:", value=datetime.now().date(), key='lesion_inicio')
+                notas_nuevas = st.text_input("Notas (opcional):", key='lesion_notas')
+                if st.form_submit_button("🩹 Reportar"):
+                    nueva_lesion = pd.DataFrame([{
+                        'Atleta': atleta_actual, 'Region': region_nueva, 'Severidad': severidad_nueva,
+                        'Inicio': pd.to_datetime(inicio_nuevo), 'Estado': 'Activa', 'Notas': notas_nuevas or None,
+                    }], columns=LESIONES_REQUIRED_COLUMNS)
+                    if anexar_filas_dataset('lesiones', load_lesiones_data(equipo_actual)[0], nueva_lesion):
+                        st.success("✅ Reporte enviado a tu entrenador.")
 
-    col_sleep, col_pain, col_ready = st.columns(3)
-    
-    with col_sleep:
-        sueno = st.slider("1. Calidad del Sueño:", min_value=1, max_value=5, value=4, help="1=Pésimo, 5=Excelente", key='session_sueno')
-    
-    with col_pain:
-        molestias = st.slider("2. Nivel de Molestias/Dolor:", min_value=1, max_value=5, value=2, help="1=Ninguna, 5=Severa", key='session_molestias')
-        
-    with col_ready:
-        disposicion = st.slider("3. Disposición para Entrenar:", min_value=1, max_value=5, value=4, help="1=Baja, 5=Alta", key='session_disposicion')
-        
-    # Cálculo de la Puntuación Media
-    score = (sueno + (5 - molestias) + disposicion) / 3 
-    
-    st.markdown("<br>", unsafe_allow_html=True)
-    
-    if score >= 4.0:
-        st.success(f"🟢 **SCORE SRD: {score:.1f}** (Óptimo)")
-        st.markdown("**Recomendación:** Estás en estado óptimo. Sigue tu programación con intensidad.", unsafe_allow_html=True)
-    elif score >= 3.0:
-        st.warning(f"🟡 **SCORE SRD: {score:.1f}** (Adecuado)")
-        st.markdown("**Recomendación:** Estado adecuado. Procede, pero respeta estrictamente los RIR/RPE y reduce el volumen si sientes fatiga.", unsafe_allow_html=True)
-    else:
-        st.error(f"🔴 **SCORE SRD: {score:.1f}** (Bajo)")
-        st.markdown("**Recomendación:** **ALERTA DE FATIGA.** Considera reducir la carga (ej., trabajar con 5% menos de peso) y el volumen.", unsafe_allow_html=True)
+        st.markdown("---")
 
-    st.markdown("---")
-    
-    # --- MÓDULO 2: PROTOCOLOS DE GUÍA (Información estática) ---
-    st.subheader("2. Protocolos de Recuperación y Guía de Sueño")
-    st.caption("Guías de referencia para mejorar tu estado actual.")
-    
-    col_crio, col_termo = st.columns(2)
-    
-    with col_crio:
-        st.error("Protocolo de Baño de Hielo (Crioterapia)")
-        st.markdown("""
+        # --- MÓDULO 3: PROTOCOLOS DE GUÍA (Información estática) ---
+        st.subheader("3. Protocolos de Recuperación y Guía de Sueño")
+        st.caption("Guías de referencia para mejorar tu estado actual.")
+
+        col_crio, col_termo = st.columns(2)
+
+        with col_crio:
+            st.error("Protocolo de Baño de Hielo (Crioterapia)")
+            st.markdown("""
         - **Objetivo:** Reducción de la inflamación muscular.
         - **Temperatura:** 10 °C - 15 °C
         - **Duración:** **10 minutos** (Máx 15 min).
         """)
-        
-    with col_termo:
-        st.info("Pautas de Sueño Óptimo")
-        st.markdown("""
+
+        with col_termo:
+            st.info("Pautas de Sueño Óptimo")
+            st.markdown("""
         - **Duración Ideal:** **8 - 10 horas** por noche.
         - **Ambiente:** Oscuro, fresco y silencioso.
         - **Regla Digital:** Evitar pantallas 30 minutos antes de dormir.
         """)
 
-    st.markdown("---")
-    st.subheader("3. Movilidad y Áreas Focales")
-    st.caption("Movilidad diaria para prevenir lesiones en áreas clave de combate.")
-    
-    st.success("""
+        st.markdown("---")
+        st.subheader("4. Movilidad y Áreas Focales")
+        st.caption("Movilidad diaria para prevenir lesiones en áreas clave de combate.")
+
+        st.success("""
     - **Movilidad Dinámica:** Realizar antes de cada entrenamiento para preparar las articulaciones. (Ej: Rotaciones de hombros, balanceos de piernas).
     - **Movilidad Estática:** Realizar *solo* después del entrenamiento o en días de descanso activo.
     - **Foco Principal:** **Caderas** (Flexores y Rotadores) y **Columna Torácica** (Rotación).
     """)
 
 
-# ----------------------------------------------------------------------------------
-## PESTAÑA 8: RANKING (Visible para todos)
-# ----------------------------------------------------------------------------------
-with RANKING_TAB:
-    st.header("🏆 Ranking de Atletas")
-    st.caption("Ordenado por: **Oros > Platas > Bronces**. (Oro=10, Plata=3, Bronce=1)")
-    st.caption(f"Archivo de origen: **{RANKING_FILE}**")
-    
-    # --- Lógica de Podio Visual (TOP 3) ---
-    if not df_ranking.empty:
-        st.markdown("---")
-        st.subheader("🥇 Top 3 Ranking Distrital") 
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 8: RANKING (Visible para todos)
+    # ----------------------------------------------------------------------------------
+    with RANKING_TAB, medir_tiempo('tab.ranking'):
+        st.header("🏆 Ranking de Atletas")
+        st.caption("Ordenado por: **Oros > Platas > Bronces**. (Oro=10, Plata=3, Bronce=1)")
+        st.caption(f"Archivo de origen: **{ruta_equipo(RANKING_FILE, equipo_actual)}**")
 
-        df_top3 = df_ranking.head(3).copy()
-        
-        pos_1 = df_top3[df_top3['Posicion'] == 1].iloc[0] if len(df_top3) >= 1 else None
-        pos_2 = df_top3[df_top3['Posicion'] == 2].iloc[0] if len(df_top3) >= 2 else None
-        pos_3 = df_top3[df_top3['Posicion'] == 3].iloc[0] if len(df_top3) >= 3 else None
-
-        col2, col1, col3 = st.columns([1, 1, 1])
-
-        # POSICIÓN 2 (Plata)
-        with col2:
-            st.markdown("<br><br>", unsafe_allow_html=True) 
-            if pos_2 is not None:
-                st.info(f"**🥈 {pos_2['Atleta']}**")
-                st.markdown(f"<h2 style='text-align: center; color: silver;'>2do Puesto</h2>", unsafe_allow_html=True) 
-                
+        # --- Lógica de Podio Visual (TOP 3) ---
+        if not df_ranking.empty:
+            st.markdown("---")
+            st.subheader("🥇 Top 3 Ranking Distrital") 
+
+            df_top3 = vista_equipo['ranking'].head(3)
+
+            pos_1 = df_top3[df_top3['Posicion'] == 1].iloc[0] if len(df_top3) >= 1 else None
+            pos_2 = df_top3[df_top3['Posicion'] == 2].iloc[0] if len(df_top3) >= 2 else None
+            pos_3 = df_top3[df_top3['Posicion'] == 3].iloc[0] if len(df_top3) >= 3 else None
+
+            col2, col1, col3 = st.columns([1, 1, 1])
+
+            # POSICIÓN 2 (Plata)
+            with col2:
+                st.markdown("<br><br>", unsafe_allow_html=True) 
+                if pos_2 is not None:
+                    st.info(f"**🥈 {pos_2['Atleta']}**")
+                    st.markdown(f"<h2 style='text-align: center; color: silver;'>2do Puesto</h2>", unsafe_allow_html=True) 
+
+                else:
+                     st.info("🥈 ---")
+
+            # POSICIÓN 1 (Oro)
+            with col1:
+                if pos_1 is not None:
+                    st.success(f"**🥇 {pos_1['Atleta']}**")
+                    st.markdown(f"<h1 style='text-align: center; color: gold;'>1er Puesto</h1>", unsafe_allow_html=True)
+                else:
+                     st.success("🥇 ---")
+
+            # POSICIÓN 3 (Bronce)
+            with col3:
+                st.markdown("<br><br><br>", unsafe_allow_html=True) 
+                if pos_3 is not None:
+                    st.error(f"**🥉 {pos_3['Atleta']}**") 
+                    st.markdown(f"<h3 style='text-align: center; color: brown;'>3er Puesto</h3>", unsafe_allow_html=True) 
+                else:
+                     st.error("🥉 ---")
+
+            st.markdown("<br>", unsafe_allow_html=True)
+
+        # --- VISTA DE GESTIÓN (ENTRENADOR) ---
+        if rol_actual == 'Entrenador':
+            st.markdown("---")
+            st.subheader("Gestión de Ranking (Edición Directa)")
+            st.warning("⚠️ **Edita los valores de medallas y categorías. La Posición se recalculará automáticamente al guardar.**")
+
+            df_ranking_edit = tabla_paginada(
+                'tabla_ranking_edit', df_ranking, 'ranking', ruta_equipo(RANKING_FILE, equipo_actual),
+                columna_filtro='Categoria', columnas_orden=['Posicion', 'Atleta', 'Categoria', 'Oros', 'Platas', 'Bronces', 'Puntos']
+            ).drop(columns=['Puntos'], errors='ignore')
+
+            with medir_tiempo('editor.ranking_data_editor'):
+                df_edited_ranking = st.data_editor(
+                    a_objeto(df_ranking_edit),
+                    num_rows="dynamic",
+                    column_config={
+                        "Posicion": st.column_config.NumberColumn("Posición", disabled=True),
+                        "Atleta": st.column_config.TextColumn("Atleta", required=True),
+                        "Categoria": st.column_config.TextColumn("Categoría"),
+                        "Oros": st.column_config.NumberColumn("🥇 Oros"),
+                        "Platas": st.column_config.NumberColumn("🥈 Platas"),
+                        "Bronces": st.column_config.NumberColumn("🥉 Bronces"),
+                    },
+                    use_container_width=True,
+                    key="ranking_data_editor"
+                )
+
+            if st.button("💾 Guardar y Recalcular Ranking", type="primary", key="save_ranking_data_btn"):
+                resultado = guardar_cambios_editor('ranking', df_ranking, df_ranking_edit, df_edited_ranking, 'ranking_data_editor')
+
+                if resultado is None:
+                    st.info("No hay cambios para guardar.")
+                elif resultado:
+                    st.success("✅ Ranking recalculado, ordenado y guardado con éxito. Recargando aplicación...")
+                    st.rerun()
+                else:
+                    st.error("❌ No se pudieron guardar los cambios en el ranking.")
+
+            st.markdown("---")
+            st.subheader("Clasificación Actual")
+        else:
+            st.subheader("Clasificación Completa")
+
+        # --- TABLA COMPLETA (Visible para todos) ---
+        if df_ranking.empty:
+            st.info("No hay datos de ranking para mostrar. El entrenador debe cargar el archivo.")
+        else:
+            cols_to_show = ['Posicion', 'Atleta', 'Categoria', 'Oros', 'Platas', 'Bronces']
+            df_ranking_pagina = tabla_paginada(
+                'tabla_ranking', df_ranking, 'ranking', ruta_equipo(RANKING_FILE, equipo_actual),
+                columna_filtro='Categoria', columnas_orden=cols_to_show
+            )
+
+            st.dataframe(
+                df_ranking_pagina[cols_to_show], 
+                use_container_width=True,
+                column_config={
+                    "Posicion": st.column_config.NumberColumn("Posición", format="%d"),
+                    "Oros": st.column_config.NumberColumn("🥇 Oros", format="%d"),
+                    "Platas": st.column_config.NumberColumn("🥈 Platas", format="%d"),
+                    "Bronces": st.column_config.NumberColumn("🥉 Bronces", format="%d"),
+                },
+                height=35 * (len(df_ranking_pagina) + 1)
+            )
+
+            # Mostrar la posición del atleta actual de forma destacada
+            posiciones = vista_equipo['posiciones']
+            if atleta_actual in posiciones.index:
+                rank_data = posiciones.loc[atleta_actual]
+                st.markdown("---")
+                st.subheader(f"Tu Posición Actual: {atleta_actual}")
+
+                col_rank, col_medals = st.columns(2)
+
+                col_rank.metric("Rango", f"#{int(rank_data['Posicion'])}")
+
+                medals_text = f"🥇 {int(rank_data['Oros'])} | 🥈 {int(rank_data['Platas'])} | 🥉 {int(rank_data['Bronces'])}"
+                col_medals.markdown(f"**Medallas:** <div style='font-size: 1.5em;'>{medals_text}</div>", unsafe_allow_html=True)
+
+            # --- Proyección Monte Carlo de la temporada ---
+            st.markdown("---")
+            st.subheader("🎲 Proyección de la Temporada (Monte Carlo)")
+            fechas_comp, eventos_comp = indice_competencias(df_calendario_full, equipo_actual, version_archivo(ruta_equipo(CALENDAR_FILE, equipo_actual)))
+            proximas_comp = fechas_comp >= np.datetime64(datetime.now().date(), 'D')
+            if proximas_comp.any():
+                st.caption("Próximas competiciones en el calendario: " + ", ".join(f"**{e}** ({pd.Timestamp(f):%d/%m})" for f, e in zip(fechas_comp[proximas_comp], eventos_comp[proximas_comp])))
             else:
-                 st.info("🥈 ---")
+                st.caption("No hay competiciones próximas en el calendario: indica cuántas quedan por disputar.")
+
+            with st.form("simulacion_ranking_form"):
+                col_mc1, col_mc2, col_mc3, col_mc4 = st.columns(4)
+                n_comp_mc = col_mc1.number_input("Competiciones por disputar", min_value=1, max_value=50, value=max(1, int(proximas_comp.sum())))
+                n_prev_mc = col_mc2.number_input(
+                    "Competiciones ya disputadas", min_value=1, max_value=200, value=max(1, int((~proximas_comp).sum())),
+                    help="Base para estimar la probabilidad de medalla de cada atleta por competición (medallas / competiciones)."
+                )
+                n_temp_mc = col_mc3.selectbox("Temporadas simuladas", options=[10000, 50000, MC_TEMPORADAS], index=2)
+                semilla_mc = col_mc4.number_input("Semilla", min_value=0, value=MC_SEMILLA, step=1)
+                if st.form_submit_button("▶️ Simular Temporada"):
+                    st.session_state['mc_parametros'] = (int(n_comp_mc), int(n_prev_mc), int(n_temp_mc), int(semilla_mc))
+
+            if 'mc_parametros' in st.session_state:
+                n_comp_mc, n_prev_mc, n_temp_mc, semilla_mc = st.session_state['mc_parametros']
+                with st.spinner(f"Simulando {n_temp_mc:,} temporadas..."):
+                    df_mc, df_dist_mc = simular_temporadas(
+                        df_ranking, equipo_actual, version_archivo(ruta_equipo(RANKING_FILE, equipo_actual)),
+                        n_comp_mc, n_prev_mc, n_temp_mc, semilla_mc
+                    )
+                st.caption(f"{n_temp_mc:,} temporadas de {n_comp_mc} competiciones (semilla {semilla_mc}). Las probabilidades se estiman con el historial de medallas suavizado hacia la media de la categoría.")
+
+                fila_mc = df_mc[df_mc['Atleta'] == atleta_actual]
+                if not fila_mc.empty:
+                    fila_mc = fila_mc.iloc[0]
+                    col_p1, col_p2, col_p3 = st.columns(3)
+                    col_p1.metric("Tu posición esperada", f"#{fila_mc['Posición Esperada']:.1f}", f"actual #{int(fila_mc['Posición Actual'])}", delta_color="off")
+                    col_p2.metric("P(Podio en tu categoría)", f"{fila_mc['P(Podio Categoría)']:.1f}%")
+                    col_p3.metric("P(1º de tu categoría)", f"{fila_mc['P(1º Categoría)']:.1f}%")
+
+                categorias_mc = ['Todas'] + sorted(df_mc['Categoria'].dropna().astype(str).unique().tolist())
+                categoria_mc = st.selectbox("Categoría:", options=categorias_mc, key='mc_categoria_sel')
+                df_mc_vista = df_mc if categoria_mc == 'Todas' else df_mc[df_mc['Categoria'].astype(str) == categoria_mc]
+                formato_pct = {c: st.column_config.NumberColumn(c, format="%.1f%%") for c in ['P(1º General)', 'P(Top 3 General)', 'P(1º Categoría)', 'P(Podio Categoría)']}
+                st.dataframe(df_mc_vista, use_container_width=True, hide_index=True, column_config=formato_pct)
+
+                if rol_actual == 'Entrenador':
+                    with st.expander("📊 Distribución de la posición final (% de temporadas)"):
+                        st.dataframe(df_dist_mc.loc[df_mc_vista['Atleta']].round(1), use_container_width=True)
+                        st.download_button(
+                            "⬇️ Descargar proyección (CSV)",
+                            data=df_mc.merge(df_dist_mc, left_on='Atleta', right_index=True).to_csv(index=False).encode('utf-8'),
+                            file_name=f"proyeccion_ranking_{datetime.now():%Y%m%d}.csv", mime='text/csv', key='mc_descarga_btn'
+                        )
+
+            # --- Selección óptima de inscripciones (solo entrenador) ---
+            if rol_actual == 'Entrenador':
+                st.markdown("---")
+                st.subheader("🧩 Selección Óptima de Inscripciones")
+                st.caption("Elige a quién inscribir por categoría maximizando el valor esperado por competición (historial de medallas corregido por fuerza relativa = suma de RM / peso corporal). Solución exacta por programación dinámica.")
+
+                col_o1, col_o2, col_o3, col_o4 = st.columns(4)
+                objetivo_insc = col_o1.radio("Maximizar:", ["Puntos esperados (10/3/1)", "Medallas esperadas"], key='insc_objetivo')
+                peso_fuerza_insc = col_o2.slider("Peso de la fuerza relativa", 0.0, 0.5, 0.2, 0.05, key='insc_peso_fuerza')
+                limite_total_insc = col_o3.number_input("Máx. inscritos totales (0 = sin límite)", min_value=0, max_value=1000, value=0, key='insc_limite_total')
+                exigir_division_insc = col_o4.checkbox(
+                    "Solo atletas dentro del límite de su división", key='insc_exigir_division',
+                    help="Excluye a quien no tiene división o peso corporal registrado, o lo tiene por encima del límite de su división."
+                )
+
+                categorias_insc = sorted(df_ranking['Categoria'].astype(object).fillna('Sin categoría').astype(str).str.strip().unique().tolist())
+                df_cupos_insc = st.data_editor(
+                    pd.DataFrame({'Categoria': categorias_insc, 'Cupos': INSCRIPCION_CUPOS_POR_DEFECTO}),
+                    disabled=['Categoria'], hide_index=True, key='insc_cupos_editor',
+                    column_config={"Cupos": st.column_config.NumberColumn("Cupos", min_value=0, step=1)}
+                )
+
+                if st.button("⚙️ Optimizar Inscripciones", key='insc_optimizar_btn'):
+                    df_candidatos_insc = candidatos_inscripcion(
+                        df_ranking, df_atletas, max(1, int((~proximas_comp).sum())), peso_fuerza_insc,
+                        PUNTOS_MEDALLA if objetivo_insc.startswith('Puntos') else np.ones(3), df_perfiles
+                    )
+                    cupos_insc = dict(zip(df_cupos_insc['Categoria'], pd.to_numeric(df_cupos_insc['Cupos'], errors='coerce').fillna(0).astype(int)))
+                    inicio_insc = time_mod.perf_counter()
+                    resultado_insc, valor_insc = optimizar_inscripciones(df_candidatos_insc, cupos_insc, limite_total_insc or None, exigir_division_insc)
+                    st.session_state['insc_resultado'] = (resultado_insc, valor_insc, (time_mod.perf_counter() - inicio_insc) * 1000, objetivo_insc)
+
+                if 'insc_resultado' in st.session_state:
+                    resultado_insc, valor_insc, ms_insc, objetivo_usado = st.session_state['insc_resultado']
+                    inscritos_insc = resultado_insc[resultado_insc['Inscrito']]
+                    excluidos_insc = resultado_insc[resultado_insc['Motivo'] != '']
+                    col_r1, col_r2, col_r3 = st.columns(3)
+                    col_r1.metric("Inscritos", len(inscritos_insc))
+                    col_r2.metric(objetivo_usado.split(' (')[0] + " / competición", f"{valor_insc:.2f}")
+                    col_r3.metric("No elegibles", len(excluidos_insc), f"{ms_insc:.0f} ms", delta_color="off")
+                    sin_peso_insc = excluidos_insc.loc[excluidos_insc['Motivo'] == 'Sin peso registrado', 'Atleta']
+                    if not sin_peso_insc.empty:
+                        st.warning(f"⚠️ {len(sin_peso_insc)} atleta(s) quedaron fuera por no tener peso corporal registrado: {', '.join(sin_peso_insc.astype(str))}.")
+                    st.dataframe(
+                        resultado_insc, use_container_width=True, hide_index=True,
+                        column_config={c: st.column_config.NumberColumn(c, format="%.1f%%") for c in ['P(Oro)', 'P(Plata)', 'P(Bronce)']}
+                    )
+                    st.download_button(
+                        "⬇️ Descargar inscripciones (CSV)", data=inscritos_insc.to_csv(index=False).encode('utf-8'),
+                        file_name=f"inscripciones_{datetime.now():%Y%m%d}.csv", mime='text/csv', key='insc_descarga_btn'
+                    )
+
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 9: RENDIMIENTO DEL SERVIDOR (Solo Entrenador)
+    # ----------------------------------------------------------------------------------
+    if rol_actual == 'Entrenador':
+        with RENDIMIENTO_TAB:
+            st.header("⏱️ Rendimiento del Servidor")
+            st.caption(f"Latencias de las últimas {PERF_VENTANA} mediciones por etiqueta, compartidas por todas las sesiones de este proceso.")
+
+            col_reset, col_profile = st.columns(2)
+            with col_reset:
+                if st.button("🔄 Reiniciar Mediciones", key="reset_perf_btn"):
+                    reset_perf_registry()
+                    st.rerun()
+            with col_profile:
+                st.toggle(
+                    "Perfilar cada recarga (cProfile)",
+                    key='perf_profile_activo',
+                    help=f"Vuelca un archivo .prof por recarga de tu sesión en la carpeta '{PERF_PROFILES_DIR}'."
+                )
+
+            df_perf = resumen_latencias()
+
+            if df_perf.empty:
+                st.info("Aún no hay mediciones registradas.")
+            else:
+                st.subheader("1. Resumen de Latencias y Caché")
+                st.dataframe(
+                    df_perf,
+                    use_container_width=True,
+                    column_config={
+                        "Media (ms)": st.column_config.NumberColumn("Media (ms)", format="%.1f"),
+                        "p50 (ms)": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+                        "p95 (ms)": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+                        "Máx (ms)": st.column_config.NumberColumn("Máx (ms)", format="%.1f"),
+                        "% Hit": st.column_config.NumberColumn("% Hit", format="%.1f%%"),
+                    }
+                )
+
+                st.markdown("---")
+                st.subheader("2. Histograma de Latencias")
+                etiqueta_sel = st.selectbox("Etiqueta:", options=df_perf['Etiqueta'].tolist(), key='perf_etiqueta_sel')
+                valores = get_latencias(etiqueta_sel)
 
-        # POSICIÓN 1 (Oro)
-        with col1:
-            if pos_1 is not None:
-                st.success(f"**🥇 {pos_1['Atleta']}**")
-                st.markdown(f"<h1 style='text-align: center; color: gold;'>1er Puesto</h1>", unsafe_allow_html=True)
+                if len(valores) > 0:
+                    conteos, bordes = np.histogram(valores, bins=min(20, max(1, len(valores))))
+                    df_hist = pd.DataFrame({
+                        'Latencia (ms)': [f"{bordes[i]:.1f}-{bordes[i + 1]:.1f}" for i in range(len(conteos))],
+                        'Mediciones': conteos
+                    }).set_index('Latencia (ms)')
+                    st.bar_chart(df_hist, use_container_width=True)
+
+            st.markdown("---")
+            st.subheader("3. Perfiles cProfile Guardados")
+            if os.path.isdir(PERF_PROFILES_DIR):
+                perfiles_guardados = sorted(os.listdir(PERF_PROFILES_DIR), reverse=True)[:20]
             else:
-                 st.success("🥇 ---")
-
-        # POSICIÓN 3 (Bronce)
-        with col3:
-            st.markdown("<br><br><br>", unsafe_allow_html=True) 
-            if pos_3 is not None:
-                st.error(f"**🥉 {pos_3['Atleta']}**") 
-                st.markdown(f"<h3 style='text-align: center; color: brown;'>3er Puesto</h3>", unsafe_allow_html=True) 
+                perfiles_guardados = []
+
+            if perfiles_guardados:
+                perfil_sel = st.selectbox("Archivo:", options=perfiles_guardados, key='perf_archivo_sel')
+                with open(os.path.join(PERF_PROFILES_DIR, perfil_sel), 'rb') as f:
+                    st.download_button("⬇️ Descargar .prof", data=f.read(), file_name=perfil_sel, key='perf_download_btn')
+                st.caption("Ábrelo con `python -m pstats` o `snakeviz`.")
             else:
-                 st.error("🥉 ---")
-        
-        st.markdown("<br>", unsafe_allow_html=True)
+                st.info("No hay perfiles guardados. Activa el perfilado y recarga la aplicación.")
 
-    # --- VISTA DE GESTIÓN (ENTRENADOR) ---
-    if rol_actual == 'Entrenador':
-        st.markdown("---")
-        st.subheader("Gestión de Ranking (Edición Directa)")
-        st.warning("⚠️ **Edita los valores de medallas y categorías. La Posición se recalculará automáticamente al guardar.**")
-        
-        df_edited_ranking = st.data_editor(
-            df_ranking.drop(columns=['Puntos'], errors='ignore'),
-            num_rows="dynamic",
-            column_config={
-                "Posicion": st.column_config.NumberColumn("Posición", disabled=True),
-                "Atleta": st.column_config.TextColumn("Atleta", required=True),
-                "Categoria": st.column_config.TextColumn("Categoría"),
-                "Oros": st.column_config.NumberColumn("🥇 Oros"),
-                "Platas": st.column_config.NumberColumn("🥈 Platas"),
-                "Bronces": st.column_config.NumberColumn("🥉 Bronces"),
-            },
-            use_container_width=True,
-            key="ranking_data_editor"
-        )
-        
-        if st.button("💾 Guardar y Recalcular Ranking", type="primary", key="save_ranking_data_btn"):
-            if save_ranking_data(df_edited_ranking):
-                st.success("✅ Ranking recalculado, ordenado y guardado con éxito. Recargando aplicación...")
-                st.rerun()
+            st.markdown("---")
+            st.subheader("4. Última Carga en Frío de Datasets")
+            carga_frio = ultima_carga_frio()
+            if carga_frio is None:
+                st.info("Todos los datasets se sirvieron desde el registro compartido desde que arrancó el proceso.")
             else:
-                st.error("❌ No se pudieron guardar los cambios en el ranking.")
-        
-        st.markdown("---")
-        st.subheader("Clasificación Actual")
-    else:
-        st.subheader("Clasificación Completa")
+                col_total, col_suma, col_motor = st.columns(3)
+                col_total.metric("Espera total (paralelo)", f"{carga_frio['Total (s)'] * 1000:.0f} ms")
+                col_suma.metric("Suma por archivo", f"{carga_frio['Suma (s)'] * 1000:.0f} ms")
+                col_motor.metric("Motor XLSX", carga_frio['Motor'], f"{carga_frio['Hilos']} hilos", delta_color="off")
+                st.caption(f"Equipo **{carga_frio['Equipo']}**, {carga_frio['Fecha'].strftime('%Y-%m-%d %H:%M:%S')}.")
+                st.dataframe(
+                    pd.DataFrame({'Dataset': list(carga_frio['Por dataset']), 'Tiempo (ms)': [v * 1000 for v in carga_frio['Por dataset'].values()]})
+                    .sort_values('Tiempo (ms)', ascending=False),
+                    use_container_width=True, hide_index=True,
+                    column_config={"Tiempo (ms)": st.column_config.NumberColumn("Tiempo (ms)", format="%.1f")}
+                )
 
-    # --- TABLA COMPLETA (Visible para todos) ---
-    if df_ranking.empty:
-        st.info("No hay datos de ranking para mostrar. El entrenador debe cargar el archivo.")
-    else:
-        cols_to_show = ['Posicion', 'Atleta', 'Categoria', 'Oros', 'Platas', 'Bronces']
-        
-        st.dataframe(
-            df_ranking[cols_to_show], 
-            use_container_width=True,
-            column_config={
-                "Posicion": st.column_config.NumberColumn("Posición", format="%d"),
-                "Oros": st.column_config.NumberColumn("🥇 Oros", format="%d"),
-                "Platas": st.column_config.NumberColumn("🥈 Platas", format="%d"),
-                "Bronces": st.column_config.NumberColumn("🥉 Bronces", format="%d"),
-            },
-            height=35 * (len(df_ranking) + 1)
-        )
+            st.markdown("---")
+            st.subheader("5. Bus de Cambios entre Sesiones")
+            sesiones_bus, df_cambios_bus = resumen_bus_cambios()
+            st.caption(f"Sesiones suscritas: **{int(sesiones_bus.sum())}** · Recarga automática de sesiones: **{'activada' if BUS_RECARGA_SESIONES else 'desactivada'}**.")
+            if df_cambios_bus.empty:
+                st.info("Aún no se ha propagado ningún cambio.")
+            else:
+                st.dataframe(df_cambios_bus, use_container_width=True, hide_index=True)
 
-        # Mostrar la posición del atleta actual de forma destacada
-        current_athlete_rank = df_ranking[df_ranking['Atleta'] == atleta_actual]
-        if not current_athlete_rank.empty:
-            rank_data = current_athlete_rank.iloc[0]
             st.markdown("---")
-            st.subheader(f"Tu Posición Actual: {atleta_actual}")
-            
-            col_rank, col_medals = st.columns(2)
-            
-            col_rank.metric("Rango", f"#{int(rank_data['Posicion'])}")
-            
-            medals_text = f"🥇 {int(rank_data['Oros'])} | 🥈 {int(rank_data['Platas'])} | 🥉 {int(rank_data['Bronces'])}"
-            col_medals.markdown(f"**Medallas:** <div style='font-size: 1.5em;'>{medals_text}</div>", unsafe_allow_html=True)
+            st.subheader("6. Tareas Programadas")
+            st.caption(f"Se ejecutan en segundo plano para todos los equipos habilitados. Las instantáneas se guardan en '{SNAPSHOTS_DIR}' (últimas {SNAPSHOTS_RETENCION}).")
+            st.dataframe(resumen_tareas(), use_container_width=True, hide_index=True)
+
+            col_tarea, col_ejecutar = st.columns([2, 1])
+            with col_tarea:
+                tarea_sel = st.selectbox("Tarea:", options=list(TAREAS_HORARIO), key='tarea_programada_sel')
+            with col_ejecutar:
+                st.markdown("<br>", unsafe_allow_html=True)
+                if st.button("▶️ Ejecutar ahora", key='ejecutar_tarea_btn'):
+                    get_tareas_programadas()['cola'].put(tarea_sel)
+                    st.toast(f"Tarea '{tarea_sel}' encolada. Recarga en unos segundos para ver el resultado.", icon="⏳")
+
+    # ----------------------------------------------------------------------------------
+    ## PESTAÑA 10: CONSOLA DE CONSULTAS SQL (Solo Entrenador)
+    # ----------------------------------------------------------------------------------
+    if rol_actual == 'Entrenador':
+        with CONSULTAS_TAB, medir_tiempo('tab.consultas_sql'):
+            st.header("🔎 Consola de Consultas SQL")
+            st.caption(
+                f"Motor embebido: **{'DuckDB' if MOTOR_SQL == 'duckdb' else 'SQLite'}** · solo lectura · máx. {SQL_MAX_FILAS:,} filas y "
+                f"{SQL_TIEMPO_MAX_S} s por consulta. Los resultados se cachean hasta que cambia alguno de los archivos del equipo."
+            )
+            if MOTOR_SQL != 'duckdb':
+                st.caption("💡 Instala `duckdb` para ejecutar los JOIN y agregaciones pesadas con el motor columnar vectorizado.")
+
+            with st.expander("📚 Tablas disponibles"):
+                st.dataframe(esquema_sql(equipo_actual), use_container_width=True, hide_index=True)
+
+            def _cargar_ejemplo_sql():
+                st.session_state['sql_consulta'] = CONSULTAS_SQL_EJEMPLO[st.session_state['sql_ejemplo']]
+
+            st.selectbox("Consulta de ejemplo:", list(CONSULTAS_SQL_EJEMPLO), key='sql_ejemplo', on_change=_cargar_ejemplo_sql)
+            st.session_state.setdefault('sql_consulta', CONSULTAS_SQL_EJEMPLO[st.session_state['sql_ejemplo']])
+            consulta_sql = st.text_area("Consulta:", key='sql_consulta', height=180)
+
+            if st.button("▶️ Ejecutar Consulta", type="primary", key='sql_ejecutar_btn'):
+                st.session_state['sql_ultima'] = consulta_sql
+
+            if st.session_state.get('sql_ultima'):
+                try:
+                    inicio_sql = time_mod.perf_counter()
+                    df_sql, truncado_sql, segundos_sql = ejecutar_consulta_sql(
+                        normalizar_consulta(st.session_state['sql_ultima']), equipo_actual, versiones_sql(equipo_actual)
+                    )
+                    espera_sql = time_mod.perf_counter() - inicio_sql
+                except Exception as e:
+                    st.error(f"❌ Error en la consulta: {e}")
+                else:
+                    col_sql1, col_sql2, col_sql3 = st.columns(3)
+                    col_sql1.metric("Filas", f"{len(df_sql):,}" + ("+" if truncado_sql else ""))
+                    col_sql2.metric("Ejecución en el motor", f"{segundos_sql * 1000:.1f} ms")
+                    col_sql3.metric("Espera", f"{espera_sql * 1000:.1f} ms", "caché" if espera_sql < segundos_sql else None, delta_color="off")
+                    if truncado_sql:
+                        st.warning(f"El resultado se limitó a {SQL_MAX_FILAS:,} filas. Agrega o filtra en la consulta para verlo completo.")
+                    st.dataframe(df_sql, use_container_width=True, hide_index=True)
+
+                    col_csv, col_parquet = st.columns(2)
+                    with col_csv:
+                        st.download_button(
+                            "⬇️ Descargar CSV", data=df_sql.to_csv(index=False).encode('utf-8'),
+                            file_name=f"consulta_{datetime.now():%Y%m%d_%H%M%S}.csv", mime='text/csv', key='sql_csv_btn'
+                        )
+                    with col_parquet:
+                        if pa is not None:
+                            st.download_button(
+                                "⬇️ Descargar Parquet", data=resultado_a_parquet(df_sql),
+                                file_name=f"consulta_{datetime.now():%Y%m%d_%H%M%S}.parquet", mime='application/octet-stream', key='sql_parquet_btn'
+                            )
+                        else:
+                            st.caption("Instala `pyarrow` para exportar a Parquet.")
+finally:
+    # Cierre de la medición de la recarga completa (también en los caminos de st.stop() y st.rerun())
+    registrar_latencia('rerun.total', time_mod.perf_counter() - inicio_rerun)
+    finalizar_perfilado(perfilador_rerun, st.session_state.get('atleta_nombre'))
 
 
 # --- FIN DEL CÓDIGO ---